@@ -1,22 +1,47 @@
 """
 Script for cleaning, formatting, and processing raw data acquired from running `data_acquisition.py`. It then saves the
-transformed data to a .pkl file as well as persists the TranscriptProcessingPipeline instance as a .pkl to be used to
-transform future text data.
+transformed data as sparse .npz matrices (plus a .json file of vocabulary words) as well as persists the
+TranscriptProcessingPipeline instance as a .pkl to be used to transform future text data, and writes the lexical index
+of the transcripts used for word for word search.
 
 Stephen Kaplan, 2020-08-10
 """
+import json
 import nltk
 import dill as pickle
+from scipy import sparse
 from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 
+from ingest_corpus import PreprocessedTextCache
 from app.db import connect_to_mongo, load_mongo_collection_as_dataframe
-from app.nlp_pipeline import TranscriptProcessingPipeline
+from app.lexical_index import analysis_fingerprint, count_terms, word_analyzer, write_transcript_index
+from app.nlp_pipeline import TranscriptProcessingPipeline, ensure_nltk_data
 from app.creds import USERNAME, PWD
 
 
+def save_vectorized_corpus(vectorized_corpus, feature_names, file_path):
+    """
+    Persists a sparse vectorized corpus to a .npz file and its vocabulary words to a .json file with the same name.
+
+    :param scipy.sparse.csr_matrix vectorized_corpus: Document-term matrix.
+    :param list feature_names: Vocabulary word for each column of the document-term matrix.
+    :param str file_path: Path to the .npz file to create.
+    """
+    sparse.save_npz(file_path, vectorized_corpus)
+    with open(file_path.replace('.npz', '.json'), 'w') as f:
+        json.dump(list(feature_names), f)
+
+
 if __name__ == '__main__':
+    ensure_nltk_data()
+
     db = connect_to_mongo(username=USERNAME, password=PWD)
-    df_transcripts = load_mongo_collection_as_dataframe(db, collection_name='transcripts')
+    df_transcripts = load_mongo_collection_as_dataframe(db, collection_name='transcripts', fields=['comedyId', 'text'])
+    # rows of the vectorized corpus are in comedyId order, which is how modeling.py lines them up with the metadata
+    df_transcripts = df_transcripts.sort_values('comedyId').reset_index(drop=True)
+
+    # transcripts that haven't changed since the last run are not cleaned and lemmatized again
+    preprocessed_cache = PreprocessedTextCache('data/preprocessed_transcripts.sqlite3')
 
     pipeline_cv = TranscriptProcessingPipeline(
         tokenizer=nltk.word_tokenize,
@@ -24,16 +49,31 @@ if __name__ == '__main__':
         lemmatizer=nltk.stem.WordNetLemmatizer,
         vectorizer=CountVectorizer
     )
-    data_cv = pipeline_cv.fit_transform(df_transcripts['text'].to_list())
-    data_cv.to_pickle('data/count_vectorized_standup_comedy_transcripts.pkl')
-
     pipeline_tfidf = TranscriptProcessingPipeline(
         tokenizer=nltk.word_tokenize,
         stemmer=nltk.stem.PorterStemmer,
         lemmatizer=nltk.stem.WordNetLemmatizer,
         vectorizer=TfidfVectorizer
     )
-    data_tfidf = pipeline_tfidf.fit_transform(df_transcripts['text'].to_list())
-    data_tfidf.to_pickle('data/tfidf_standup_comedy_transcripts.pkl')
+
+    # both pipelines clean and lemmatize the same way, so preprocess the transcripts once (on every CPU) and fit both
+    # vectorizers to the result
+    preprocessed_transcripts = pipeline_tfidf.preprocess(df_transcripts['text'].to_list(), cache=preprocessed_cache,
+                                                         n_jobs=-1)
+
+    data_cv = pipeline_cv.fit_transform_preprocessed(preprocessed_transcripts, sparse=True)
+    save_vectorized_corpus(data_cv, pipeline_cv.vectorizer.get_feature_names(),
+                           'data/count_vectorized_standup_comedy_transcripts.npz')
+
+    data_tfidf = pipeline_tfidf.fit_transform_preprocessed(preprocessed_transcripts, sparse=True)
+    save_vectorized_corpus(data_tfidf, pipeline_tfidf.vectorizer.get_feature_names(),
+                           'data/tfidf_standup_comedy_transcripts.npz')
 
     pickle.dump(pipeline_tfidf, open('../app/static/ml_models/tfidf_pipeline.pkl', 'wb'))
+
+    # index every word of the transcripts (not just the pipeline's vocabulary) for lexical search in the flask app. the
+    # words are split out the same way as the pipeline's, since the app preprocesses search terms with it
+    vocabulary = {}
+    counts = count_terms(word_analyzer(pipeline_tfidf), preprocessed_transcripts, vocabulary)
+    write_transcript_index('../app/static/ml_models/lexical_index', counts, df_transcripts['comedyId'].to_list(),
+                           vocabulary, analysis_fingerprint(pipeline_tfidf))
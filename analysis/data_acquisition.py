@@ -3,17 +3,30 @@ Contains functions for scraping stand-up comedy transcripts from https://scrapsf
 If this file is run as a script, will scrape comedy transcripts, create 2 related dataframes (transcripts and metadata),
 and persist them to .pkl files in a local folder `data`.
 
+Pages are fetched concurrently over pooled connections, rate limited per host, retried on failure and cached on disk in
+`data/http_cache`. Finished comedy specials are checkpointed to `data/scrape_checkpoint.jsonl`, so re-running after a
+crash only fetches what is left. The sites scraped can be pointed elsewhere (e.g. a local server with fixture pages)
+with the TRANSCRIPTS_INDEX_URL and OMDB_API_URL environment variables.
+
 Stephen Kaplan, 2020-08-10
 """
-import requests
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
 import re
 import pandas as pd
 import string
-import json
 
+from http_fetcher import Checkpoint, Fetcher
 from app.creds import OMDB_API_KEY
 
+TRANSCRIPTS_INDEX_URL = os.environ.get('TRANSCRIPTS_INDEX_URL',
+                                       'https://scrapsfromtheloft.com/stand-up-comedy-scripts/')
+OMDB_API_URL = os.environ.get('OMDB_API_URL', 'https://omdbapi.com/')
+
+# shared by everything that doesn't get a fetcher passed in, so connections are pooled across calls
+_default_fetcher = None
+
 MANUAL_IMAGE_REPLACEMENTS = {
     "Patton Oswalt - I Love Everything": "https://m.media-amazon.com/images/M/MV5BNTAxNDk5OTMtNDZiYy00NDc5LWJmYTgt"
                                          "OWM4NTg3MDIyZTg4XkEyXkFqcGdeQXVyMTMxODk2OTU@._V1_.jpg",
@@ -89,51 +102,65 @@ MANUAL_IMAGE_REPLACEMENTS = {
 }
 
 
-def get_all_comedy_transcript_elements():
+def get_default_fetcher():
+    """
+    :return: Fetcher without a disk cache, shared by calls that aren't given one.
+    :rtype: Fetcher
+    """
+    global _default_fetcher
+    if _default_fetcher is None:
+        _default_fetcher = Fetcher()
+
+    return _default_fetcher
+
+
+def get_all_comedy_transcript_elements(fetcher=None):
     """
     Returns all elements on the page that contain the titles of and href's to each stand-up comedy transcript.
 
+    :param Fetcher fetcher: Fetcher used for HTTP requests. Defaults to a shared fetcher without a disk cache.
     :return: HTML elements for all stand-up comedy transcripts on the page.
     :rtype: list
     """
-    response = requests.get('https://scrapsfromtheloft.com/stand-up-comedy-scripts/')
-    soup = BeautifulSoup(response.content, 'html.parser')
+    fetcher = fetcher or get_default_fetcher()
+
+    # the list of transcripts changes as new ones are posted, so never use a cached copy
+    soup = BeautifulSoup(fetcher.fetch(TRANSCRIPTS_INDEX_URL, use_cache=False), 'html.parser')
     parsing_results = soup.find_all('a', class_='title')
 
     return list(parsing_results)
 
 
-def get_image_url(comedian, title, year):
+def get_image_url(comedian, title, year, fetcher=None):
     """
     Returns a public URL to the "movie poster" for a given comedy special. Due to the inconsistency in availability
-    of these images, this function tries a few methods: Searches the OMDB API by title, searches the OMDB API by
-    comedian, checks the static/images directory, and checks a lookup table containing image URLs.
+    of these images, this function tries a few methods: Checks a lookup table containing image URLs, searches the OMDB
+    API by title, searches the OMDB API by comedian, and finally falls back to the static/images directory. The OMDB API
+    is only queried if the earlier methods didn't find an image.
 
     :param str comedian: Name of the comedian.
     :param title: Title of the stand-up comedy special
     :param year: Release year for the standup comedy special.
+    :param Fetcher fetcher: Fetcher used for HTTP requests. Defaults to a shared fetcher without a disk cache.
     :return: Public URL to a relevant movie poster/graphic for the comedy special.
     :rtype: str
     """
+    # insert image URL manually if in lookup table above
+    if f'{comedian} - {title}' in MANUAL_IMAGE_REPLACEMENTS:
+        return MANUAL_IMAGE_REPLACEMENTS[f'{comedian} - {title}']
+
+    fetcher = fetcher or get_default_fetcher()
     title_formatted = title.replace(' ', '+').replace("’", '%27').replace('.', '%2E')
     comedian_formatted = comedian.replace(' ', '+').replace("’", '%27').replace('.', '%2E')
 
-    # search by both title and comedian in case one works and the other doesn't
-    response_title = requests.get(url=f'https://omdbapi.com/?t={title_formatted}&y={year}&apikey={OMDB_API_KEY}')
-    response_comedian = requests.get(url=f'https://omdbapi.com/?t={comedian_formatted}&y={year}&apikey={OMDB_API_KEY}')
+    # search by title, then by comedian in case the title doesn't work
+    for query in [title_formatted, comedian_formatted]:
+        response = fetcher.fetch_json(f'{OMDB_API_URL}?t={query}&y={year}&apikey={OMDB_API_KEY}')
+        if 'Poster' in response:
+            return response['Poster']
 
-    # insert image URL manually if in lookup table above
-    try:
-        image_url = MANUAL_IMAGE_REPLACEMENTS[f'{comedian} - {title}']
-    except KeyError:
-        if 'Poster' in json.loads(response_title.content):                  # try searching OMDB API with title
-            image_url = json.loads(response_title.content)['Poster']
-        elif 'Poster' in json.loads(response_comedian.content):             # try searching OMDB API with comedian
-            image_url = json.loads(response_comedian.content)['Poster']
-        else:                                                               # use static image file
-            image_url = f'static/images/{comedian} - {title}.jpg'
-
-    return image_url
+    # use static image file
+    return f'static/images/{comedian} - {title}.jpg'
 
 
 def replace_if_title_does_not_begin_with(text, incorrect_fragment, replacement):
@@ -228,15 +255,15 @@ def custom_format(comedian, title):
     return formatted[0], formatted[1]
 
 
-def parse_comedy_metadata(raw_title):
+def parse_comedy_title(raw_title):
     """
-    Attempts to parse comedian name, comedy special title, and year from raw text. Returns None if unable to parse
-    using that regular expression, indicating that it is a title for a non-standard comedy special. Also returns None
-    if the transcript is not in English.
+    Attempts to parse comedian name, comedy special title, and year from raw text, without looking anything up online.
+    Returns None if unable to parse using that regular expression, indicating that it is a title for a non-standard
+    comedy special. Also returns None if the transcript is not in English.
 
     :param str raw_title: Raw title containing multiple pieces of information from list of transcripts on page.
-    :return: Metadata (Comedian name, comedy special title, and year performed).
-    :rtype: dict
+    :return: Comedian name, comedy special title, and year performed.
+    :rtype: tuple
     """
     # define standard regex matching format for comedy titles
     regex_matches = re.match(r'(.+):\s(.+)\s\((\d+)\)', raw_title)
@@ -259,68 +286,146 @@ def parse_comedy_metadata(raw_title):
         comedian, title = custom_format(comedian, title)                       # to handle special cases and errors
 
         year = int(regex_matches.group(3))
-        return {
-            'Comedian': comedian,
-            'Title': title,
-            'Year': year,
-            'ImageURL': get_image_url(comedian, title, year)
-        }
+        return comedian, title, year
 
 
-def parse_comedy_transcript(transcript_url):
+def parse_comedy_metadata(raw_title, fetcher=None):
+    """
+    Attempts to parse comedian name, comedy special title, and year from raw text, and looks up a poster image. Returns
+    None if the title can't be parsed (see `parse_comedy_title`).
+
+    :param str raw_title: Raw title containing multiple pieces of information from list of transcripts on page.
+    :param Fetcher fetcher: Fetcher used to look up the poster image.
+    :return: Metadata (Comedian name, comedy special title, and year performed).
+    :rtype: dict
+    """
+    parsed_title = parse_comedy_title(raw_title)
+    if parsed_title is None:
+        return None
+
+    comedian, title, year = parsed_title
+    return {
+        'Comedian': comedian,
+        'Title': title,
+        'Year': year,
+        'ImageURL': get_image_url(comedian, title, year, fetcher=fetcher)
+    }
+
+
+def parse_comedy_transcript(transcript_url, fetcher=None):
     """
     Parses an individual comedy transcript.
 
     :param str transcript_url: URL to page containing transcript
+    :param Fetcher fetcher: Fetcher used for HTTP requests. Defaults to a shared fetcher without a disk cache.
     :return: Full raw transcript.
     :rtype: str
     """
+    fetcher = fetcher or get_default_fetcher()
+
     # navigate to page containing transcript and parse entire thing
-    response = requests.get(transcript_url)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    soup = BeautifulSoup(fetcher.fetch(transcript_url), 'html.parser')
     transcript = soup.find('div', class_='post-content').text
 
     return transcript
 
 
-def parse_comedy_metadata_and_transcripts(comedy_transcript_elements):
+def parse_comedy_special(raw_title, transcript_url, fetcher=None):
     """
-    Main parsing function.
+    Parses the metadata and transcript of one comedy special.
+
+    :param str raw_title: Raw title from the list of transcripts.
+    :param str transcript_url: URL to page containing transcript.
+    :param Fetcher fetcher: Fetcher used for HTTP requests.
+    :return: Metadata dictionary and raw transcript, or None if this isn't a standard comedy special (see
+             `parse_comedy_metadata`).
+    :rtype: tuple
+    """
+    m = parse_comedy_metadata(raw_title, fetcher=fetcher)
+    if m is None:
+        return None
+
+    return m, parse_comedy_transcript(transcript_url, fetcher=fetcher)
+
+
+def parse_comedy_metadata_and_transcripts(comedy_transcript_elements, fetcher=None, checkpoint=None, max_workers=8):
+    """
+    Main parsing function. Comedy specials are fetched and parsed concurrently, but returned in page order.
 
     :param list comedy_transcript_elements: HTML elements for all stand-up comedy transcripts on the page.
+    :param Fetcher fetcher: Fetcher used for HTTP requests. Defaults to a shared fetcher without a disk cache.
+    :param Checkpoint checkpoint: If given, comedy specials it has already recorded are skipped, and every newly parsed
+                                  one is recorded as soon as it's done.
+    :param int max_workers: Number of comedy specials fetched at the same time.
     :return: List of dictionaries containing parsed metadata and list of parased transcript strings.
     :rtype: tuple
     """
+    fetcher = fetcher or get_default_fetcher()
+    items = [(element.text, element['href']) for element in comedy_transcript_elements]
+
+    def parse(raw_title, transcript_url):
+        result = parse_comedy_special(raw_title, transcript_url, fetcher=fetcher)
+        if checkpoint is not None:
+            checkpoint.record(transcript_url, result)
+        return result
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for raw_title, transcript_url in items:
+            if checkpoint is not None and transcript_url in checkpoint:
+                results[transcript_url] = checkpoint[transcript_url]
+            else:
+                futures[executor.submit(parse, raw_title, transcript_url)] = transcript_url
+
+        try:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        except BaseException:
+            # stop fetching anything else; whatever finished is already in the checkpoint
+            for future in futures:
+                future.cancel()
+            raise
+
     parsed_metadata = []
     transcripts = []
-    # loops through each HTML element containing comedy transcript metadata text and link to transcript
-    for idx, element in enumerate(comedy_transcript_elements):
-        m = parse_comedy_metadata(element.text)
-        # if unable to parse using the method above, skips that entry. this usually indicates that it is the title of
+    for _, transcript_url in items:
+        # if unable to parse the title, skips that entry. this usually indicates that it is the title of
         # non-standard comedy routine (such as a short sketch on David Letterman)
-        if m is None:
+        if results[transcript_url] is None:
             continue
 
+        m, transcript = results[transcript_url]
         parsed_metadata.append(m)
-
-        # parse transcript
-        transcripts.append(parse_comedy_transcript(element['href']))
+        transcripts.append(transcript)
 
     return parsed_metadata, transcripts
 
 
-def scrape_comedy_transcripts():
+def scrape_comedy_transcripts(cache_dir='data/http_cache', checkpoint_path='data/scrape_checkpoint.jsonl',
+                              max_workers=8, requests_per_second=4):
     """
     Main function for scraping stand-up comedy transcripts and metadata from
     https://scrapsfromtheloft.com/stand-up-comedy-scripts/.
 
     Saves metadata and transcript dataframes to .pkl files in the `data` folder.
+
+    :param str cache_dir: Directory HTTP responses are cached in.
+    :param str checkpoint_path: File finished comedy specials are recorded in. Delete it to scrape from scratch.
+    :param int max_workers: Number of comedy specials fetched at the same time.
+    :param float requests_per_second: Maximum number of requests sent to each host per second.
     """
     print('Scraping comedy transcript data...')
 
+    fetcher = Fetcher(cache_dir=cache_dir, max_connections=max_workers, requests_per_second=requests_per_second)
+    checkpoint = Checkpoint(checkpoint_path)
+
     # scrape data
-    comedy_transcript_elements = get_all_comedy_transcript_elements()
-    parsed_metadata, parsed_transcripts = parse_comedy_metadata_and_transcripts(comedy_transcript_elements)
+    comedy_transcript_elements = get_all_comedy_transcript_elements(fetcher=fetcher)
+    parsed_metadata, parsed_transcripts = parse_comedy_metadata_and_transcripts(comedy_transcript_elements,
+                                                                                fetcher=fetcher,
+                                                                                checkpoint=checkpoint,
+                                                                                max_workers=max_workers)
 
     # create dataframes
     df_metadata = pd.DataFrame(parsed_metadata)
@@ -330,6 +435,9 @@ def scrape_comedy_transcripts():
     df_metadata.to_pickle('data/standup_comedy_metadata.pkl')
     df_transcripts.to_pickle('data/raw_standup_comedy_transcripts.pkl')
 
+    # the results are saved, so the next run should start from scratch
+    checkpoint.clear()
+
     print(f'{len(parsed_metadata)} comedy transcript data successfully acquired and saved.')
 
 
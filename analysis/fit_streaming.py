@@ -0,0 +1,141 @@
+"""
+Streaming alternative to running `create_nlp_pipeline.py` and then `modeling.py`, for corpora too large to hold in
+memory. Transcripts are streamed from Mongo in batches: one pass builds the vocabulary and IDF weights, a few more train
+the NMF topic model one minibatch at a time, and a last one computes each comedy special's topic weights. Only one batch
+of transcripts, the topic-word matrix and the document-topic weights are ever in memory. Preprocessed transcripts are
+cached on disk (see `ingest_corpus.PreprocessedTextCache`), so only the first pass cleans and lemmatizes them.
+
+If run as main script, fits and persists the pipeline and topic model, exports them as a model artifact, writes the
+lexical index of the transcripts, and saves the topic weights to the metadata collection. Pass `--hashing` to hash words
+to columns instead of building a vocabulary (the model artifact is then skipped, since it needs a vocabulary, and the
+current model artifact is retired so the app loads the new pickles).
+"""
+import sys
+
+import dill as pickle
+import joblib
+import nltk
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from ingest_corpus import PreprocessedTextCache
+from insert_data_mongo import upsert_to_mongo
+from modeling import get_top_words
+from app.artifacts import clear_current_version, write_model_artifact
+from app.db import connect_to_mongo, iter_mongo_collection_batches
+from app.lexical_index import analysis_fingerprint, count_terms, word_analyzer, write_transcript_index
+from app.nlp_pipeline import TranscriptProcessingPipeline, ensure_nltk_data
+from app.streaming import HashingTfidfVectorizer, MiniBatchNMF, StreamingTfidfVectorizer
+from app.topics import TOPIC_COLUMNS
+from app.creds import USERNAME, PWD
+
+
+def stream_transcripts(db, batch_size=1000):
+    """
+    :param pymongo.database.Database db: Mongo database object.
+    :param int batch_size: Number of transcripts per batch.
+    :return: Generator of (comedyIds, transcripts) list pairs, in comedyId order.
+    :rtype: generator
+    """
+    for df_batch in iter_mongo_collection_batches(db, 'transcripts', fields=['comedyId', 'text'],
+                                                  batch_size=batch_size, sort='comedyId'):
+        yield df_batch['comedyId'].to_list(), df_batch['text'].to_list()
+
+
+def fit_streaming(make_batches, pipeline, topic_model, n_epochs=5, cache=None, n_jobs=1):
+    """
+    Fits a pipeline and a minibatch topic model to a corpus streamed in batches.
+
+    :param make_batches: Function returning a new iterable of (ids, documents) batches each time it's called. It is
+                         called once per pass over the corpus.
+    :param TranscriptProcessingPipeline pipeline: Pipeline whose vectorizer can be fit in batches.
+    :param MiniBatchNMF topic_model: Topic model to train.
+    :param int n_epochs: Number of passes over the corpus to train the topic model for.
+    :param cache: Optional store of previously preprocessed documents (see `TranscriptProcessingPipeline.preprocess`).
+    :param int n_jobs: Number of processes to preprocess each batch in.
+    :return: Document ids and document-topic matrix, in the order the batches were streamed.
+    :rtype: tuple
+    """
+    pipeline.fit_stream((documents for _, documents in make_batches()), cache=cache, n_jobs=n_jobs)
+
+    for _ in range(n_epochs):
+        for X_batch in pipeline.transform_stream((documents for _, documents in make_batches()), cache=cache):
+            topic_model.partial_fit(X_batch)
+
+    ids, doc_topic = [], []
+    for batch_ids, documents in make_batches():
+        X_batch = pipeline.transform_preprocessed(pipeline.preprocess(documents, cache=cache), sparse=True)
+        ids.extend(batch_ids)
+        doc_topic.append(topic_model.transform(X_batch))
+
+    return ids, np.vstack(doc_topic)
+
+
+def stream_term_counts(make_batches, pipeline, cache=None):
+    """
+    Counts every word of a corpus streamed in batches, for the lexical index (see app.lexical_index). The counts are
+    sparse, so they take far less memory than the transcripts.
+
+    :param make_batches: Function returning a new iterable of (ids, documents) batches.
+    :param TranscriptProcessingPipeline pipeline: Fitted pipeline.
+    :param cache: Optional store of previously preprocessed documents.
+    :return: Document ids, document-term matrix of word counts (in the order the batches were streamed), and the
+             vocabulary mapping each word to its column.
+    :rtype: tuple
+    """
+    analyzer = word_analyzer(pipeline)
+    ids, counts, vocabulary = [], [], {}
+    for batch_ids, documents in make_batches():
+        ids.extend(batch_ids)
+        counts.append(count_terms(analyzer, pipeline.preprocess(documents, cache=cache), vocabulary))
+
+    # words first seen in later batches add columns, so earlier batches are widened to the final vocabulary
+    counts = [sparse.csr_matrix((batch.data, batch.indices, batch.indptr), shape=(batch.shape[0], len(vocabulary)))
+              for batch in counts]
+
+    return ids, sparse.vstack(counts, format='csr'), vocabulary
+
+
+if __name__ == '__main__':
+    ensure_nltk_data()
+    hashing = '--hashing' in sys.argv[1:]
+
+    db = connect_to_mongo(username=USERNAME, password=PWD)
+    preprocessed_cache = PreprocessedTextCache('data/preprocessed_transcripts.sqlite3')
+
+    pipeline_tfidf = TranscriptProcessingPipeline(
+        tokenizer=nltk.word_tokenize,
+        stemmer=nltk.stem.PorterStemmer,
+        lemmatizer=nltk.stem.WordNetLemmatizer,
+        vectorizer=HashingTfidfVectorizer if hashing else StreamingTfidfVectorizer
+    )
+    topic_model = MiniBatchNMF(n_components=6, random_state=0)
+
+    comedy_ids, doc_topic = fit_streaming(lambda: stream_transcripts(db), pipeline_tfidf, topic_model,
+                                          n_epochs=topic_model.n_epochs, cache=preprocessed_cache, n_jobs=-1)
+
+    pickle.dump(pipeline_tfidf, open('../app/static/ml_models/tfidf_pipeline.pkl', 'wb'))
+    joblib.dump(topic_model, '../app/static/ml_models/tfidf_nmf_model.pkl')
+    if hashing:
+        # an artifact of an earlier fit would otherwise still be served, with topic weights that no longer match
+        clear_current_version('../app/static/ml_models/artifacts')
+    else:
+        write_model_artifact('../app/static/ml_models/artifacts', pipeline_tfidf, topic_model, doc_topic,
+                             comedy_ids=comedy_ids)
+
+        # topics come out in a different order on every fit, so check that they still match the names in
+        # TOPIC_COLUMNS
+        word_topic = pd.DataFrame(topic_model.components_.T, index=pipeline_tfidf.vectorizer.get_feature_names())
+        print(get_top_words(word_topic).to_string())
+
+    # index every word of the transcripts for lexical search in the flask app
+    counted_ids, counts, vocabulary = stream_term_counts(lambda: stream_transcripts(db), pipeline_tfidf,
+                                                         cache=preprocessed_cache)
+    write_transcript_index('../app/static/ml_models/lexical_index', counts, counted_ids, vocabulary,
+                           analysis_fingerprint(pipeline_tfidf))
+
+    # add topic weights to metadata in mongo db
+    df_topics = pd.DataFrame(doc_topic, columns=TOPIC_COLUMNS)
+    df_topics.insert(0, 'comedyId', comedy_ids)
+    upsert_to_mongo(db, 'metadata', df=df_topics, key_fields=['comedyId'])
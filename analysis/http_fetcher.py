@@ -0,0 +1,180 @@
+"""
+Contains the HTTP machinery used to acquire data: a fetcher that reuses pooled connections, limits how often each host
+is hit, retries failed requests with exponential backoff and caches responses on disk, and a checkpoint file that lets
+an interrupted scrape resume where it left off instead of downloading everything again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class RateLimiter:
+    """
+    Spaces out requests to each host so that no host receives more than a fixed number of requests per second, no
+    matter how many threads are fetching.
+    """
+    def wait(self, host):
+        """
+        Blocks until a request to the host is allowed.
+
+        :param str host: Host name.
+        """
+        if self.requests_per_second is None:
+            return
+
+        # reserve the next free slot for this host, then sleep outside the lock until it arrives
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1 / self.requests_per_second
+
+        if slot > now:
+            time.sleep(slot - now)
+
+    def __init__(self, requests_per_second=None):
+        self.requests_per_second = requests_per_second
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+
+class DiskCache:
+    """
+    Stores response bodies on disk, one file per URL.
+    """
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def get(self, url):
+        """
+        :param str url: Requested URL.
+        :return: Cached response body, or None if the URL hasn't been fetched before.
+        :rtype: bytes
+        """
+        try:
+            with open(self._path(url), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, url, content):
+        """
+        :param str url: Requested URL.
+        :param bytes content: Response body.
+        """
+        # write to a temporary file first so a crash never leaves a truncated response in the cache
+        path = self._path(url)
+        staging_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(staging_path, 'wb') as f:
+            f.write(content)
+        os.replace(staging_path, path)
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+
+class Fetcher:
+    """
+    Fetches URLs over a pooled, retrying session, with per-host rate limiting and an optional on-disk response cache.
+    Safe to share between threads.
+    """
+    def fetch(self, url, use_cache=True):
+        """
+        :param str url: URL to GET.
+        :param bool use_cache: If False, always fetch from the network (the response is still cached).
+        :return: Response body.
+        :rtype: bytes
+        """
+        if use_cache and self.cache is not None:
+            content = self.cache.get(url)
+            if content is not None:
+                return content
+
+        self.rate_limiter.wait(urlparse(url).netloc)
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+
+        if self.cache is not None:
+            self.cache.set(url, response.content)
+
+        return response.content
+
+    def fetch_json(self, url, use_cache=True):
+        """
+        :param str url: URL to GET.
+        :param bool use_cache: If False, always fetch from the network.
+        :return: Decoded JSON response body.
+        """
+        return json.loads(self.fetch(url, use_cache=use_cache))
+
+    def __init__(self, cache_dir=None, max_connections=8, requests_per_second=None, retries=5, backoff_factor=0.5,
+                 timeout=30):
+        self.cache = DiskCache(cache_dir) if cache_dir is not None else None
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.timeout = timeout
+
+        # retry connection errors, rate limiting and server errors, waiting backoff_factor * 2^n seconds in between
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+
+class Checkpoint:
+    """
+    Append-only record of finished work items, stored as one JSON object per line. Items recorded before a crash are
+    loaded again on the next run so they can be skipped.
+    """
+    def record(self, key, result):
+        """
+        :param str key: Unique identifier of the work item.
+        :param result: JSON-serializable result of the work item.
+        """
+        line = json.dumps({'key': key, 'result': result}) + '\n'
+        with self._lock:
+            self.completed[key] = result
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+
+    def clear(self):
+        """
+        Forgets every recorded item, e.g. once a run has finished and its results have been saved.
+        """
+        with self._lock:
+            self.completed = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def __contains__(self, key):
+        return key in self.completed
+
+    def __getitem__(self, key):
+        return self.completed[key]
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        # the last line may be cut short if the previous run crashed while writing it
+                        continue
+                    self.completed[item['key']] = item['result']
@@ -0,0 +1,197 @@
+"""
+Contains functions for incrementally adding newly posted (or edited) comedy specials to the Mongo database, instead of
+scraping and re-inserting the whole corpus. Each comedy special is identified by its comedian, title and year, and each
+transcript carries a hash of its text, so only new and changed transcripts are written. Also contains the on-disk cache
+of preprocessed transcripts used by `create_nlp_pipeline.py`, so unchanged transcripts are never cleaned and lemmatized
+twice.
+
+If run as main script, scrapes the comedy specials that aren't in the database yet and upserts them (add `--refresh` to
+also re-scrape the ones that are, to pick up edited transcripts). Afterwards, re-run `create_nlp_pipeline.py` and
+`modeling.py` to refit the models.
+"""
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+
+from data_acquisition import get_all_comedy_transcript_elements, parse_comedy_metadata_and_transcripts, \
+    parse_comedy_title
+from http_fetcher import Checkpoint, Fetcher
+from insert_data_mongo import upsert_to_mongo
+from app.db import connect_to_mongo, load_mongo_collection_as_dataframe
+from app.nlp_pipeline import content_hash
+from app.creds import USERNAME, PWD
+
+
+class PreprocessedTextCache:
+    """
+    Preprocessed (cleaned and lemmatized) transcripts stored in a local SQLite file, keyed on a hash of the raw
+    transcript and of the preprocessing settings. Pass it to `TranscriptProcessingPipeline.preprocess`.
+    """
+    def get_many(self, keys):
+        """
+        :param list keys: Cache keys.
+        :return: Preprocessed text for each key that is in the cache.
+        :rtype: dict
+        """
+        found = {}
+        keys = list(set(keys))
+        with sqlite3.connect(self.path) as connection:
+            # sqlite limits the number of parameters per query
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = connection.execute(f'SELECT key, text FROM preprocessed_text WHERE key IN '
+                                          f'({",".join("?" * len(batch))})', batch)
+                found.update(rows)
+
+        return found
+
+    def set_many(self, items):
+        """
+        :param dict items: Preprocessed text keyed on cache key.
+        """
+        with sqlite3.connect(self.path) as connection:
+            connection.executemany('INSERT OR REPLACE INTO preprocessed_text (key, text) VALUES (?, ?)', items.items())
+
+    def __len__(self):
+        with sqlite3.connect(self.path) as connection:
+            return connection.execute('SELECT COUNT(*) FROM preprocessed_text').fetchone()[0]
+
+    def __init__(self, path):
+        self.path = path
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with sqlite3.connect(path) as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS preprocessed_text (key TEXT PRIMARY KEY, text TEXT)')
+
+
+def special_key(comedian, title, year):
+    """
+    :param str comedian: Comedian name.
+    :param str title: Comedy special title.
+    :param int year: Year performed.
+    :return: Key identifying a comedy special.
+    :rtype: str
+    """
+    return f'{comedian}|{title}|{int(year)}'
+
+
+def load_existing_specials(db):
+    """
+    Loads the identity and transcript hash of every comedy special already in the database. Transcripts inserted before
+    hashes were stored are hashed here.
+
+    :param pymongo.database.Database db: Mongo database object.
+    :return: comedyId keyed on comedy special key, and transcript hash keyed on comedyId.
+    :rtype: tuple
+    """
+    metadata = load_mongo_collection_as_dataframe(db, 'metadata', fields=['comedyId', 'comedian', 'title', 'year'])
+    ids = {special_key(comedian, title, year): int(comedy_id)
+           for comedy_id, comedian, title, year in zip(metadata['comedyId'], metadata['comedian'],
+                                                       metadata['title'], metadata['year'])}
+
+    transcripts = load_mongo_collection_as_dataframe(db, 'transcripts', fields=['comedyId', 'textHash'])
+    hashes = {int(comedy_id): text_hash for comedy_id, text_hash in zip(transcripts['comedyId'],
+                                                                        transcripts['textHash'])
+              if isinstance(text_hash, str)}
+
+    unhashed = [int(comedy_id) for comedy_id in transcripts['comedyId'] if int(comedy_id) not in hashes]
+    if unhashed:
+        for document in db['transcripts'].find({'comedyId': {'$in': unhashed}}, projection={'comedyId': 1, 'text': 1}):
+            hashes[int(document['comedyId'])] = content_hash(document['text'])
+
+    return ids, hashes
+
+
+def diff_specials(metadata, transcripts, existing_ids, existing_hashes):
+    """
+    Works out which scraped comedy specials are new and which have a changed transcript, and gives each new one the
+    next free comedyId.
+
+    :param list metadata: Scraped metadata dictionaries (see `data_acquisition.parse_comedy_metadata`).
+    :param list transcripts: Scraped raw transcript for each metadata dictionary.
+    :param dict existing_ids: comedyId keyed on comedy special key, for comedy specials already in the database.
+    :param dict existing_hashes: Transcript hash keyed on comedyId, for comedy specials already in the database.
+    :return: Metadata records to upsert (new comedy specials only), transcript records to upsert (new and changed
+             comedy specials), and the number of new and changed comedy specials.
+    :rtype: tuple
+    """
+    next_id = max(existing_ids.values(), default=-1) + 1
+    metadata_records = []
+    transcript_records = []
+    n_new, n_changed = 0, 0
+
+    for m, transcript in zip(metadata, transcripts):
+        key = special_key(m['Comedian'], m['Title'], m['Year'])
+        text_hash = content_hash(transcript)
+
+        comedy_id = existing_ids.get(key)
+        is_new = comedy_id is None
+        if is_new:
+            comedy_id = next_id
+            existing_ids[key] = comedy_id
+            next_id += 1
+            n_new += 1
+        elif existing_hashes.get(comedy_id) == text_hash:
+            continue
+        else:
+            n_changed += 1
+
+        # the metadata of existing comedy specials may have been corrected by hand (see modeling.py), so only the
+        # transcript of a changed comedy special is updated
+        if is_new:
+            metadata_records.append({'comedyId': comedy_id, 'comedian': m['Comedian'], 'title': m['Title'],
+                                     'year': m['Year'], 'imageUrl': m['ImageURL']})
+        transcript_records.append({'comedyId': comedy_id, 'text': transcript, 'textHash': text_hash})
+
+    return pd.DataFrame(metadata_records), pd.DataFrame(transcript_records), n_new, n_changed
+
+
+def ingest_comedy_specials(db, fetcher, checkpoint=None, refresh=False):
+    """
+    Scrapes comedy specials and upserts the new and changed ones into the metadata and transcripts collections. Nothing
+    is dropped, so the app can keep reading the collections the whole time.
+
+    :param pymongo.database.Database db: Mongo database object.
+    :param Fetcher fetcher: Fetcher used for HTTP requests.
+    :param Checkpoint checkpoint: Optional checkpoint, so an interrupted run can resume.
+    :param bool refresh: If True, also re-scrape comedy specials that are already in the database, to pick up edited
+                         transcripts. Otherwise only comedy specials that aren't in the database are scraped.
+    :return: Number of new and changed comedy specials.
+    :rtype: tuple
+    """
+    existing_ids, existing_hashes = load_existing_specials(db)
+
+    elements = []
+    for element in get_all_comedy_transcript_elements(fetcher=fetcher):
+        parsed_title = parse_comedy_title(element.text)
+        if parsed_title is not None and (refresh or special_key(*parsed_title) not in existing_ids):
+            elements.append(element)
+
+    metadata, transcripts = parse_comedy_metadata_and_transcripts(elements, fetcher=fetcher, checkpoint=checkpoint)
+    df_metadata, df_transcripts, n_new, n_changed = diff_specials(metadata, transcripts, existing_ids,
+                                                                  existing_hashes)
+
+    if n_new or n_changed:
+        # transcripts first, so every comedy special in the metadata collection always has a transcript
+        upsert_to_mongo(db, 'transcripts', df_transcripts, key_fields=['comedyId'])
+        upsert_to_mongo(db, 'metadata', df_metadata, key_fields=['comedyId'])
+
+    return n_new, n_changed
+
+
+if __name__ == '__main__':
+    # a refresh is looking for edited transcripts, so it mustn't read pages from the cache of an earlier run
+    refresh = '--refresh' in sys.argv[1:]
+    checkpoint = Checkpoint('data/ingest_checkpoint.jsonl')
+
+    n_new, n_changed = ingest_comedy_specials(db=connect_to_mongo(username=USERNAME, password=PWD),
+                                              fetcher=Fetcher(cache_dir=None if refresh else 'data/http_cache',
+                                                              requests_per_second=4),
+                                              checkpoint=checkpoint,
+                                              refresh=refresh)
+    checkpoint.clear()
+    print(f'{n_new} new and {n_changed} changed comedy specials saved.')
@@ -6,13 +6,16 @@ Stephen Kaplan, 2020-08-22
 """
 
 import pandas as pd
+from pymongo import ASCENDING, UpdateOne
 from app.db import connect_to_mongo
 from app.creds import USERNAME, PWD
 
 
 def insert_to_mongo(db, collection_name, columns, file_path=None, df=None):
     """
-    Creates (or replaces) a collection in a given mongo database.
+    Creates (or replaces) a collection in a given mongo database. The new contents are written to a staging collection
+    that is then renamed over the old one, so anyone reading the collection sees either the old or the new contents,
+    never an empty or partially written collection.
 
     Must either specify `file_path` to a .pkl file containing a pandas DataFrame OR pass the DataFrame in directly.
 
@@ -22,13 +25,6 @@ def insert_to_mongo(db, collection_name, columns, file_path=None, df=None):
     :param str file_path: File path to .pkl file to persist to Mongo collection. Required if df not provided.
     :param pandas.DataFrame df: Pandas DataFrame to persist to Mongo collection. Required if file_path not provided.
     """
-    # create collections
-    collection = db[collection_name]
-
-    # drop in case data is already there
-    collection.drop()
-    collection = db[collection_name]
-
     if (file_path is None) and (df is None):
         raise ValueError('You must specify a file path to a .pkl file or a dataframe.')
 
@@ -43,8 +39,41 @@ def insert_to_mongo(db, collection_name, columns, file_path=None, df=None):
     # convert to lists of dictionaries
     data_json = df.to_dict('records')
 
-    # insert into mongo collections
-    collection.insert_many(data_json)
+    # insert into a staging collection (dropping any left over from an interrupted run)
+    staging_collection = db[f'{collection_name}_staging']
+    staging_collection.drop()
+    staging_collection.insert_many(data_json)
+
+    # swap it in for the real collection in one step
+    staging_collection.rename(collection_name, dropTarget=True)
+
+
+def upsert_to_mongo(db, collection_name, df, key_fields, batch_size=1000):
+    """
+    Inserts new documents and updates existing ones in place, matching them on key fields. Only the fields present in
+    the dataframe are written; any other fields of existing documents are left as they are.
+
+    :param pymongo.database.Database db: Database containing the collection.
+    :param str collection_name: Name of Mongo DB collection
+    :param pandas.DataFrame df: Documents to insert or update, one per row. Column names are used as field names.
+    :param list key_fields: Fields that identify a document, e.g. ['comedyId'].
+    :param int batch_size: Number of documents written per round trip.
+    :return: Number of documents inserted and number of documents modified.
+    :rtype: tuple
+    """
+    collection = db[collection_name]
+    collection.create_index([(field, ASCENDING) for field in key_fields])
+
+    operations = [UpdateOne({field: record[field] for field in key_fields}, {'$set': record}, upsert=True)
+                  for record in df.to_dict('records')]
+
+    n_inserted, n_modified = 0, 0
+    for start in range(0, len(operations), batch_size):
+        result = collection.bulk_write(operations[start:start + batch_size], ordered=False)
+        n_inserted += result.upserted_count
+        n_modified += result.modified_count
+
+    return n_inserted, n_modified
 
 
 if __name__ == '__main__':
@@ -5,31 +5,38 @@ makes some manual adjustments to the comedy special metadata.
 
 Stephen Kaplan, 2020-08-13
 """
+import json
 import pandas as pd
+from scipy import sparse
 from sklearn.decomposition import NMF
 import joblib
+import dill as pickle
 
-from insert_data_mongo import insert_to_mongo
+from insert_data_mongo import upsert_to_mongo
 from app.db import connect_to_mongo, load_mongo_collection_as_dataframe
 from app.creds import USERNAME, PWD
+from app.topics import TOPIC_COLUMNS
+from app.artifacts import write_model_artifact
 
 
-def get_topics(model, n_components, vectorized_corpus):
+def get_topics(model, n_components, vectorized_corpus, feature_names):
     """
-
-
-    :param model:
-    :param n_components:
-    :param vectorized_corpus:
-    :return:
+    Fits a topic model to a vectorized corpus and returns the document-topic and topic-word matrices.
+
+    :param model: Topic model class (e.g. sklearn.decomposition.NMF).
+    :param int n_components: Number of topics.
+    :param scipy.sparse.csr_matrix vectorized_corpus: Document-term matrix. Kept sparse throughout fitting.
+    :param list feature_names: Vocabulary word for each column of the document-term matrix.
+    :return: Document-topic, topic-word, and word-topic dataframes and the fitted topic model.
+    :rtype: tuple
     """
     model = model(n_components)
 
     df_document_topic = pd.DataFrame(model.fit_transform(vectorized_corpus))
-    df_topic_word = pd.DataFrame(model.components_, columns=vectorized_corpus.columns)
+    df_topic_word = pd.DataFrame(model.components_, columns=feature_names)
     df_word_topic = df_topic_word.transpose()
 
-    return df_document_topic, df_topic_word, df_word_topic, topic_model
+    return df_document_topic, df_topic_word, df_word_topic, model
 
 
 def get_top_words(df_word_topic, n_top_words=20):
@@ -51,32 +58,43 @@ def get_top_words(df_word_topic, n_top_words=20):
 
 if __name__ == "__main__":
     # tried out LSA, LDA, and NMF with both word count and TF/IDF as input. NMF with TF/IDF seems best (for now)
-    count_vectorized_comedy_corpus = pd.read_pickle('data/count_vectorized_standup_comedy_transcripts.pkl')
-    tfidf_comedy_corpus = pd.read_pickle('data/tfidf_standup_comedy_transcripts.pkl')
+    count_vectorized_comedy_corpus = sparse.load_npz('data/count_vectorized_standup_comedy_transcripts.npz')
+    tfidf_comedy_corpus = sparse.load_npz('data/tfidf_standup_comedy_transcripts.npz')
+    with open('data/tfidf_standup_comedy_transcripts.json') as f:
+        tfidf_feature_names = json.load(f)
 
     doc_topic, topic_word, word_topic, topic_model = get_topics(model=NMF, n_components=6,
-                                                                vectorized_corpus=tfidf_comedy_corpus)
+                                                                vectorized_corpus=tfidf_comedy_corpus,
+                                                                feature_names=tfidf_feature_names)
 
     # dump topic model to .pkl for use in search feature in flask app
     joblib.dump(topic_model, '../app/static/ml_models/tfidf_nmf_model.pkl')
 
     # use top words to decide on topic categories
     top_words = get_top_words(word_topic)
-    topic_names = ['observational', 'theBlackExperience', 'britishAustralian',
-                   'political', 'immigrantUpbringing', 'relationshipsSex']
+    topic_names = TOPIC_COLUMNS
     doc_topic.columns = topic_names
 
-    # add topic weights to metadata and overwrite metadata collection in mongo db
+    # add topic weights to metadata in mongo db. the transcripts were vectorized in comedyId order
     db = connect_to_mongo(username=USERNAME, password=PWD)
     metadata = load_mongo_collection_as_dataframe(db, 'metadata')
-    metadata.drop(['comedyId', '_id'], axis=1, inplace=True)
+    metadata = metadata.sort_values('comedyId').reset_index(drop=True)
+    metadata.drop(['_id'], axis=1, inplace=True)
 
     # fix final image URLs that were causing issues
     metadata.loc[2, 'imageUrl'] = "static/images/George Lopez - We'll Do It for Half.jpg"
     metadata.loc[193, 'imageUrl'] = "https://m.media-amazon.com/images/M/MV5BMjk0NjIwNTctMzk3ZC00OTYxLTg2NGEtNTU4OWY5MDQ3YmRlXkEyXkFqcGdeQXVyMTk3NDAwMzI@._V1_.jpg"
 
-    # persist the updated metadata
+    # persist the updated metadata. updating documents in place keeps the collection readable by the app throughout
     metadata2 = pd.merge(metadata, doc_topic, left_index=True, right_index=True)
-    columns = ['comedyId', 'comedian', 'title', 'year', 'imageUrl']
+    columns = ['comedyId', 'imageUrl']
     columns.extend(topic_names)
-    insert_to_mongo(db, 'metadata', columns=columns, df=metadata2)
+    upsert_to_mongo(db, 'metadata', df=metadata2[columns], key_fields=['comedyId'])
+
+    # export the pipeline and topic model as a memory-mappable model artifact, which the flask app loads instead of the
+    # pickles. its document-topic matrix is fingerprinted with the topic weights just saved, so the app can tell if they
+    # are later refreshed without a new artifact
+    with open('../app/static/ml_models/tfidf_pipeline.pkl', 'rb') as f:
+        tfidf_pipeline = pickle.load(f)
+    write_model_artifact('../app/static/ml_models/artifacts', tfidf_pipeline, topic_model,
+                         metadata2[topic_names].values, comedy_ids=metadata2['comedyId'].values)
@@ -1,60 +1,104 @@
-from flask import Flask, render_template, request
-import joblib
-import dill as pickle
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
+import time
 
-from app.db import load_mongo_collection_as_dataframe, connect_to_mongo
-from app.creds import USERNAME, PWD
+from flask import Flask, Response, render_template, request, jsonify, abort, g
 
-import sys
-from app import nlp_pipeline
-
-sys.modules['nlp_pipeline'] = nlp_pipeline
+from app.metrics import REGISTRY, REQUEST_SECONDS, timed
+from app.profiling import RequestProfiler
+from app.search import search_batch, search_hybrid, search_lexical, format_results
+from app.startup import LazyResources
 
 # initialize flask app
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.config.from_object('app.config.ProductionConfig')
 
-# load metadata from mongo and convert topic weights to topic booleans based on threshold
-METADATA = load_mongo_collection_as_dataframe(db=connect_to_mongo(USERNAME, PWD), collection_name='metadata')
-THRESHOLD = 0.2
+# metadata and models are loaded on first use (or up front in the gunicorn master, see gunicorn.conf.py)
+RESOURCES = LazyResources(app.config)
+MAX_PER_PAGE = 100
+MAX_BATCH_SIZE = 1000
+INDEX_DROPDOWN_OPTIONS = ['Observational', 'The Black Experience', 'British & Australian',
+                          'Political', 'Immigrant Upbringing', 'Relationships & Sex']
+SEARCH_MODES = ['topic', 'lexical', 'hybrid']
 
-# load NLP models
-PIPELINE = pickle.load(open('app/static/ml_models/tfidf_pipeline.pkl', 'rb'))
-TOPIC_MODEL = joblib.load('app/static/ml_models/tfidf_nmf_model.pkl')
+# samples requests for profiling; does nothing unless PROFILE_SAMPLE_RATE or PROFILE_TOKEN is set
+PROFILER = RequestProfiler(sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+                           slow_request_seconds=app.config['PROFILE_SLOW_REQUEST_SECONDS'],
+                           directory=app.config['PROFILE_DIR'],
+                           token=app.config['PROFILE_TOKEN'])
 
 
-def apply_threshold_to_topics(data):
-    """
-    Converts topic weights in metadata to string representation of boolean. If topic weight is above the threshold, then
-    the document is considered to be a member of that topic.
+@app.before_request
+def start_request():
+    g.request_start = time.perf_counter()
+    g.profile = PROFILER.start(request.headers.get('X-Profile-Token'))
 
-    :param pandas.DataFrame data: Metadata pandas dataframe, where columns 6 through the last column each represent a
-                                  topic and contain topic weights for each document.
-    :return: Dataframe with topic weight columns converted to boolean in string form ('1', '0').
-    :rtype: pandas.DataFrame
-    """
-    for col in data.columns[6:]:
-        data[col] = data[col] > THRESHOLD
-        data[col].replace(True, '1', inplace=True)
-        data[col].replace(False, '0', inplace=True)
 
-    return data
+@app.after_request
+def finish_request(response):
+    seconds = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.observe(seconds, endpoint)
+    if g.profile is not None:
+        PROFILER.finish(g.profile, seconds, endpoint, token=request.headers.get('X-Profile-Token'))
+
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Request and stage latency histograms in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/')
 def index():
     """
-    Loads initial home page.
+    Loads initial home page. The page only changes when the metadata does, so it is rendered once and then served from
+    memory, answering conditional GETs with 304 Not Modified. Only the first page of comedy specials is rendered; the
+    rest are loaded from /api/specials as the user asks for them.
     """
-    metadata = apply_threshold_to_topics(METADATA.copy())
+    resources = RESOURCES.get()
+    per_page = app.config['CARDS_PER_PAGE']
+
+    def render():
+        with timed('render'):
+            return render_template('index.html',
+                                   comedy_info=resources.index_comedy_info[:per_page],
+                                   dropdown_options=INDEX_DROPDOWN_OPTIONS,
+                                   search_text='',
+                                   lazy_load=True,
+                                   per_page=per_page,
+                                   total=len(resources.index_comedy_info))
 
-    return render_template('index.html',
-                           comedy_info=metadata.values.tolist(),
-                           dropdown_options=['Observational', 'The Black Experience', 'British & Australian',
-                                             'Political', 'Immigrant Upbringing', 'Relationships & Sex'],
-                           search_text='')
+    page = resources.page_cache.get_or_render('index', render)
+
+    response = Response(page.body, mimetype='text/html')
+    response.set_etag(page.etag)
+    response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
+
+def search_specials(resources, queries, k, mode):
+    """
+    Ranks comedy specials against many search terms in one of the search modes.
+
+    :param Resources resources: Loaded app resources.
+    :param list queries: List of search term strings.
+    :param int k: Number of results to return per search term.
+    :param str mode: 'topic' (by topic similarity), 'lexical' (by matching words) or 'hybrid' (a blend of both).
+    :return: One (row_ids, scores) tuple per search term, best first.
+    :rtype: list
+    """
+    if mode == 'lexical':
+        return search_lexical(queries, resources.pipeline, resources.lexical_index, k=k)
+    if mode == 'hybrid':
+        return search_hybrid(queries, resources.pipeline, resources.projector, resources.topic_index,
+                             resources.lexical_index, k=k, lexical_weight=app.config['HYBRID_LEXICAL_WEIGHT'])
+
+    return search_batch(queries, resources.pipeline, resources.projector, resources.topic_index, k=k,
+                        cache=resources.query_cache)
 
 
 @app.route('/search', methods=['POST'])
@@ -62,30 +106,120 @@ def search():
     """
     Finds comedy specials similar to the search term entered by the user.
     """
-    metadata = METADATA.copy()
+    resources = RESOURCES.get()
 
-    # extract search term from the HTML form
+    # extract search term (and optionally the search mode) from the HTML form
     search_term = request.form['search']
+    mode = request.form.get('mode', app.config['SEARCH_MODE'])
+    if mode not in SEARCH_MODES:
+        abort(400, description=f'"mode" must be one of {", ".join(SEARCH_MODES)}.')
 
     if search_term != '':
-        # put search term in same vector space as data model was trained on
-        search_transformed = PIPELINE.transform([search_term])
-        # put search in topic space
-        search_topics = TOPIC_MODEL.transform(search_transformed)
-
-        # calculate cosine similarity matrix
-        doc_topic_matrix = metadata[metadata.columns[6:]].values
-        similarity = cosine_similarity(doc_topic_matrix, search_topics)
-        top_10_idx = np.argsort(similarity.flatten())[-10:]
-        metadata = metadata.iloc[list(top_10_idx)]
-
-    metadata = apply_threshold_to_topics(metadata)
-
-    return render_template('index.html',
-                           comedy_info=metadata.values.tolist(),
-                           dropdown_options=['Observational', 'Black Culture', 'British & Australian',
-                                             'Political', 'Immigrant Upbringing', 'Relationships & Sex'],
-                           search_text=search_term)
+        if mode == 'topic':
+            # vectorize the search term, put it in topic space, and rank by cosine similarity (most similar first), in
+            # a batch with any searches other threads are making at the same time
+            top_10_idx, _ = resources.search_batcher.search(search_term, k=10)
+        else:
+            [(top_10_idx, _)] = search_specials(resources, [search_term], 10, mode)
+        with timed('card_data'):
+            comedy_info = resources.comedy_info(top_10_idx)
+    else:
+        comedy_info = resources.index_comedy_info
+
+    with timed('render'):
+        return render_template('index.html',
+                               comedy_info=comedy_info,
+                               dropdown_options=['Observational', 'Black Culture', 'British & Australian',
+                                                 'Political', 'Immigrant Upbringing', 'Relationships & Sex'],
+                               search_text=search_term)
+
+
+@app.route('/api/search/batch', methods=['POST'])
+def api_search_batch():
+    """
+    Finds comedy specials similar to each of many search terms in one request. Expects a JSON body of the form
+    {"queries": ["political", "relationships"], "k": 10, "mode": "topic"}.
+    """
+    payload = request.get_json(silent=True) or {}
+    queries = payload.get('queries')
+    k = payload.get('k', 10)
+    mode = payload.get('mode', 'topic')
+
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        abort(400, description='"queries" must be a list of strings.')
+    if len(queries) > MAX_BATCH_SIZE:
+        abort(400, description=f'At most {MAX_BATCH_SIZE} queries can be sent in one request.')
+    # bool is a subclass of int, so JSON true would otherwise pass as k=1
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= MAX_PER_PAGE:
+        abort(400, description=f'"k" must be an integer between 1 and {MAX_PER_PAGE}.')
+    if mode not in SEARCH_MODES:
+        abort(400, description=f'"mode" must be one of {", ".join(SEARCH_MODES)}.')
+
+    resources = RESOURCES.get()
+    results = search_specials(resources, queries, k, mode)
+
+    with timed('card_data'):
+        specials = [format_results(resources.metadata, row_ids, similarities) for row_ids, similarities in results]
+
+    return jsonify(results=[{'query': query, 'specials': query_specials}
+                            for query, query_specials in zip(queries, specials)])
+
+
+@app.route('/special/<int:comedy_id>/similar')
+def similar_specials(comedy_id):
+    """
+    Returns the comedy specials most similar in topic space to one comedy special ("more like this"), looked up in the
+    precomputed neighbour lists. `comedy_id` is the comedy special's comedyId, returned as `id` by the other endpoints.
+    Query parameter: `k` (number of comedy specials, 10 by default).
+    """
+    resources = RESOURCES.get()
+
+    # parsed here rather than with `type=int`, which would silently fall back to the default for e.g. k=abc
+    try:
+        k = int(request.args.get('k', 10))
+    except ValueError:
+        k = None
+    if k is None or not 1 <= k <= MAX_PER_PAGE:
+        abort(400, description=f'"k" must be an integer between 1 and {MAX_PER_PAGE}.')
+    row_id = resources.row_of(comedy_id)
+    if row_id is None:
+        abort(404, description=f'No comedy special with id {comedy_id}.')
+
+    with timed('neighbours'):
+        row_ids, similarities = resources.similar_specials(row_id, k=k)
+    with timed('card_data'):
+        specials = format_results(resources.metadata, row_ids, similarities)
+
+    return jsonify(id=comedy_id, specials=specials)
+
+
+@app.route('/api/specials')
+def api_specials():
+    """
+    Returns one page of comedy specials, optionally filtered by topic and release year. Query parameters: `topic`
+    (name or number, may be repeated to require several topics), `year_from`, `year_to`, `page` and `per_page`.
+    """
+    resources = RESOURCES.get()
+
+    try:
+        topics = [resources.specials_index.topic_number(topic) for topic in request.args.getlist('topic')]
+    except KeyError as e:
+        abort(400, description=str(e))
+
+    year_from = request.args.get('year_from', type=int)
+    year_to = request.args.get('year_to', type=int)
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', app.config['CARDS_PER_PAGE'], type=int)
+    if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+        abort(400, description=f'"page" must be at least 1 and "per_page" between 1 and {MAX_PER_PAGE}.')
+
+    with timed('filter'):
+        row_ids = resources.specials_index.filter(topics, year_from=year_from, year_to=year_to)
+        page_row_ids, pages = resources.specials_index.paginate(row_ids, page, per_page)
+    with timed('card_data'):
+        specials = resources.comedy_info(page_row_ids)
+
+    return jsonify(total=len(row_ids), page=page, per_page=per_page, pages=pages, specials=specials)
 
 
 if __name__ == '__main__':
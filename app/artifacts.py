@@ -0,0 +1,448 @@
+"""
+Contains the reader and writer for model artifacts: a compact, versioned, pickle-free format for the fitted NLP pipeline
+and topic model. An artifact is a directory holding
+
+    manifest.json           format version, vectorizer and topic model settings, stop words, array shapes, checksums,
+                            and a fingerprint of the comedyIds and topic weights of the document-topic matrix
+    vocabulary.json         vocabulary words, in column order
+    idf.npy                 inverse document frequency of each vocabulary word
+    components.npy          topic-word matrix of the topic model
+    doc_topic.npy           document-topic matrix of the training corpus
+    doc_topic_unit.npy      the same matrix with each row scaled to unit length, ready for cosine similarity
+
+Arrays are loaded with memory mapping and read-only, so every worker on a machine shares the same pages of the
+operating system's page cache, and loading never executes code stored in the artifact (unlike unpickling).
+
+Artifacts are written to `<root>/<version>/`, and `<root>/CURRENT` names the version the app should load. Running app
+workers notice when CURRENT changes and swap in the new version without restarting. If this file is run as a script, it
+lists the versions in the default root, or points CURRENT at one of them (e.g. to roll back):
+
+    python -m app.artifacts list
+    python -m app.artifacts promote <version>
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+import nltk
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from app.nlp_pipeline import TranscriptProcessingPipeline
+from app.similarity import l2_normalize_rows
+from app.topics import TOPIC_COLUMNS, topic_weights_fingerprint
+
+ARTIFACT_FORMAT_VERSION = 1
+
+
+class ArtifactVectorizer:
+    """
+    TF-IDF vectorizer rebuilt from a vocabulary and IDF weights. Produces the same output as the fitted
+    sklearn.feature_extraction.text.TfidfVectorizer it was exported from, for the word analyzer settings that
+    TranscriptProcessingPipeline uses.
+
+    It stands in for the fitted vectorizer when the app serves requests, so it only implements the part of the sklearn
+    API the app uses on a fitted pipeline: `transform`, `build_analyzer`, `get_stop_words`, `get_params`,
+    `get_feature_names`, `vocabulary_` and `idf_`. It can't be fit, or exported again as an artifact.
+    """
+    def _analyze(self, document):
+        if self.lowercase:
+            document = document.lower()
+        tokens = [token for token in self.token_pattern.findall(document) if token not in self.stop_words]
+
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+
+        ngrams = tokens if min_n == 1 else []
+        for n in range(max(min_n, 2), max_n + 1):
+            ngrams.extend(' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+        return ngrams
+
+    def transform(self, corpus):
+        """
+        :param list corpus: List of preprocessed strings each containing a document.
+        :return: TF-IDF matrix with one row per document.
+        :rtype: scipy.sparse.csr_matrix
+        """
+        indices = []
+        indptr = [0]
+        for document in corpus:
+            indices.extend(self.vocabulary_[term] for term in self._analyze(document) if term in self.vocabulary_)
+            indptr.append(len(indices))
+
+        # duplicate (row, column) entries are summed, which counts each term's occurrences
+        matrix = sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                   shape=(len(corpus), len(self.vocabulary_)))
+        matrix.sum_duplicates()
+
+        if self.binary:
+            matrix.data[:] = 1
+        if self.sublinear_tf:
+            np.log(matrix.data, out=matrix.data)
+            matrix.data += 1
+        if self.idf_ is not None:
+            matrix = matrix @ sparse.diags(self.idf_)
+        if self.norm is not None:
+            matrix = normalize(matrix, norm=self.norm, copy=False)
+
+        return sparse.csr_matrix(matrix)
+
+    def build_analyzer(self):
+        """
+        :return: Function splitting a preprocessed document into the terms that are looked up in the vocabulary.
+        :rtype: function
+        """
+        return self._analyze
+
+    def get_stop_words(self):
+        return self.stop_words
+
+    def get_params(self, deep=True):
+        """
+        :param bool deep: Unused; for compatibility with sklearn's `get_params`.
+        :return: The word analysis and weighting settings of the vectorizer it was exported from. Stop words are
+                 returned as the list of words itself, even if the original settings named a built-in list.
+        :rtype: dict
+        """
+        return {
+            'analyzer': 'word',
+            'lowercase': self.lowercase,
+            'strip_accents': None,
+            'token_pattern': self.token_pattern.pattern,
+            'ngram_range': self.ngram_range,
+            'stop_words': sorted(self.stop_words),
+            'binary': self.binary,
+            'sublinear_tf': self.sublinear_tf,
+            'norm': self.norm,
+            'use_idf': self.idf_ is not None
+        }
+
+    def get_feature_names(self):
+        return list(self.vocabulary)
+
+    def __init__(self, vocabulary, idf, settings, stop_words):
+        self.vocabulary = vocabulary
+        self.vocabulary_ = {term: i for i, term in enumerate(vocabulary)}
+        self.idf_ = idf if settings['use_idf'] else None
+        self.lowercase = settings['lowercase']
+        self.token_pattern = re.compile(settings['token_pattern'])
+        self.ngram_range = tuple(settings['ngram_range'])
+        self.binary = settings['binary']
+        self.sublinear_tf = settings['sublinear_tf']
+        self.norm = settings['norm']
+        self.stop_words = frozenset(stop_words)
+
+
+class ModelArtifact:
+    """
+    A loaded model artifact. Arrays are read-only memory maps.
+    """
+    def pipeline(self):
+        """
+        Builds a ready-to-use NLP pipeline from the artifact without unpickling anything.
+
+        :return: Fitted NLP pipeline.
+        :rtype: TranscriptProcessingPipeline
+        """
+        vectorizer = ArtifactVectorizer(self.vocabulary, self.idf, self.manifest['vectorizer'],
+                                        self.manifest['vectorizer_stop_words'])
+        pipeline = TranscriptProcessingPipeline(tokenizer=nltk.word_tokenize,
+                                                stemmer=nltk.stem.PorterStemmer,
+                                                lemmatizer=nltk.stem.WordNetLemmatizer,
+                                                vectorizer=lambda **kwargs: vectorizer,
+                                                stop_words=[])
+        pipeline.stop_words = frozenset(self.manifest['stop_words'])
+        pipeline.lemmatizer_stop_words = frozenset(self.manifest['lemmatizer_stop_words'])
+        pipeline._is_fit = True
+
+        return pipeline
+
+    def topic_model(self):
+        """
+        Builds a fitted sklearn NMF topic model from the artifact's topic-word matrix.
+
+        :return: Topic model ready for `transform`.
+        :rtype: sklearn.decomposition.NMF
+        """
+        from sklearn.decomposition import NMF
+
+        # topic models fit in minibatches (see app.streaming) also record settings that sklearn's NMF doesn't have
+        nmf_params = NMF(n_components=1).get_params()
+        topic_model = NMF(**{key: value for key, value in self.manifest['topic_model'].items() if key in nmf_params})
+        topic_model.components_ = np.asarray(self.components)
+        topic_model.n_components_ = self.components.shape[0]
+        topic_model.n_features_in_ = self.components.shape[1]
+
+        return topic_model
+
+    def matches_metadata(self, metadata):
+        """
+        Checks whether the artifact's document-topic matrix holds the same comedy specials and topic weights as the
+        metadata. They drift apart when the metadata's topic weights are refreshed without exporting a new artifact.
+
+        :param pandas.DataFrame metadata: Metadata pandas dataframe the app is serving.
+        :return: True if the document-topic matrix can stand in for the metadata's topic columns.
+        :rtype: bool
+        """
+        expected = self.manifest.get('topic_weights_fingerprint')
+        if expected is None or 'comedyId' not in metadata.columns:
+            return False
+
+        return expected == topic_weights_fingerprint(metadata['comedyId'], metadata[TOPIC_COLUMNS].values)
+
+    def verify(self):
+        """
+        Checks every array file against the checksum recorded in the manifest.
+
+        :raises ValueError: If any file has been modified or corrupted.
+        """
+        for file_name, checksum in self.manifest['checksums'].items():
+            if file_checksum(os.path.join(self.path, file_name)) != checksum:
+                raise ValueError(f'Model artifact file {file_name} in {self.path} does not match its checksum.')
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+
+        if self.manifest['format_version'] != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f'Unsupported model artifact format version {self.manifest["format_version"]} in {path} '
+                             f'(expected {ARTIFACT_FORMAT_VERSION}).')
+
+        self.version = self.manifest['version']
+        with open(os.path.join(path, 'vocabulary.json')) as f:
+            self.vocabulary = json.load(f)
+
+        mmap_mode = 'r' if mmap else None
+        self.idf = np.load(os.path.join(path, 'idf.npy'), mmap_mode=mmap_mode)
+        self.components = np.load(os.path.join(path, 'components.npy'), mmap_mode=mmap_mode)
+        self.doc_topic = np.load(os.path.join(path, 'doc_topic.npy'), mmap_mode=mmap_mode)
+        self.doc_topic_unit = np.load(os.path.join(path, 'doc_topic_unit.npy'), mmap_mode=mmap_mode)
+
+
+def file_checksum(file_path):
+    """
+    :param str file_path: Path to a file.
+    :return: SHA-256 hex digest of the file's contents.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def _json_safe(params):
+    return {key: value for key, value in params.items()
+            if value is None or isinstance(value, (str, int, float, bool))}
+
+
+def write_model_artifact(root, pipeline, topic_model, doc_topic, comedy_ids=None, make_current=True):
+    """
+    Exports a fitted NLP pipeline and topic model as a new model artifact version.
+
+    :param str root: Directory containing all artifact versions.
+    :param TranscriptProcessingPipeline pipeline: Fitted pipeline whose vectorizer is a sklearn TfidfVectorizer.
+    :param topic_model: Fitted topic model (sklearn.decomposition.NMF or app.streaming.MiniBatchNMF).
+    :param numpy.ndarray doc_topic: Document-topic matrix of the training corpus, exactly as saved to the metadata.
+    :param list comedy_ids: comedyId of each row of the document-topic matrix. Without them, the app never uses the
+                            document-topic matrix in place of the metadata's topic weights.
+    :param bool make_current: If True, point `<root>/CURRENT` at the new version.
+    :return: Path to the new artifact directory.
+    :rtype: str
+    """
+    vectorizer = pipeline.vectorizer
+    if not hasattr(vectorizer, 'vocabulary_'):
+        raise ValueError('Only vectorizers with a vocabulary can be exported, not hashing vectorizers.')
+    if vectorizer.analyzer != 'word' or vectorizer.tokenizer is not None or vectorizer.preprocessor is not None \
+            or vectorizer.strip_accents is not None:
+        raise ValueError('Only word analyzers without a custom tokenizer, preprocessor or accent stripping can be '
+                         'exported.')
+
+    vocabulary = [None] * len(vectorizer.vocabulary_)
+    for term, column in vectorizer.vocabulary_.items():
+        vocabulary[column] = term
+
+    # fingerprinted before the matrix is reduced to float32, so it matches the weights saved to the metadata
+    weights_fingerprint = None if comedy_ids is None else topic_weights_fingerprint(comedy_ids, doc_topic)
+    doc_topic = np.asarray(doc_topic, dtype=np.float32)
+    arrays = {
+        'idf.npy': np.asarray(vectorizer.idf_, dtype=np.float64),
+        'components.npy': np.asarray(topic_model.components_, dtype=np.float64),
+        'doc_topic.npy': doc_topic,
+        'doc_topic_unit.npy': l2_normalize_rows(doc_topic)
+    }
+
+    # the version is derived from the contents, so re-exporting an identical model is a no-op
+    digest = hashlib.sha256(json.dumps([vocabulary, weights_fingerprint]).encode())
+    for array in arrays.values():
+        digest.update(np.ascontiguousarray(array).tobytes())
+    version = digest.hexdigest()[:16]
+
+    path = os.path.join(root, version)
+    if not os.path.exists(path):
+        staging_path = path + '.tmp'
+        os.makedirs(staging_path, exist_ok=True)
+
+        for file_name, array in arrays.items():
+            np.save(os.path.join(staging_path, file_name), array)
+        with open(os.path.join(staging_path, 'vocabulary.json'), 'w') as f:
+            json.dump(vocabulary, f)
+
+        manifest = {
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'version': version,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'vectorizer': {
+                'lowercase': vectorizer.lowercase,
+                'token_pattern': vectorizer.token_pattern,
+                'ngram_range': list(vectorizer.ngram_range),
+                'binary': vectorizer.binary,
+                'sublinear_tf': vectorizer.sublinear_tf,
+                'norm': vectorizer.norm,
+                'use_idf': vectorizer.use_idf
+            },
+            'vectorizer_stop_words': sorted(vectorizer.get_stop_words() or []),
+            'topic_model': _json_safe(topic_model.get_params()),
+            'stop_words': sorted(pipeline.stop_words),
+            'lemmatizer_stop_words': sorted(pipeline.lemmatizer_stop_words),
+            'topic_weights_fingerprint': weights_fingerprint,
+            'shapes': {file_name: list(array.shape) for file_name, array in arrays.items()},
+            'checksums': {file_name: file_checksum(os.path.join(staging_path, file_name)) for file_name in arrays}
+        }
+        with open(os.path.join(staging_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        # only a complete artifact ever appears under its final name
+        os.rename(staging_path, path)
+
+    if make_current:
+        set_current_version(root, version)
+
+    return path
+
+
+def replace_directory(staging_path, path):
+    """
+    Moves a fully written directory into place, replacing the directory already there, with renames so that a complete
+    directory is always in place (bar a moment between the renames). For indexes that aren't versioned like model
+    artifacts.
+
+    :param str staging_path: Directory holding the new contents.
+    :param str path: Directory to replace.
+    """
+    old_path = path.rstrip('/') + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(staging_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def set_current_version(root, version):
+    """
+    Atomically points `<root>/CURRENT` at an artifact version.
+
+    :param str root: Directory containing all artifact versions.
+    :param str version: Artifact version (name of its directory).
+    """
+    staging_file = os.path.join(root, 'CURRENT.tmp')
+    with open(staging_file, 'w') as f:
+        f.write(version)
+    os.replace(staging_file, os.path.join(root, 'CURRENT'))
+
+
+def clear_current_version(root):
+    """
+    Removes `<root>/CURRENT`, so the app loads the legacy pickles instead of any artifact, e.g. after fitting models
+    that can't be exported as an artifact.
+
+    :param str root: Directory containing all artifact versions.
+    """
+    try:
+        os.remove(os.path.join(root, 'CURRENT'))
+    except FileNotFoundError:
+        pass
+
+
+def current_version(root):
+    """
+    :param str root: Directory containing all artifact versions.
+    :return: Version named by `<root>/CURRENT`, or None if there isn't one.
+    :rtype: str
+    """
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(root):
+    """
+    :param str root: Directory containing all artifact versions.
+    :return: Manifests of every complete artifact version, oldest first.
+    :rtype: list
+    """
+    if not os.path.isdir(root):
+        return []
+
+    manifests = []
+    for name in os.listdir(root):
+        manifest_path = os.path.join(root, name, 'manifest.json')
+        if not name.endswith('.tmp') and os.path.isfile(manifest_path):
+            with open(manifest_path) as f:
+                manifests.append(json.load(f))
+
+    return sorted(manifests, key=lambda manifest: manifest['created'])
+
+
+def promote_version(root, version):
+    """
+    Verifies an artifact version and then makes it the current version.
+
+    :param str root: Directory containing all artifact versions.
+    :param str version: Artifact version to promote.
+    :raises ValueError: If the artifact's files don't match their checksums.
+    """
+    ModelArtifact(os.path.join(root, version), mmap=True).verify()
+    set_current_version(root, version)
+
+
+def load_current_artifact(root, mmap=True):
+    """
+    :param str root: Directory containing all artifact versions.
+    :param bool mmap: If True, memory map the arrays read-only instead of reading them into memory.
+    :return: The current model artifact, or None if no artifact has been exported.
+    :rtype: ModelArtifact
+    """
+    version = current_version(root)
+    if version is None:
+        return None
+
+    return ModelArtifact(os.path.join(root, version), mmap=mmap)
+
+
+if __name__ == '__main__':
+    from app.config import ProductionConfig
+
+    artifact_root = ProductionConfig.MODEL_ARTIFACT_ROOT
+    if sys.argv[1:] == ['list']:
+        current = current_version(artifact_root)
+        for manifest in list_versions(artifact_root):
+            marker = '*' if manifest['version'] == current else ' '
+            print(f"{marker} {manifest['version']}  {manifest['created']}  {manifest['shapes']['components.npy']}")
+    elif len(sys.argv) == 3 and sys.argv[1] == 'promote':
+        promote_version(artifact_root, sys.argv[2])
+        print(f'Current model artifact is now {sys.argv[2]}.')
+    else:
+        sys.exit('Usage: python -m app.artifacts list | promote <version>')
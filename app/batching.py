@@ -0,0 +1,119 @@
+"""
+Contains the search micro-batcher. Under gunicorn with threaded workers, each thread handling a search would otherwise
+clean, vectorize, project and rank its search term on its own. Instead, searches arriving within a few milliseconds of
+each other are collected and scored together by one call to `app.search.search_batch`, and each thread gets back its
+own results. Identical searches in flight at the same time are only scored once.
+
+There is no scheduler thread (so nothing to restart after gunicorn forks the workers): the first thread to find its
+search still pending runs the next batch, while the threads whose searches are in that batch wait for it to finish.
+Only one batch runs at a time, so searches arriving while a batch runs form the next one.
+"""
+import threading
+
+from app.metrics import REGISTRY
+from app.search import search_batch
+
+BATCH_SIZE = REGISTRY.histogram('standup_search_batch_size', 'Number of distinct searches scored together.',
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+class _PendingSearch:
+    """
+    One distinct search waiting to be scored, shared by every thread that asked for it.
+    """
+    def result(self):
+        if self.error is not None:
+            raise self.error
+
+        return self.row_ids, self.similarities
+
+    def __init__(self, query, k):
+        self.query = query
+        self.k = k
+        self.done = False
+        self.row_ids = None
+        self.similarities = None
+        self.error = None
+
+
+class SearchBatcher:
+    """
+    Coalesces searches made at the same time by different threads into batches of at most `max_batch_size` distinct
+    searches. While other searches are in flight, a search waits at most `max_wait` seconds for more to join its batch;
+    searches arriving while a batch runs are batched regardless. With `max_batch_size` 1, every search is scored on its
+    own.
+    """
+    def search(self, query, k=10):
+        """
+        Finds the top k most similar comedy specials for a search term, scored in a batch with any other searches made
+        at the same time. Blocks until the results are ready.
+
+        :param str query: Search term.
+        :param int k: Number of results to return.
+        :return: Row ids and similarities of the most similar comedy specials, most similar first.
+        :rtype: tuple
+        """
+        if self.max_batch_size <= 1:
+            [result] = search_batch([query], self.pipeline, self.topic_model, self.topic_index, k=k, cache=self.cache)
+            return result
+
+        with self._condition:
+            pending = self._in_flight.get((query, k))
+            if pending is None:
+                pending = self._in_flight[(query, k)] = _PendingSearch(query, k)
+                self._queue.append(pending)
+                self._condition.notify_all()
+
+            # when other searches are in flight, give their threads a moment to add more searches to the batch. a lone
+            # search doesn't wait, so batching adds no latency when traffic is light
+            if self.max_wait > 0 and len(self._in_flight) > 1:
+                self._condition.wait_for(lambda: pending.done or len(self._queue) >= self.max_batch_size,
+                                         timeout=self.max_wait)
+
+        while not pending.done:
+            with self._run_lock:
+                # the search may have been scored in the batch that held the lock
+                if pending.done:
+                    break
+                with self._condition:
+                    batch, self._queue = self._queue[:self.max_batch_size], self._queue[self.max_batch_size:]
+                self._run(batch)
+
+        return pending.result()
+
+    def _run(self, batch):
+        if not batch:
+            return
+
+        BATCH_SIZE.observe(len(batch))
+        queries_by_k = {}
+        for pending in batch:
+            queries_by_k.setdefault(pending.k, []).append(pending)
+
+        for k, pendings in queries_by_k.items():
+            try:
+                results = search_batch([pending.query for pending in pendings], self.pipeline, self.topic_model,
+                                       self.topic_index, k=k, cache=self.cache)
+                for pending, (row_ids, similarities) in zip(pendings, results):
+                    pending.row_ids, pending.similarities = row_ids, similarities
+            except Exception as e:
+                for pending in pendings:
+                    pending.error = e
+
+        with self._condition:
+            for pending in batch:
+                pending.done = True
+                del self._in_flight[(pending.query, pending.k)]
+            self._condition.notify_all()
+
+    def __init__(self, pipeline, topic_model, topic_index, cache=None, max_batch_size=32, max_wait=0.002):
+        self.pipeline = pipeline
+        self.topic_model = topic_model
+        self.topic_index = topic_index
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = []
+        self._in_flight = {}
+        self._condition = threading.Condition()
+        self._run_lock = threading.Lock()
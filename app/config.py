@@ -1,9 +1,64 @@
 """
 As of 8-20-2020 this does not exist in dev branch.
 """
+import json
+import os
 
 
 class ProductionConfig:
     DEVELOPMENT = False
     DEBUG = False
     ENVIRONMENT = 'production'     # for production, 'production'
+
+    # where metadata is read from: 'sqlite' (local snapshot, refreshed with `python -m app.metadata_store sync`) or
+    # 'mongo'
+    METADATA_STORE = os.environ.get('METADATA_STORE', 'sqlite')
+    METADATA_SNAPSHOT_PATH = os.environ.get('METADATA_SNAPSHOT_PATH', 'app/static/data/metadata.sqlite3')
+    # local artifacts loaded at start up
+    MODEL_ARTIFACT_ROOT = os.environ.get('MODEL_ARTIFACT_ROOT', 'app/static/ml_models/artifacts')
+    # how often (in seconds) each worker checks for a new model artifact or metadata snapshot to swap in; 0 disables
+    MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 30))
+    # how long (in seconds) after failing to load the models and metadata a worker waits before trying again
+    RESOURCES_RETRY_INTERVAL = float(os.environ.get('RESOURCES_RETRY_INTERVAL', 30))
+    # legacy pickles, only used if no model artifact has been exported
+    PIPELINE_PATH = 'app/static/ml_models/tfidf_pipeline.pkl'
+    TOPIC_MODEL_PATH = 'app/static/ml_models/tfidf_nmf_model.pkl'
+
+    # how search results are ranked: 'exact' (score every comedy special), or approximately with 'lsh' or 'ivf', which
+    # only pay off for catalogues of many thousands. SIMILARITY_PARAMS is a JSON object of backend settings, e.g.
+    # '{"n_probe": 8}' (see app.similarity)
+    SIMILARITY_BACKEND = os.environ.get('SIMILARITY_BACKEND', 'exact')
+    SIMILARITY_PARAMS = json.loads(os.environ.get('SIMILARITY_PARAMS', '{}'))
+
+    # word for word search of transcripts, comedians and titles (see app.lexical_index). SEARCH_MODE is how the search
+    # box ranks results: 'topic', 'lexical' or 'hybrid' (a blend, weighted by HYBRID_LEXICAL_WEIGHT)
+    LEXICAL_INDEX_PATH = os.environ.get('LEXICAL_INDEX_PATH', 'app/static/ml_models/lexical_index')
+    SEARCH_MODE = os.environ.get('SEARCH_MODE', 'topic')
+    HYBRID_LEXICAL_WEIGHT = float(os.environ.get('HYBRID_LEXICAL_WEIGHT', 0.5))
+
+    # precomputed "more like this" lists served by /special/<id>/similar (see app.neighbours)
+    NEIGHBOURS_PATH = os.environ.get('NEIGHBOURS_PATH', 'app/static/ml_models/neighbours')
+
+    # topic weight above which a comedy special is considered a member of a topic
+    TOPIC_THRESHOLD = float(os.environ.get('TOPIC_THRESHOLD', 0.2))
+    # number of comedy specials rendered on the home page and returned per page by /api/specials
+    CARDS_PER_PAGE = 48
+
+    # opt-in request profiling (see app.profiling): the fraction of requests to profile, how long a profiled request
+    # must take for its profile to be saved, and where. Requests sending PROFILE_TOKEN in an X-Profile-Token header are
+    # always profiled and saved
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SLOW_REQUEST_SECONDS = float(os.environ.get('PROFILE_SLOW_REQUEST_SECONDS', 0.5))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/standup_profiles')
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+
+    # concurrent searches in a worker are scored together (see app.batching): at most SEARCH_BATCH_MAX_SIZE distinct
+    # searches per batch, each waiting at most SEARCH_BATCH_MAX_WAIT seconds for others to join. 1 disables batching
+    SEARCH_BATCH_MAX_SIZE = int(os.environ.get('SEARCH_BATCH_MAX_SIZE', 32))
+    SEARCH_BATCH_MAX_WAIT = float(os.environ.get('SEARCH_BATCH_MAX_WAIT', 0.002))
+
+    # search result cache: 'memory' (per worker), 'sqlite' (shared by workers on one machine), or 'none'
+    QUERY_CACHE_BACKEND = os.environ.get('QUERY_CACHE_BACKEND', 'memory')
+    QUERY_CACHE_PATH = os.environ.get('QUERY_CACHE_PATH', '/tmp/standup_query_cache.sqlite3')
+    QUERY_CACHE_SIZE = 10000
+    QUERY_CACHE_TTL = 3600         # seconds
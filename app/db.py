@@ -6,49 +6,97 @@ This file can be run as a script.
 Stephen Kaplan, 2020-08-10
 """
 
+import os
+
 import pandas as pd
 from pymongo import MongoClient
 
+# the address of the database can be overridden with the MONGO_HOST environment variable
+DEFAULT_MONGO_HOST = '3.20.109.89'
+
+# MongoClient keeps its own connection pool, so one client is shared per host and user
+_clients = {}
+
 
-def connect_to_mongo(username, password, db_name='standupComedyDB', public_ip='3.20.109.89'):
+def connect_to_mongo(username, password, db_name='standupComedyDB', public_ip=None):
     """
-    Connect to and return Mongo database object using PyMongo.
+    Connect to and return Mongo database object using PyMongo. Connections are pooled: repeated calls with the same
+    host and credentials reuse the same client.
 
     :param str username: Mongo database username
     :param str password: Mongo database password
     :param str db_name: Mongo database name. Defaults to 'standupcomedyDB'.
-    :param str public_ip: IP address location of mongo database. Defaults to 3.20.109.89
+    :param str public_ip: IP address location of mongo database. Defaults to the MONGO_HOST environment variable, or
+                          3.20.109.89 if it isn't set.
     :return: Mongo database object
     :rtype: pymongo.database.Database
     """
-    config = {
-        'host': f'{public_ip}:27017',
-        'username': username,
-        'password': password,
-        'authSource': db_name
-    }
-    client = MongoClient(**config)
-    db = client.standupComedyDB
+    public_ip = public_ip or os.environ.get('MONGO_HOST', DEFAULT_MONGO_HOST)
 
-    return db
+    key = (public_ip, username, password, db_name)
+    if key not in _clients:
+        config = {
+            'host': f'{public_ip}:27017',
+            'username': username,
+            'password': password,
+            'authSource': db_name
+        }
+        _clients[key] = MongoClient(**config)
 
+    return _clients[key][db_name]
 
-def load_mongo_collection_as_dataframe(db, collection_name):
+
+def load_mongo_collection_as_dataframe(db, collection_name, fields=None, batch_size=1000):
     """
     Loads a mongo collection as a Pandas dataframe.
 
     :param pymongo.database.Database db: Mongo database object.
     :param str collection_name: Name of Mongo collection
+    :param list fields: Fields to load. Defaults to all fields.
+    :param int batch_size: Number of documents fetched from the server per round trip.
     :return: Dataframe containing Mongo collection contents
     :rtype: pandas.DataFrame
     """
     # get collection
     collection = db[collection_name]
 
-    # query all data from collection
-    collection_json = collection.find()
+    # query the requested fields from collection. only return _id if it's asked for
+    projection = None if fields is None else {field: 1 for field in fields}
+    if projection is not None and '_id' not in projection:
+        projection['_id'] = 0
+    collection_json = collection.find({}, projection=projection, batch_size=batch_size)
 
     # convert to pandas DataFrame
-    df_collection = pd.DataFrame(collection_json)
+    df_collection = pd.DataFrame(list(collection_json), columns=fields)
 
     return df_collection
+
+
+def iter_mongo_collection_batches(db, collection_name, fields=None, batch_size=1000, sort=None):
+    """
+    Streams a mongo collection as a series of Pandas dataframes, so that large collections never have to be held in
+    memory at once.
+
+    :param pymongo.database.Database db: Mongo database object.
+    :param str collection_name: Name of Mongo collection
+    :param list fields: Fields to load. Defaults to all fields.
+    :param int batch_size: Number of documents per dataframe (and fetched from the server per round trip).
+    :param str sort: Field to order the documents by, e.g. 'comedyId'. Should be indexed. Defaults to natural order.
+    :return: Generator of dataframes of at most batch_size rows.
+    :rtype: generator
+    """
+    projection = None if fields is None else {field: 1 for field in fields}
+    if projection is not None and '_id' not in projection:
+        projection['_id'] = 0
+    cursor = db[collection_name].find({}, projection=projection, batch_size=batch_size)
+    if sort is not None:
+        cursor = cursor.sort(sort, 1)
+
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield pd.DataFrame(batch, columns=fields)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, columns=fields)
@@ -0,0 +1,454 @@
+"""
+Contains the lexical search index: BM25 over the words of the transcripts and over the comedian and title of each
+comedy special. Topic search maps every search term onto a handful of topics, so a search for a particular bit or
+comedian only finds specials that are vaguely about the same things; lexical search finds the specials that actually
+contain the words. Words are matched individually, wherever they are in a transcript: a search for a phrase ranks
+first the transcripts containing all of its words (and containing them most often), whether or not they are next to
+each other.
+
+The transcript index is an inverted index over every word of the transcripts, after the same preprocessing (cleaning,
+lemmatizing and splitting into words) as the NLP pipeline. Unlike the pipeline's TF-IDF vocabulary, no word is dropped
+for being too rare or too common, so rare words (names, places, the word a bit turns on) can be found. There is one
+posting list per word, holding the transcripts that contain it and how often. Each posting is delta encoded (the gap
+from the previous transcript in the list, then the word count) as variable-length integers, so most postings take two
+bytes. Scoring a search term only decodes the posting lists of its words, never every transcript. The index is a
+directory holding
+
+    manifest.json           format version, BM25 settings and a fingerprint of the preprocessing it was built with
+    comedy_ids.npy          comedyId of each transcript, which lines the transcripts up with the metadata rows
+    terms.npy               every word, UTF-8 encoded and concatenated in sorted order
+    term_offsets.npy        where each word starts in terms.npy, plus where the last ends
+    offsets.npy             where each word's posting list starts in postings.npy, plus where the last ends
+    postings.npy            every posting list, encoded
+    doc_freqs.npy           number of transcripts containing each word
+    doc_lengths.npy         number of words in each transcript
+
+Arrays are loaded with memory mapping and read-only, like the model artifacts (see app.artifacts), so every worker
+shares the same pages. The comedian and title index is tiny, so it is built from the metadata when the app starts
+rather than stored. The transcript index is written by `analysis/create_nlp_pipeline.py` (or `fit_streaming.py`).
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+from app.artifacts import replace_directory
+from app.similarity import select_top_k
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_FORMAT_VERSION = 2
+
+
+def encode_varints(values):
+    """
+    Encodes non-negative integers as variable-length integers: 7 bits per byte, least significant first, with the high
+    bit set on every byte but the last of each integer.
+
+    :param numpy.ndarray values: Non-negative integers.
+    :return: Encoded bytes, and the number of bytes of each integer.
+    :rtype: tuple
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for i in range(1, 10):
+        n_bytes += values >= np.uint64(1 << (7 * i))
+
+    starts = np.cumsum(n_bytes) - n_bytes
+    encoded = np.empty(n_bytes.sum(), dtype=np.uint8)
+    for i in range(int(n_bytes.max(initial=0))):
+        mask = n_bytes > i
+        low_bits = (values[mask] >> np.uint64(7 * i)) & np.uint64(0x7f)
+        continuation = (n_bytes[mask] > i + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[mask] + i] = low_bits | continuation
+
+    return encoded, n_bytes
+
+
+def decode_varints(encoded):
+    """
+    :param numpy.ndarray encoded: Bytes written by encode_varints.
+    :return: Decoded integers.
+    :rtype: numpy.ndarray
+    """
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    if len(encoded) == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    ends = np.flatnonzero(encoded < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = (np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)) * 7
+    low_bits = (encoded & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+
+    return np.add.reduceat(low_bits, starts)
+
+
+def word_analyzer(pipeline):
+    """
+    :param TranscriptProcessingPipeline pipeline: NLP pipeline.
+    :return: Function splitting a preprocessed document into words the same way the pipeline's vectorizer does
+             (lowercasing, tokenizing and dropping the vectorizer's stop words), without its vocabulary.
+    :rtype: function
+    """
+    return pipeline.vectorizer.build_analyzer()
+
+
+def analysis_fingerprint(pipeline):
+    """
+    :param TranscriptProcessingPipeline pipeline: NLP pipeline.
+    :return: Identifier of everything that determines which words a document is split into: the pipeline's
+             preprocessing and its vectorizer's word analysis settings.
+    :rtype: str
+    """
+    vectorizer = pipeline.vectorizer
+    params = vectorizer.get_params()
+    analysis = {name: params.get(name) for name in ['analyzer', 'lowercase', 'strip_accents', 'token_pattern',
+                                                    'ngram_range', 'stop_words']}
+    # the stop words themselves, since a fitted sklearn vectorizer may name a built-in list ('english') where the model
+    # artifact exported from it (see app.artifacts) holds the words
+    if hasattr(vectorizer, 'get_stop_words'):
+        analysis['stop_words'] = sorted(vectorizer.get_stop_words() or [])
+    digest = hashlib.sha256(pipeline.preprocessing_fingerprint().encode())
+    digest.update(json.dumps(analysis, sort_keys=True, default=str).encode())
+
+    return digest.hexdigest()[:16]
+
+
+class TermList:
+    """
+    Sorted list of words, stored as one array of UTF-8 bytes so that it can be memory mapped. Looking a word up is a
+    binary search.
+    """
+    def columns(self, words):
+        """
+        :param list words: Words to look up.
+        :return: Position of each of the words that is in the list.
+        :rtype: numpy.ndarray
+        """
+        columns = []
+        for word in words:
+            column = bisect.bisect_left(self, word)
+            if column < len(self) and self[column] == word:
+                columns.append(column)
+
+        return np.array(columns, dtype=np.int64)
+
+    @property
+    def arrays(self):
+        return {'terms.npy': self.encoded, 'term_offsets.npy': self.offsets}
+
+    @classmethod
+    def from_words(cls, words):
+        """
+        :param list words: Words, in sorted order.
+        :return: Term list of the words.
+        :rtype: TermList
+        """
+        encoded = [word.encode('utf-8') for word in words]
+        offsets = np.concatenate([[0], np.cumsum([len(word) for word in encoded], dtype=np.int64)]).astype(np.int64)
+
+        return cls(offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+    def __getitem__(self, column):
+        return self.encoded[self.offsets[column]:self.offsets[column + 1]].tobytes().decode('utf-8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __init__(self, offsets, encoded):
+        self.offsets = offsets
+        self.encoded = encoded
+
+
+class PostingLists:
+    """
+    Delta and variable-length encoded posting lists of one field, scored with BM25.
+    """
+    def postings(self, term):
+        """
+        :param int term: Term (e.g. vocabulary column).
+        :return: Documents containing the term, in ascending order, and how often it occurs in each.
+        :rtype: tuple
+        """
+        values = decode_varints(self.encoded[self.offsets[term]:self.offsets[term + 1]])
+        documents = np.cumsum(values[0::2]).astype(np.int64)
+
+        return documents, values[1::2].astype(np.float32)
+
+    def score(self, terms):
+        """
+        BM25 scores of every document containing at least one of the terms.
+
+        :param numpy.ndarray terms: Terms of a search. Repeats are ignored.
+        :return: Matching documents, in ascending order, and their scores.
+        :rtype: tuple
+        """
+        matches = []
+        contributions = []
+        n_documents = len(self.doc_lengths)
+        for term in np.unique(terms):
+            doc_freq = self.doc_freqs[term]
+            if doc_freq == 0:
+                continue
+
+            documents, counts = self.postings(term)
+            idf = np.log(1 + (n_documents - doc_freq + 0.5) / (doc_freq + 0.5))
+            length_norm = 1 - self.b + self.b * self.doc_lengths[documents] / self.average_length
+            matches.append(documents)
+            contributions.append(idf * counts * (self.k1 + 1) / (counts + self.k1 * length_norm))
+
+        if not matches:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        documents, positions = np.unique(np.concatenate(matches), return_inverse=True)
+        scores = np.bincount(positions, weights=np.concatenate(contributions))
+
+        return documents, scores.astype(np.float32)
+
+    @property
+    def arrays(self):
+        return {'offsets.npy': self.offsets, 'postings.npy': self.encoded, 'doc_freqs.npy': self.doc_freqs,
+                'doc_lengths.npy': self.doc_lengths}
+
+    @classmethod
+    def from_counts(cls, counts, k1=1.2, b=0.75):
+        """
+        :param scipy.sparse.spmatrix counts: Document-term matrix of term counts.
+        :param float k1: BM25 term frequency saturation.
+        :param float b: BM25 document length normalization.
+        :return: Posting lists of every term (column).
+        :rtype: PostingLists
+        """
+        by_term = sparse.csc_matrix(counts, dtype=np.int64)
+        by_term.sum_duplicates()
+        by_term.sort_indices()
+
+        # each posting is the gap from the previous document in the term's list (or the document itself, for the
+        # first) followed by the count
+        documents = by_term.indices.astype(np.int64)
+        gaps = np.diff(documents, prepend=0)
+        list_starts = by_term.indptr[:-1][np.diff(by_term.indptr) > 0]
+        gaps[list_starts] = documents[list_starts]
+
+        values = np.empty(2 * len(documents), dtype=np.uint64)
+        values[0::2] = gaps
+        values[1::2] = by_term.data
+        encoded, n_bytes = encode_varints(values)
+        offsets = np.concatenate([[0], np.cumsum(n_bytes)])[2 * by_term.indptr].astype(np.int64)
+
+        doc_freqs = np.diff(by_term.indptr).astype(np.int32)
+        doc_lengths = np.asarray(by_term.sum(axis=1)).ravel().astype(np.float32)
+
+        return cls(offsets, encoded, doc_freqs, doc_lengths, k1=k1, b=b)
+
+    def __init__(self, offsets, encoded, doc_freqs, doc_lengths, k1=1.2, b=0.75):
+        self.offsets = offsets
+        self.encoded = encoded
+        self.doc_freqs = doc_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.average_length = float(np.mean(doc_lengths)) if len(doc_lengths) else 1.0
+        if self.average_length == 0:
+            self.average_length = 1.0
+
+
+class LexicalIndex:
+    """
+    BM25 search over the transcripts (if a transcript index has been built) and over the comedian and title of every
+    comedy special. Name matches are weighted by `name_weight`, since a search for a comedian or title is a strong
+    signal. Results are metadata row ids.
+    """
+    def score(self, preprocessed_query, query):
+        """
+        Lexical scores of every comedy special matching a search term.
+
+        :param str preprocessed_query: The search term after cleaning and lemmatizing (see
+                                       `TranscriptProcessingPipeline.preprocess`), matched against the transcripts.
+        :param str query: The search term as entered, matched against comedians and titles.
+        :return: Matching metadata rows, in ascending order, and their scores.
+        :rtype: tuple
+        """
+        rows = []
+        scores = []
+        if self.transcripts is not None and preprocessed_query:
+            terms = self.transcript_terms.columns(self.analyzer(preprocessed_query))
+            if len(terms):
+                documents, transcript_scores = self.transcripts.score(terms)
+                documents_rows = self.transcript_rows[documents]
+                in_metadata = documents_rows >= 0
+                rows.append(documents_rows[in_metadata])
+                scores.append(transcript_scores[in_metadata])
+        if self.names is not None:
+            name_rows, name_scores = self.names.score(self.name_vectorizer.transform([query]).indices)
+            rows.append(name_rows)
+            scores.append(self.name_weight * name_scores)
+
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        rows, positions = np.unique(np.concatenate(rows), return_inverse=True)
+        return rows, np.bincount(positions, weights=np.concatenate(scores)).astype(np.float32)
+
+    def top_k(self, preprocessed_query, query, k=10):
+        """
+        :param str preprocessed_query: The search term after cleaning and lemmatizing.
+        :param str query: The search term as entered.
+        :param int k: Number of results to return.
+        :return: Metadata rows of the (at most) k best matches, best first, and their scores.
+        :rtype: tuple
+        """
+        rows, scores = self.score(preprocessed_query, query)
+        top, top_scores = select_top_k(scores[np.newaxis], k)
+
+        return rows[top[0]], top_scores[0]
+
+    @classmethod
+    def from_metadata(cls, metadata, path=None, pipeline=None, mmap=True, name_weight=2.0):
+        """
+        Builds the comedian and title index from the metadata, and loads the transcript index if there is one that was
+        built with the same preprocessing as the NLP pipeline.
+
+        :param pandas.DataFrame metadata: Metadata pandas dataframe.
+        :param str path: Directory of the transcript index.
+        :param TranscriptProcessingPipeline pipeline: NLP pipeline that search terms are preprocessed with.
+        :param bool mmap: If True, memory map the transcript index read-only instead of reading it into memory.
+        :param float name_weight: Weight of comedian and title matches relative to transcript matches.
+        :return: Lexical index.
+        :rtype: LexicalIndex
+        """
+        names, name_vectorizer = None, None
+        if len(metadata):
+            name_vectorizer = CountVectorizer(lowercase=True, strip_accents='unicode', token_pattern=r'(?u)\b\w+\b')
+            name_counts = name_vectorizer.fit_transform(metadata['comedian'].astype(str) + ' ' +
+                                                        metadata['title'].astype(str))
+            names = PostingLists.from_counts(name_counts)
+
+        transcripts, transcript_terms, transcript_rows, analyzer = None, None, None, None
+        if path is not None and pipeline is not None and os.path.exists(os.path.join(path, 'manifest.json')):
+            transcripts, transcript_terms, comedy_ids = load_transcript_index(path, analysis_fingerprint(pipeline),
+                                                                              mmap=mmap)
+            if transcripts is not None and 'comedyId' not in metadata.columns:
+                logger.warning('The metadata has no comedyId column to line transcripts up with; searching comedians '
+                               'and titles only.')
+                transcripts = None
+            elif transcripts is not None:
+                row_of_comedy_id = dict(zip(metadata['comedyId'], range(len(metadata))))
+                transcript_rows = np.array([row_of_comedy_id.get(comedy_id, -1) for comedy_id in comedy_ids],
+                                           dtype=np.int64)
+                analyzer = word_analyzer(pipeline)
+
+        return cls(transcripts, transcript_terms, transcript_rows, analyzer, names, name_vectorizer,
+                   name_weight=name_weight)
+
+    def __init__(self, transcripts, transcript_terms, transcript_rows, analyzer, names, name_vectorizer,
+                 name_weight=2.0):
+        self.transcripts = transcripts
+        self.transcript_terms = transcript_terms
+        self.transcript_rows = transcript_rows
+        self.analyzer = analyzer
+        self.names = names
+        self.name_vectorizer = name_vectorizer
+        self.name_weight = name_weight
+
+
+def load_transcript_index(path, fingerprint=None, mmap=True):
+    """
+    :param str path: Directory of the transcript index.
+    :param str fingerprint: Analysis fingerprint of the NLP pipeline (see analysis_fingerprint), which the index must
+                            have been built with.
+    :param bool mmap: If True, memory map the arrays read-only instead of reading them into memory.
+    :return: Transcript posting lists, their words and the comedyId of each transcript, or (None, None, None) if the
+             index was built with different preprocessing.
+    :rtype: tuple
+    """
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    if manifest['format_version'] != LEXICAL_INDEX_FORMAT_VERSION:
+        raise ValueError(f'Unsupported lexical index format version {manifest["format_version"]} in {path} '
+                         f'(expected {LEXICAL_INDEX_FORMAT_VERSION}).')
+    if fingerprint is None or fingerprint != manifest['analysis_fingerprint']:
+        logger.warning('The lexical index in %s was built with different preprocessing than the NLP pipeline; '
+                       'searching comedians and titles only. Rebuild it with analysis/create_nlp_pipeline.py.', path)
+        return None, None, None
+
+    mmap_mode = 'r' if mmap else None
+    arrays = {file_name: np.load(os.path.join(path, file_name), mmap_mode=mmap_mode)
+              for file_name in ['offsets.npy', 'postings.npy', 'doc_freqs.npy', 'doc_lengths.npy', 'terms.npy',
+                                'term_offsets.npy', 'comedy_ids.npy']}
+    transcripts = PostingLists(arrays['offsets.npy'], arrays['postings.npy'], arrays['doc_freqs.npy'],
+                               arrays['doc_lengths.npy'], k1=manifest['k1'], b=manifest['b'])
+
+    return transcripts, TermList(arrays['term_offsets.npy'], arrays['terms.npy']), arrays['comedy_ids.npy']
+
+
+def count_terms(analyzer, preprocessed_corpus, vocabulary):
+    """
+    Counts every word of a corpus, however rare or common, adding the words not already in the vocabulary to it. A
+    corpus can be counted in batches by passing each batch the same vocabulary.
+
+    :param analyzer: Function splitting a preprocessed document into words (see word_analyzer).
+    :param list preprocessed_corpus: Cleaned and lemmatized documents (see `TranscriptProcessingPipeline.preprocess`).
+    :param dict vocabulary: Maps each word counted so far to its column. Updated in place.
+    :return: Document-term matrix of how often each word occurs in each document, with a column for every word in the
+             vocabulary so far.
+    :rtype: scipy.sparse.csr_matrix
+    """
+    columns = []
+    indptr = [0]
+    for document in preprocessed_corpus:
+        columns.extend(vocabulary.setdefault(word, len(vocabulary)) for word in analyzer(document))
+        indptr.append(len(columns))
+
+    counts = sparse.csr_matrix((np.ones(len(columns), dtype=np.int32), np.asarray(columns, dtype=np.int64), indptr),
+                               shape=(len(indptr) - 1, len(vocabulary)))
+    counts.sum_duplicates()
+
+    return counts
+
+
+def write_transcript_index(path, counts, comedy_ids, vocabulary, fingerprint, k1=1.2, b=0.75):
+    """
+    Builds the transcript index and writes it to a directory, replacing any index already there.
+
+    :param str path: Directory to write the index to.
+    :param scipy.sparse.spmatrix counts: Document-term matrix of word counts, one row per transcript (see count_terms).
+    :param list comedy_ids: comedyId of each transcript.
+    :param dict vocabulary: Maps each word to its column in the counts.
+    :param str fingerprint: Analysis fingerprint of the NLP pipeline the transcripts were preprocessed with (see
+                            analysis_fingerprint).
+    :param float k1: BM25 term frequency saturation.
+    :param float b: BM25 document length normalization.
+    """
+    # posting lists are stored in word order, so a word's column is its position in the sorted term list
+    words = sorted(vocabulary)
+    columns = np.array([vocabulary[word] for word in words], dtype=np.int64)
+    transcripts = PostingLists.from_counts(sparse.csc_matrix(counts)[:, columns], k1=k1, b=b)
+    terms = TermList.from_words(words)
+
+    staging_path = path.rstrip('/') + '.tmp'
+    shutil.rmtree(staging_path, ignore_errors=True)
+    os.makedirs(staging_path)
+
+    arrays = dict(transcripts.arrays, **terms.arrays, **{'comedy_ids.npy': np.asarray(comedy_ids)})
+    for file_name, array in arrays.items():
+        np.save(os.path.join(staging_path, file_name), array)
+    manifest = {
+        'format_version': LEXICAL_INDEX_FORMAT_VERSION,
+        'analysis_fingerprint': fingerprint,
+        'n_documents': counts.shape[0],
+        'n_terms': len(words),
+        'k1': k1,
+        'b': b
+    }
+    with open(os.path.join(staging_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    replace_directory(staging_path, path)
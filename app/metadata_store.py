@@ -0,0 +1,153 @@
+"""
+Contains the stores the comedy special metadata can be loaded from: the remote Mongo database, or a local SQLite
+snapshot of it. The web app reads the local snapshot by default, so serving requests never depends on the database,
+and any local SQLite file with the same columns can stand in for Mongo.
+
+If this file is run as a script, it will refresh the local snapshot from Mongo:
+
+    python -m app.metadata_store sync
+"""
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+
+from app.topics import TOPIC_COLUMNS
+
+# the fields the web app uses. everything else in the collection is left on the server
+APP_METADATA_FIELDS = ['comedyId', 'comedian', 'title', 'year', 'imageUrl'] + TOPIC_COLUMNS
+
+
+class MetadataStore:
+    """
+    Somewhere the metadata can be loaded from.
+    """
+    def load(self):
+        """
+        :return: Metadata pandas dataframe, one row per comedy special, in a stable order.
+        :rtype: pandas.DataFrame
+        """
+        raise NotImplementedError
+
+
+class MongoMetadataStore(MetadataStore):
+    """
+    Metadata stored in the remote Mongo database.
+    """
+    def load(self):
+        # only needed (and only importable) where there is access to the database
+        from app.db import connect_to_mongo, load_mongo_collection_as_dataframe
+
+        username, password = self.username, self.password
+        if username is None:
+            from app.creds import USERNAME as username, PWD as password
+
+        db = connect_to_mongo(username, password)
+
+        metadata = load_mongo_collection_as_dataframe(db, self.collection_name, fields=self.fields,
+                                                      batch_size=self.batch_size)
+
+        # comedy specials ingested since the topic model was last fit have no topic weights yet, so can't be shown
+        topic_columns = [column for column in TOPIC_COLUMNS if column in metadata.columns]
+        if topic_columns:
+            metadata = metadata.dropna(subset=topic_columns)
+
+        # the models' document-topic rows are in comedyId order, which isn't necessarily the collection's order
+        if 'comedyId' in metadata.columns:
+            metadata = metadata.sort_values('comedyId').reset_index(drop=True)
+
+        return metadata
+
+    def __init__(self, username=None, password=None, collection_name='metadata', fields=None, batch_size=1000):
+        self.username = username
+        self.password = password
+        self.collection_name = collection_name
+        self.fields = fields
+        self.batch_size = batch_size
+
+
+class SQLiteMetadataStore(MetadataStore):
+    """
+    Metadata stored in a table of a local SQLite file.
+    """
+    TABLE = 'metadata'
+
+    def load(self):
+        # connecting would create an empty database, so check that the snapshot exists first
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f'No metadata snapshot at {self.path}.')
+
+        with sqlite3.connect(f'file:{self.path}?mode=ro', uri=True) as connection:
+            return pd.read_sql(f'SELECT * FROM {self.TABLE} ORDER BY rowid', connection)
+
+    def save(self, metadata):
+        """
+        Replaces the snapshot with the given metadata. The new file is written next to the old one and swapped in
+        atomically, so readers never see a partially written snapshot.
+
+        :param pandas.DataFrame metadata: Metadata pandas dataframe.
+        """
+        metadata = metadata.copy()
+        # store mongo's ObjectIds as strings so that loading the snapshot doesn't depend on pymongo
+        if '_id' in metadata.columns:
+            metadata['_id'] = metadata['_id'].astype(str)
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        staging_path = self.path + '.tmp'
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+        with sqlite3.connect(staging_path) as connection:
+            metadata.to_sql(self.TABLE, connection, index=False)
+        os.replace(staging_path, self.path)
+
+    def __init__(self, path):
+        self.path = path
+
+
+def create_metadata_store(backend='sqlite', path=None):
+    """
+    Builds the metadata store the app reads from.
+
+    :param str backend: 'sqlite' for the local snapshot or 'mongo' for the remote database.
+    :param str path: Path to the SQLite snapshot. Required for the 'sqlite' backend.
+    :return: Metadata store.
+    :rtype: MetadataStore
+    """
+    if backend == 'sqlite':
+        if path is None:
+            raise ValueError('A path is required for the sqlite metadata store.')
+        return SQLiteMetadataStore(path)
+    elif backend == 'mongo':
+        return MongoMetadataStore(fields=APP_METADATA_FIELDS)
+
+    raise ValueError(f'Unknown metadata store backend: {backend}')
+
+
+def sync_metadata(source, target):
+    """
+    Copies the metadata from one store into a local snapshot.
+
+    :param MetadataStore source: Store to read from, e.g. Mongo.
+    :param SQLiteMetadataStore target: Snapshot to replace.
+    :return: Number of comedy specials copied.
+    :rtype: int
+    """
+    metadata = source.load()
+    target.save(metadata)
+
+    return len(metadata)
+
+
+if __name__ == '__main__':
+    from app.config import ProductionConfig
+
+    if sys.argv[1:] != ['sync']:
+        sys.exit('Usage: python -m app.metadata_store sync')
+
+    n_specials = sync_metadata(MongoMetadataStore(fields=APP_METADATA_FIELDS),
+                               SQLiteMetadataStore(ProductionConfig.METADATA_SNAPSHOT_PATH))
+    print(f'Saved {n_specials} comedy specials to {ProductionConfig.METADATA_SNAPSHOT_PATH}.')
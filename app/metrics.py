@@ -0,0 +1,124 @@
+"""
+Contains the app's latency metrics: histograms of how long each request and each stage of handling it (cleaning,
+lemmatizing, vectorizing, topic projection, ranking, building card data, rendering) take, exposed in the Prometheus
+text format on the `/metrics` endpoint. Recording a measurement is a lock and a few integer increments, so the metrics
+stay on in production.
+
+Each gunicorn worker keeps its own histograms, so `/metrics` reports the worker that answered the scrape.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds (in seconds) of the histogram buckets: from half a millisecond up to ten seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(label_names, label_values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """
+    Prometheus histogram: counts of observations falling in each bucket, plus their sum and count, kept separately for
+    each combination of label values.
+    """
+    def observe(self, value, *label_values):
+        """
+        :param float value: Observed value, e.g. a duration in seconds.
+        :param label_values: Value of each label, in the order of `label_names`.
+        """
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bucket] += 1
+            series[1] += value
+
+    def render(self):
+        """
+        :return: The histogram in the Prometheus text exposition format.
+        :rtype: str
+        """
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((label_values, list(counts), total) for label_values, (counts, total)
+                            in self._series.items())
+
+        for label_values, counts, total in series:
+            cumulative = 0
+            for upper_bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, f'le="{upper_bound}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+
+        return '\n'.join(lines) + '\n'
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+
+class MetricsRegistry:
+    """
+    The set of metrics exposed on `/metrics`.
+    """
+    def histogram(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Creates a histogram and registers it.
+
+        :param str name: Metric name.
+        :param str help: Description of the metric.
+        :param tuple label_names: Names of the labels.
+        :param tuple buckets: Upper bounds of the buckets.
+        :return: New histogram.
+        :rtype: Histogram
+        """
+        histogram = Histogram(name, help, label_names=label_names, buckets=buckets)
+        self.metrics.append(histogram)
+
+        return histogram
+
+    def render(self):
+        """
+        :return: Every registered metric in the Prometheus text exposition format.
+        :rtype: str
+        """
+        return ''.join(metric.render() for metric in self.metrics)
+
+    def __init__(self):
+        self.metrics = []
+
+
+REGISTRY = MetricsRegistry()
+REQUEST_SECONDS = REGISTRY.histogram('standup_request_duration_seconds', 'Time spent handling each request.',
+                                     label_names=('endpoint',))
+STAGE_SECONDS = REGISTRY.histogram('standup_stage_duration_seconds', 'Time spent in each stage of handling requests.',
+                                   label_names=('stage',))
+
+
+@contextmanager
+def timed(stage):
+    """
+    Records how long the body of a `with` block takes as one observation of a stage.
+
+    :param str stage: Name of the stage, e.g. 'lemmatize'.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
@@ -0,0 +1,202 @@
+"""
+Contains the precomputed "more like this" lists: for every comedy special, the comedy specials closest to it in topic
+space (by cosine similarity of their topic weights). Finding them on demand would score every comedy special on every
+click, so they are computed once, after the topic model is fit, and looking one up is a single array row.
+
+They are computed in blocks of rows against blocks of columns, keeping only the running top k of each row, so the
+N x N similarity matrix is never in memory. The lists are a directory holding
+
+    manifest.json           format version, k, and a fingerprint of the metadata they were computed from
+    comedy_ids.npy          comedyId of each row, which lines the lists up with the metadata rows
+    neighbours.npy          int32 metadata rows of each comedy special's k nearest comedy specials, nearest first
+    similarities.npy        float16 cosine similarity of each of them
+
+Arrays are memory mapped read-only, like the model artifacts. If this file is run as a script, it computes the lists
+from the metadata snapshot (so run it after `analysis/modeling.py` and `python -m app.metadata_store sync`):
+
+    python -m app.neighbours build [k]
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from app.artifacts import replace_directory
+from app.similarity import l2_normalize_rows, select_top_k
+from app.topics import TOPIC_COLUMNS, topic_weights_fingerprint
+
+logger = logging.getLogger(__name__)
+
+NEIGHBOURS_FORMAT_VERSION = 1
+
+
+def _merge_top_k(best_ids, best_scores, rows, ids, scores):
+    # merges candidate (row, id, score) triples into each row's current top k, keeping the top k
+    n_rows, k = best_ids.shape
+    all_rows = np.concatenate([np.repeat(np.arange(n_rows), k), rows])
+    all_ids = np.concatenate([best_ids.ravel(), ids])
+    all_scores = np.concatenate([best_scores.ravel(), scores])
+
+    order = np.lexsort((-all_scores, all_rows))
+    rank = np.arange(len(order)) - np.searchsorted(all_rows[order], all_rows[order])
+    keep = order[rank < k]
+
+    return all_ids[keep].reshape(n_rows, k), all_scores[keep].reshape(n_rows, k)
+
+
+def compute_neighbours(vectors, k=20, row_block_size=1024, column_block_size=16384):
+    """
+    Finds the k rows most similar to each row (excluding itself) by cosine similarity.
+
+    :param numpy.ndarray vectors: Row vectors, e.g. the document-topic matrix.
+    :param int k: Number of neighbours per row.
+    :param int row_block_size: Number of rows scored at once.
+    :param int column_block_size: Number of rows scored against at once. Memory use is about row_block_size *
+                                  column_block_size * 4 bytes.
+    :return: Neighbouring rows of each row (nearest first) as int32, and their similarities as float16, both of shape
+             (n_rows, k).
+    :rtype: tuple
+    """
+    vectors = l2_normalize_rows(vectors)
+    n_rows = len(vectors)
+    k = max(min(k, n_rows - 1), 0)
+    column_block_size = max(column_block_size, k + 1)
+    neighbours = np.zeros((n_rows, k), dtype=np.int32)
+    similarities = np.zeros((n_rows, k), dtype=np.float16)
+    if k == 0:
+        return neighbours, similarities
+
+    for row_start in range(0, n_rows, row_block_size):
+        rows = vectors[row_start:row_start + row_block_size]
+        row_ids = np.arange(row_start, row_start + len(rows))
+        best_ids, best_scores = None, None
+
+        for column_start in range(0, n_rows, column_block_size):
+            scores = rows @ vectors[column_start:column_start + column_block_size].T
+            # a comedy special isn't its own neighbour
+            in_block = (row_ids >= column_start) & (row_ids < column_start + scores.shape[1])
+            scores[np.flatnonzero(in_block), row_ids[in_block] - column_start] = -np.inf
+
+            if best_ids is None:
+                best_ids, best_scores = select_top_k(scores, k)
+                continue
+
+            # after the first block, most scores are below the row's current k-th best, so only the few above it are
+            # merged in, rather than partially sorting every block
+            candidates = np.flatnonzero(scores > best_scores[:, -1:])
+            if len(candidates):
+                candidate_rows, candidate_columns = np.divmod(candidates, scores.shape[1])
+                best_ids, best_scores = _merge_top_k(best_ids, best_scores, candidate_rows,
+                                                     candidate_columns + column_start, scores.ravel()[candidates])
+
+        neighbours[row_start:row_start + len(rows)] = best_ids
+        similarities[row_start:row_start + len(rows)] = best_scores
+
+    return neighbours, similarities
+
+
+def _metadata_fingerprint(metadata):
+    return topic_weights_fingerprint(metadata['comedyId'], metadata[TOPIC_COLUMNS].values)
+
+
+class NeighbourLists:
+    """
+    Precomputed nearest comedy specials of every comedy special.
+    """
+    def similar(self, row_id, k=10):
+        """
+        :param int row_id: Metadata row of a comedy special.
+        :param int k: Number of neighbours to return, at most `self.k`.
+        :return: Metadata rows of the comedy special's nearest comedy specials (nearest first) and their cosine
+                 similarities.
+        :rtype: tuple
+        """
+        return np.asarray(self.neighbours[row_id, :k]), np.asarray(self.similarities[row_id, :k], dtype=np.float32)
+
+    @property
+    def k(self):
+        return self.neighbours.shape[1]
+
+    @classmethod
+    def load(cls, path, metadata, mmap=True):
+        """
+        :param str path: Directory of the neighbour lists.
+        :param pandas.DataFrame metadata: Metadata pandas dataframe the app is serving.
+        :param bool mmap: If True, memory map the arrays read-only instead of reading them into memory.
+        :return: Neighbour lists, or None if there are none or they were computed from different metadata.
+        :rtype: NeighbourLists
+        """
+        manifest_path = os.path.join(path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return None
+
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        if manifest['format_version'] != NEIGHBOURS_FORMAT_VERSION:
+            raise ValueError(f'Unsupported neighbour lists format version {manifest["format_version"]} in {path} '
+                             f'(expected {NEIGHBOURS_FORMAT_VERSION}).')
+        if 'comedyId' not in metadata.columns or _metadata_fingerprint(metadata) != manifest['metadata_fingerprint']:
+            logger.warning('The neighbour lists in %s were computed from different metadata; finding similar comedy '
+                           'specials on demand instead. Rebuild them with `python -m app.neighbours build`.', path)
+            return None
+
+        mmap_mode = 'r' if mmap else None
+        return cls(np.load(os.path.join(path, 'neighbours.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, 'similarities.npy'), mmap_mode=mmap_mode))
+
+    def __init__(self, neighbours, similarities):
+        self.neighbours = neighbours
+        self.similarities = similarities
+
+
+def write_neighbours(path, metadata, k=20, **block_sizes):
+    """
+    Computes the neighbour lists of every comedy special in the metadata and writes them to a directory, replacing any
+    lists already there.
+
+    :param str path: Directory to write the lists to.
+    :param pandas.DataFrame metadata: Metadata pandas dataframe with comedyId and topic columns, in the order the app
+                                      loads it.
+    :param int k: Number of neighbours per comedy special.
+    :param block_sizes: Block sizes passed to compute_neighbours.
+    """
+    neighbours, similarities = compute_neighbours(metadata[TOPIC_COLUMNS].values, k=k, **block_sizes)
+
+    staging_path = path.rstrip('/') + '.tmp'
+    shutil.rmtree(staging_path, ignore_errors=True)
+    os.makedirs(staging_path)
+
+    np.save(os.path.join(staging_path, 'comedy_ids.npy'), metadata['comedyId'].values)
+    np.save(os.path.join(staging_path, 'neighbours.npy'), neighbours)
+    np.save(os.path.join(staging_path, 'similarities.npy'), similarities)
+    manifest = {
+        'format_version': NEIGHBOURS_FORMAT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'k': neighbours.shape[1],
+        'n_specials': len(metadata),
+        'metadata_fingerprint': _metadata_fingerprint(metadata)
+    }
+    with open(os.path.join(staging_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    replace_directory(staging_path, path)
+
+
+if __name__ == '__main__':
+    from app.config import ProductionConfig
+    from app.metadata_store import create_metadata_store
+
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != 'build':
+        sys.exit('Usage: python -m app.neighbours build [k]')
+
+    metadata = create_metadata_store(ProductionConfig.METADATA_STORE,
+                                     path=ProductionConfig.METADATA_SNAPSHOT_PATH).load()
+    start = time.perf_counter()
+    write_neighbours(ProductionConfig.NEIGHBOURS_PATH, metadata, k=int(sys.argv[2]) if len(sys.argv) == 3 else 20)
+    print(f'Saved the neighbour lists of {len(metadata)} comedy specials to {ProductionConfig.NEIGHBOURS_PATH} in '
+          f'{time.perf_counter() - start:.1f}s.')
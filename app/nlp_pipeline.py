@@ -1,11 +1,159 @@
+import hashlib
+import math
+import os
 import re
 import string
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import nltk
 
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('wordnet')
+from app.metrics import timed
+
+# NLTK data used by the pipeline. it is never downloaded at run time; see `ensure_nltk_data`.
+NLTK_RESOURCES = ['corpora/stopwords', 'corpora/wordnet']
+
+# bump whenever `clean_document` or `lemmatize_document` change what they produce, so that preprocessed text cached by
+# `TranscriptProcessingPipeline.preprocess` is computed again
+PREPROCESSING_VERSION = 1
+
+# text cleaning patterns, compiled once at import. `clean_document` applies them in a fixed order, since several of the
+# steps only produce the same output when run in that order. the "words with numbers" and "crazy expressions" patterns
+# only start matching at the beginning of a word, which removes exactly the same words as `\w*\d\w*` and
+# `\w*((\w)\2{2,})\w*` without retrying from every character inside words that don't match.
+BRACKETS_PATTERN = re.compile(r'\[.*?\]')                              # text between brackets (meta-notes)
+PARENTHESES_PATTERN = re.compile(r'\(.*?\)')                           # text between parenthesis
+PUNCTUATION_PATTERN = re.compile(r'[%s]' % re.escape(string.punctuation))  # punctuation
+WORDS_WITH_NUMBERS_PATTERN = re.compile(r'(?<!\w)\w*?\d\w*')            # words with numbers
+MUSIC_PATTERN = re.compile(r'♪.*?♪')                                   # music
+REMOVED_CHARACTERS_PATTERN = re.compile('[“”…–\n]')                    # quotes, hyphens, line breaks
+REPEATED_CHARACTERS_PATTERN = re.compile(r'(?<!\w)\w*?(\w)\1\1\w*')    # crazy expressions like "aaahh"
+
+
+def content_hash(text):
+    """
+    :param str text: Any text, e.g. a raw transcript.
+    :return: SHA-256 hex digest of the text, which changes whenever the text does.
+    :rtype: str
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# the pipeline each worker process of a parallel `TranscriptProcessingPipeline.preprocess` uses. set once per process
+# by the pool's initializer, so the pipeline is sent to each worker once rather than with every document
+_worker_pipeline = None
+
+
+def _init_preprocessing_worker(pipeline):
+    global _worker_pipeline
+    _worker_pipeline = pipeline
+
+
+def _preprocess_in_worker(document):
+    return _worker_pipeline.lemmatize_document(_worker_pipeline.clean_document(document))
+
+
+def ensure_nltk_data(resources=None):
+    """
+    Checks that NLTK data is installed locally, without ever trying to download it.
+
+    :param list resources: NLTK resource paths (e.g. 'corpora/wordnet'). Defaults to everything the pipeline uses.
+    :raises LookupError: If any of the resources can't be found, with instructions for installing them.
+    """
+    resources = NLTK_RESOURCES if resources is None else resources
+    missing = []
+    for resource in resources:
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            missing.append(resource)
+
+    if missing:
+        names = ' '.join(resource.split('/')[-1] for resource in missing)
+        raise LookupError(f'Missing NLTK data: {", ".join(missing)}. NLTK data is not downloaded at run time; install '
+                          f'it ahead of time with `python -m nltk.downloader {names}`, or point the NLTK_DATA '
+                          f'environment variable at a directory that contains it.')
+
+
+class LemmaCache:
+    """
+    Bounded, least-recently-used cache of word -> lemma lookups. Comedy transcripts repeat the same few thousand words
+    endlessly, so most calls to the (slow) WordNet lemmatizer can be skipped. Safe to share between threads, and its
+    contents survive pickling.
+    """
+    def lemmatize(self, word, lemmatizer):
+        """
+        Returns the lemma of a word, calling the lemmatizer only if the word is not already cached.
+
+        :param str word: Word to lemmatize.
+        :param nltk.stem.WordNetLemmatizer lemmatizer: Lemmatizer used on a cache miss.
+        :return: Lemmatized word.
+        :rtype: str
+        """
+        with self._lock:
+            lemma = self._lemmas.get(word)
+            if lemma is not None:
+                self._lemmas.move_to_end(word)
+                self.hits += 1
+                return lemma
+            self.misses += 1
+
+        lemma = lemmatizer.lemmatize(word)
+
+        with self._lock:
+            self._lemmas[word] = lemma
+            if len(self._lemmas) > self.maxsize:
+                self._lemmas.popitem(last=False)
+
+        return lemma
+
+    def stats(self):
+        """
+        Summarizes how effective the cache has been.
+
+        :return: Number of hits, misses, cached words, maximum size, and the hit rate.
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._lemmas),
+            'maxsize': self.maxsize,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def clear(self):
+        """
+        Empties the cache and resets the hit/miss counters.
+        """
+        with self._lock:
+            self._lemmas.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._lemmas)
+
+    def __getstate__(self):
+        # locks can't be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lemmas = OrderedDict()
+        self._lock = threading.Lock()
 
 
 class TranscriptProcessingPipeline:
@@ -37,19 +185,19 @@ class TranscriptProcessingPipeline:
         :rtype: str
         """
         # first pass of removing common english words and profanity
-        cleaned_document = self.remove_stop_words(document)
-
-        # clean unwanted words and characters
-        cleaned_document = cleaned_document.lower()                            # lower case
-        cleaned_document = re.sub(r'\[.*?\]', '', cleaned_document)            # text between brackets (meta-notes)
-        cleaned_document = re.sub(r'\(.*?\)', '', cleaned_document)            # text between parenthesis
-        cleaned_document = re.sub(r'[%s]' % re.escape(string.punctuation), ' ', cleaned_document)   # punctuation
-        cleaned_document = re.sub(r'\w*\d\w*', '', cleaned_document)           # words with numbers
-        cleaned_document = re.sub(r'\♪.*?\♪', '', cleaned_document)                                 # music
-        cleaned_document = re.sub('[“”…]', '', cleaned_document)                                    # quotes
-        cleaned_document = re.sub(r'\–', '', cleaned_document)                                      # hyphens
-        cleaned_document = re.sub('\n', '', cleaned_document)                                       # line breaks
-        cleaned_document = re.sub(r'\w*((\w)\2{2,})\w*', '', cleaned_document)  # remove crazy expressions like "aaahh"
+        cleaned_document = self.remove_stop_words(document).lower()
+
+        # clean unwanted words and characters. the `in` checks skip scans that could not match anything.
+        if '[' in cleaned_document:
+            cleaned_document = BRACKETS_PATTERN.sub('', cleaned_document)
+        if '(' in cleaned_document:
+            cleaned_document = PARENTHESES_PATTERN.sub('', cleaned_document)
+        cleaned_document = PUNCTUATION_PATTERN.sub(' ', cleaned_document)
+        cleaned_document = WORDS_WITH_NUMBERS_PATTERN.sub('', cleaned_document)
+        if '♪' in cleaned_document:
+            cleaned_document = MUSIC_PATTERN.sub('', cleaned_document)
+        cleaned_document = REMOVED_CHARACTERS_PATTERN.sub('', cleaned_document)
+        cleaned_document = REPEATED_CHARACTERS_PATTERN.sub('', cleaned_document)
 
         # second pass of stop words and return
         return self.remove_stop_words(cleaned_document)
@@ -75,10 +223,29 @@ class TranscriptProcessingPipeline:
         """
         # split text into words and iterate through, lemmatizing each word if necessary
         tokenized_document = document.split()
-        lemmatized_document = [self.lemmatizer.lemmatize(word) if word not in self.lemmatizer_stop_words else word
+        lemmatized_document = [self.lemma_cache.lemmatize(word, self.lemmatizer)
+                               if word not in self.lemmatizer_stop_words else word
                                for word in tokenized_document]
         return ' '.join(lemmatized_document)
 
+    def warm_lemma_cache(self, words=None):
+        """
+        Fills the lemma cache ahead of time so that the first queries after start up don't pay for WordNet lookups.
+
+        :param list words: Words to lemmatize. Defaults to the vocabulary of the fitted vectorizer.
+        :return: Number of words in the cache.
+        :rtype: int
+        """
+        if words is None:
+            # hashing vectorizers have no vocabulary
+            words = getattr(self.vectorizer, 'vocabulary_', {}).keys() if self._is_fit else []
+
+        for word in words:
+            if word not in self.lemmatizer_stop_words:
+                self.lemma_cache.lemmatize(word, self.lemmatizer)
+
+        return len(self.lemma_cache)
+
     def lemmatize_corpus(self, corpus):
         """
         Iterates through and lemmatizes words in each document in the corpus.
@@ -89,69 +256,202 @@ class TranscriptProcessingPipeline:
         """
         return [self.lemmatize_document(document) for document in corpus]
 
-    def _preprocess_data(self, corpus):
+    def preprocessing_fingerprint(self):
+        """
+        :return: Identifier of everything that determines the output of self.preprocess (the preprocessing code version
+                 and the stop words), used to key cached preprocessed text.
+        :rtype: str
+        """
+        digest = hashlib.sha256(str(PREPROCESSING_VERSION).encode())
+        for words in [self.stop_words, self.lemmatizer_stop_words]:
+            digest.update('\n'.join(sorted(words)).encode('utf-8'))
+            digest.update(b'\0')
+
+        return digest.hexdigest()[:16]
+
+    def _preprocess_documents(self, documents, n_jobs=1):
+        if n_jobs is None or n_jobs == 1 or len(documents) < 2:
+            with timed('clean'):
+                cleaned = self.clean_corpus(documents)
+            with timed('lemmatize'):
+                return self.lemmatize_corpus(cleaned)
+
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        # a few chunks per process evens out the load (transcripts vary a lot in length) without much overhead.
+        # `map` returns results in input order, so the output doesn't depend on which process finishes first
+        chunksize = max(1, math.ceil(len(documents) / (n_jobs * 4)))
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_preprocessing_worker,
+                                 initargs=(self,)) as executor:
+            return list(executor.map(_preprocess_in_worker, documents, chunksize=chunksize))
+
+    def preprocess(self, corpus, cache=None, n_jobs=1):
         """
-        Performs preprocessing steps on data.
+        Performs preprocessing steps (cleaning and lemmatization) on data.
 
         :param list corpus: List of strings containing each document.
-        :return:
+        :param cache: Optional store of previously preprocessed documents with `get_many(keys)` and `set_many(items)`
+                      methods (e.g. a PreprocessedTextCache). Documents found in it aren't processed again.
+        :param int n_jobs: Number of processes to preprocess documents in, or -1 to use every CPU. Worth it for large
+                           corpora only, since the pipeline has to be sent to each process.
+        :return: Cleaned and lemmatized corpus.
+        :rtype: list
         """
         # if a single string is provided, put it in a list
         corpus = corpus if isinstance(corpus, list) else list(corpus)
 
-        cleaned_corpus = self.clean_corpus(corpus)
-        lemmatized_corpus = self.lemmatize_corpus(cleaned_corpus)
+        if cache is None:
+            return self._preprocess_documents(corpus, n_jobs=n_jobs)
+
+        # documents are keyed on their contents and on how they are preprocessed, so a changed document or a change to
+        # the stop words is never served from the cache
+        fingerprint = self.preprocessing_fingerprint()
+        keys = [f'{fingerprint}:{content_hash(document)}' for document in corpus]
+        preprocessed = cache.get_many(keys)
+
+        missing = {key: document for key, document in zip(keys, corpus) if key not in preprocessed}
+        if missing:
+            processed = dict(zip(missing, self._preprocess_documents(list(missing.values()), n_jobs=n_jobs)))
+            cache.set_many(processed)
+            preprocessed.update(processed)
 
-        return lemmatized_corpus
+        return [preprocessed[key] for key in keys]
 
-    def fit_transform(self, corpus):
+    def fit_transform(self, corpus, sparse=False, cache=None, n_jobs=1):
         """
         Preprocess data, fit the vectorizer, and return the resulting vectorized corpus.
 
         :param list corpus: List of strings each containing a document.
+        :param bool sparse: If True, return the vectorized corpus as a scipy CSR matrix instead of a dense dataframe.
+        :param cache: Optional store of previously preprocessed documents (see self.preprocess).
+        :param int n_jobs: Number of processes to preprocess documents in (see self.preprocess).
         :return: Prepared and vectorized corpus for use in modeling.
-        :rtype: pandas.DataFrame
+        :rtype: pandas.DataFrame or scipy.sparse.csr_matrix
+        """
+        return self.fit_transform_preprocessed(self.preprocess(corpus, cache=cache, n_jobs=n_jobs), sparse=sparse)
+
+    def fit_transform_preprocessed(self, preprocessed_corpus, sparse=False):
+        """
+        Fit the vectorizer to a corpus that has already been passed through self.preprocess, e.g. by another pipeline
+        with the same stop words, so that several vectorizers can be fit to one preprocessed corpus.
+
+        :param list preprocessed_corpus: List of cleaned and lemmatized strings each containing a document.
+        :param bool sparse: If True, return the vectorized corpus as a scipy CSR matrix instead of a dense dataframe.
+        :return: Vectorized corpus for use in modeling.
+        :rtype: pandas.DataFrame or scipy.sparse.csr_matrix
         """
-        preprocessed_corpus = self._preprocess_data(corpus)
         vectorized_corpus = self.vectorizer.fit_transform(preprocessed_corpus)
         self._is_fit = True
 
-        return pd.DataFrame(vectorized_corpus.toarray(), columns=self.vectorizer.get_feature_names())
+        return vectorized_corpus if sparse else self.to_dataframe(vectorized_corpus)
+
+    def fit_stream(self, batches, cache=None, n_jobs=1):
+        """
+        Fit the vectorizer to a corpus one batch of documents at a time, so the corpus never has to be in memory at
+        once. The vectorizer must support fitting in batches (see app.streaming).
 
-    def transform(self, corpus):
+        :param batches: Iterable of lists of strings, each a batch of documents.
+        :param cache: Optional store of previously preprocessed documents (see self.preprocess).
+        :param int n_jobs: Number of processes to preprocess each batch in (see self.preprocess).
+        :return: The fitted pipeline.
+        :rtype: TranscriptProcessingPipeline
+        """
+        for batch in batches:
+            self.vectorizer.partial_fit(self.preprocess(batch, cache=cache, n_jobs=n_jobs))
+        self.vectorizer.finish_fit()
+        self._is_fit = True
+
+        return self
+
+    def transform_stream(self, batches, cache=None, n_jobs=1):
+        """
+        Transform a corpus one batch of documents at a time after the pipeline has been fit.
+
+        :param batches: Iterable of lists of strings, each a batch of documents.
+        :param cache: Optional store of previously preprocessed documents (see self.preprocess).
+        :param int n_jobs: Number of processes to preprocess each batch in (see self.preprocess).
+        :return: Generator of scipy CSR matrices, one per batch.
+        :rtype: generator
+        """
+        for batch in batches:
+            yield self.transform_preprocessed(self.preprocess(batch, cache=cache, n_jobs=n_jobs), sparse=True)
+
+    def transform(self, corpus, sparse=False):
         """
         Transform any corpus of text after self.fit_transform has already been called on an instance of this class.
 
         :param list corpus: List of strings each containing a document.
+        :param bool sparse: If True, return the vectorized corpus as a scipy CSR matrix instead of a dense dataframe.
         :return: Prepared and vectorized corpus for use in modeling.
-        :rtype: pandas.DataFrame
+        :rtype: pandas.DataFrame or scipy.sparse.csr_matrix
+        """
+        return self.transform_preprocessed(self.preprocess(corpus), sparse=sparse)
+
+    def transform_preprocessed(self, preprocessed_corpus, sparse=False):
         """
+        Vectorize a corpus that has already been passed through self.preprocess.
 
+        :param list preprocessed_corpus: List of cleaned and lemmatized strings each containing a document.
+        :param bool sparse: If True, return the vectorized corpus as a scipy CSR matrix instead of a dense dataframe.
+        :return: Vectorized corpus for use in modeling.
+        :rtype: pandas.DataFrame or scipy.sparse.csr_matrix
+        """
         if not self._is_fit:
             raise ValueError("Must fit the ml_models before transforming!")
 
-        preprocessed_corpus = self._preprocess_data(corpus)
-        vectorized_corpus = self.vectorizer.transform(preprocessed_corpus)
+        with timed('vectorize'):
+            vectorized_corpus = self.vectorizer.transform(preprocessed_corpus)
+
+        return vectorized_corpus if sparse else self.to_dataframe(vectorized_corpus)
+
+    def to_dataframe(self, vectorized_corpus):
+        """
+        Converts a sparse vectorized corpus into a dense dataframe with one column per vocabulary word. Intended for
+        analysis only, as this densifies a mostly-zero matrix.
+
+        :param scipy.sparse.csr_matrix vectorized_corpus: Output of the vectorizer.
+        :return: Dense document-term dataframe.
+        :rtype: pandas.DataFrame
+        """
+        if not hasattr(self.vectorizer, 'get_feature_names'):
+            raise ValueError(f'{type(self.vectorizer).__name__} has no feature names to label dataframe columns with '
+                             '(hashed columns are ambiguous); pass sparse=True to get a sparse matrix instead.')
 
         return pd.DataFrame(vectorized_corpus.toarray(), columns=self.vectorizer.get_feature_names())
 
-    def __init__(self, tokenizer, stemmer, lemmatizer, vectorizer, stop_words=nltk.corpus.stopwords.words('english')):
+    def __init__(self, tokenizer, stemmer, lemmatizer, vectorizer, stop_words=None, lemma_cache_size=100000):
         self.tokenizer = tokenizer
         self.stemmer = stemmer()
         self.lemmatizer = lemmatizer()
+        self.lemma_cache = LemmaCache(maxsize=lemma_cache_size)
         self.vectorizer = vectorizer(stop_words='english', min_df=0.1, max_df=0.7)
         self._is_fit = False
 
-        self.stop_words = stop_words
+        # copy the stop words so that neither the caller's list nor nltk's list is modified below
+        stop_words = list(nltk.corpus.stopwords.words('english') if stop_words is None else stop_words)
         # have to append profanity to stop words, sorry!
-        self.stop_words.extend(['motherfucker', 'motherfucking', 'fuck', 'fucked', 'fucking', 'nigger',
-                                'cunt', 'hell', 'fuckin', "fuckin’", 'damn', 'shit', 'goddamn', 'bitch'])
+        stop_words.extend(['motherfucker', 'motherfucking', 'fuck', 'fucked', 'fucking', 'nigger',
+                           'cunt', 'hell', 'fuckin', "fuckin’", 'damn', 'shit', 'goddamn', 'bitch'])
         # add other random stop words that weren't captured
-        self.stop_words.extend(['yo', 'um', "’em", 'wanna', "ain’t", 'ha', 'ok', 'ah', 'sort', 'quite', 'awesome',
-                                'sir', 'literally', 'er', 'huh', 'dude', 'amazing', 'anymore', 'ya', 'alright',
-                                'totally', 'mm', 'hello', 'whoa', 'la', 'ought', 'special', 'ready', 'supposed',
-                                'anybody', 'soon', 'wow', 'ooh', 'obviously', 'river', 'view'])
+        stop_words.extend(['yo', 'um', "’em", 'wanna', "ain’t", 'ha', 'ok', 'ah', 'sort', 'quite', 'awesome',
+                           'sir', 'literally', 'er', 'huh', 'dude', 'amazing', 'anymore', 'ya', 'alright',
+                           'totally', 'mm', 'hello', 'whoa', 'la', 'ought', 'special', 'ready', 'supposed',
+                           'anybody', 'soon', 'wow', 'ooh', 'obviously', 'river', 'view'])
         # names (ideally I would simply remove all common first names more efficiently, but keep Trump)
-        self.stop_words.extend(['kevin', 'jim', 'jimmy', 'peter', 'joe', 'dave', 'daniel', 'richard', 'jack',
-                                'michael', 'brian', 'martin', 'paul', 'billy'])
-        self.lemmatizer_stop_words = ['vegas', 'vegan']
\ No newline at end of file
+        stop_words.extend(['kevin', 'jim', 'jimmy', 'peter', 'joe', 'dave', 'daniel', 'richard', 'jack',
+                           'michael', 'brian', 'martin', 'paul', 'billy'])
+
+        # frozen sets make every "is this a stop word?" check a hash lookup instead of a scan through a list
+        self.stop_words = frozenset(stop_words)
+        self.lemmatizer_stop_words = frozenset(['vegas', 'vegan'])
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled pipeline. Pipelines pickled before the stop words were stored as frozen sets hold them as
+        lists, so they are converted on load, and pipelines pickled before the lemma cache existed are given an empty
+        one.
+        """
+        self.__dict__.update(state)
+        if 'lemma_cache' not in state:
+            self.lemma_cache = LemmaCache()
+        self.stop_words = frozenset(self.stop_words)
+        self.lemmatizer_stop_words = frozenset(self.lemmatizer_stop_words)
@@ -0,0 +1,54 @@
+"""
+Contains a small cache of fully rendered HTML pages. Pages whose content only changes when the models or metadata are
+refreshed (like the home page) are rendered once and then served from memory with an ETag, so that browsers can
+revalidate with a conditional GET and receive a 304 instead of the whole page.
+"""
+import hashlib
+import threading
+
+
+class RenderedPage:
+    """
+    Rendered HTML body and its ETag.
+    """
+    def __init__(self, body):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+
+class PageCache:
+    """
+    Thread-safe map of page name -> rendered page. Each page is rendered at most once until the cache is cleared.
+    """
+    def get_or_render(self, name, render):
+        """
+        Returns a cached page, rendering it first if necessary.
+
+        :param str name: Name of the page.
+        :param callable render: Function with no arguments returning the page's HTML.
+        :return: Rendered page.
+        :rtype: RenderedPage
+        """
+        page = self._pages.get(name)
+        if page is not None:
+            return page
+
+        with self._lock:
+            # another thread may have rendered the page while this one waited on the lock
+            page = self._pages.get(name)
+            if page is None:
+                page = RenderedPage(render())
+                self._pages[name] = page
+
+        return page
+
+    def clear(self):
+        """
+        Drops all rendered pages, e.g. after the models or metadata are refreshed.
+        """
+        with self._lock:
+            self._pages = {}
+
+    def __init__(self):
+        self._pages = {}
+        self._lock = threading.Lock()
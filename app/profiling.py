@@ -0,0 +1,88 @@
+"""
+Contains the opt-in request profiler. A sampled fraction of requests (and any request carrying the configured profiling
+token in an `X-Profile-Token` header) runs under cProfile, and the profile of each one that turns out to be slow is
+written to disk: a `.prof` file for tools like snakeviz or `python -m pstats`, and a `.txt` file with the call tree of
+the most expensive calls. While the sample rate is 0 and no token is set, the only cost per request is one comparison.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile, and saves the profiles of the slow ones.
+    """
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.token is not None
+
+    def _is_forced(self, token):
+        return self.token is not None and token == self.token
+
+    def start(self, token=None):
+        """
+        Starts profiling the current request if it is sampled or carries the profiling token.
+
+        :param str token: Value of the request's X-Profile-Token header, if any.
+        :return: Running profiler, or None if the request isn't profiled.
+        :rtype: cProfile.Profile
+        """
+        if not self.enabled:
+            return None
+        if not self._is_forced(token) and random.random() >= self.sample_rate:
+            return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already running in this thread
+            return None
+
+        return profile
+
+    def finish(self, profile, seconds, name, token=None):
+        """
+        Stops profiling a request, and saves the profile if the request was slow or carried the profiling token.
+
+        :param cProfile.Profile profile: Profiler returned by self.start.
+        :param float seconds: How long the request took.
+        :param str name: Name of the request, e.g. its endpoint, used in the file names.
+        :param str token: Value of the request's X-Profile-Token header, if any.
+        :return: Path to the saved .prof file, or None if it wasn't saved.
+        :rtype: str
+        """
+        profile.disable()
+        if seconds < self.slow_request_seconds and not self._is_forced(token):
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{name}-'
+                                            f'{int(seconds * 1000)}ms')
+        profile.dump_stats(path + '.prof')
+
+        summary = io.StringIO()
+        stats = pstats.Stats(profile, stream=summary).sort_stats('cumulative')
+        stats.print_stats(self.n_calls)
+        stats.print_callees(self.n_calls)
+        with open(path + '.txt', 'w') as f:
+            f.write(summary.getvalue())
+
+        logger.warning('Profiled %s request taking %.3fs: %s.prof', name, seconds, path)
+
+        return path + '.prof'
+
+    def __init__(self, sample_rate=0.0, slow_request_seconds=0.5, directory='/tmp/standup_profiles', token=None,
+                 n_calls=40):
+        self.sample_rate = sample_rate
+        self.slow_request_seconds = slow_request_seconds
+        self.directory = directory
+        self.token = token or None
+        self.n_calls = n_calls
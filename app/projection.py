@@ -0,0 +1,130 @@
+"""
+Contains a projection engine that maps TF-IDF vectors into topic space using the fitted NMF topic-word matrix.
+Projecting a vector onto the topics is a small non-negative least squares problem (one variable per topic), so instead of
+running sklearn's general NMF solver for every search, the engine precomputes the topic Gram matrix once and solves all
+the search terms of a batch together.
+
+With only a handful of topics, the solution is found exactly: the optimum is the unconstrained least squares solution
+restricted to some subset of the topics, and the inverse of the Gram matrix restricted to every subset is precomputed,
+so solving a batch is a few matrix products. With many topics, batched coordinate descent is used instead.
+"""
+import itertools
+
+import numpy as np
+
+# 2^n_topics subsets are enumerated, so beyond this many topics coordinate descent is cheaper
+MAX_ENUMERATED_TOPICS = 10
+
+
+class TopicProjector:
+    """
+    Solves min_W 0.5 * ||X - W H||^2 + l1 * sum(W) + 0.5 * l2 * ||W||^2 subject to W >= 0, for a fixed topic-word
+    matrix H. This is the problem sklearn.decomposition.NMF.transform solves with the Frobenius loss.
+    """
+    def _solve_enumerated(self, XHt):
+        # least squares solution restricted to every subset of the topics: shape (n_rows, n_subsets, n_topics)
+        candidates = (XHt @ self._subset_inverses).reshape(len(XHt), -1, self.n_topics)
+
+        # at a restricted least squares solution the objective is -0.5 * w . (X H^T), so the best feasible candidate is
+        # the optimum. the empty subset (W = 0) is always feasible
+        objective = -0.5 * (candidates @ XHt[:, :, np.newaxis])[:, :, 0]
+        objective[(candidates < -1e-10).any(axis=2)] = np.inf
+        best = objective.argmin(axis=1)
+
+        return np.maximum(candidates[np.arange(len(XHt)), best], 0)
+
+    def _solve_coordinate_descent(self, XHt, W):
+        for _ in range(self.max_iter):
+            max_step = 0.0
+            # one sweep over the topics, updating every row at once
+            for topic in self._active_topics:
+                gradient = W @ self.gram[:, topic] - XHt[:, topic]
+                updated = np.maximum(W[:, topic] - gradient / self.gram[topic, topic], 0)
+                max_step = max(max_step, np.abs(updated - W[:, topic]).max(initial=0.0))
+                W[:, topic] = updated
+
+            if max_step <= self.tol * max(W.max(initial=0.0), 1e-12):
+                break
+
+        return W
+
+    def transform(self, X):
+        """
+        Projects vectors into topic space.
+
+        :param X: TF-IDF matrix with one row per search term (scipy sparse matrix or numpy array).
+        :return: Non-negative topic weights, one row per search term.
+        :rtype: numpy.ndarray
+        """
+        XHt = np.asarray(X @ self._components_t, dtype=np.float64)
+        if self.l1_reg:
+            XHt -= self.l1_reg
+
+        # warm start from the unconstrained least squares solution, which is already optimal for rows where it is
+        # non-negative
+        W = XHt @ self._gram_inv
+        unsolved = (W < 0).any(axis=1)
+        if unsolved.any():
+            if self._subset_inverses is not None:
+                W[unsolved] = self._solve_enumerated(XHt[unsolved])
+            else:
+                W[unsolved] = self._solve_coordinate_descent(XHt[unsolved], np.maximum(W[unsolved], 0))
+
+        return W
+
+    @classmethod
+    def from_topic_model(cls, topic_model, n_features=None, **kwargs):
+        """
+        Builds a projector from a fitted sklearn NMF topic model, including its regularization of W.
+
+        :param sklearn.decomposition.NMF topic_model: Fitted topic model using the Frobenius loss.
+        :param int n_features: Number of vocabulary words. Defaults to the number of columns of `components_`.
+        :param kwargs: Passed through to TopicProjector (tol, max_iter).
+        :return: Projector equivalent to `topic_model.transform`.
+        :rtype: TopicProjector
+        """
+        if getattr(topic_model, 'beta_loss', 'frobenius') not in ('frobenius', 2):
+            raise ValueError('Only topic models fit with the Frobenius loss can be projected by least squares.')
+
+        components = topic_model.components_
+        n_features = components.shape[1] if n_features is None else n_features
+        l1_ratio = topic_model.l1_ratio
+
+        # newer versions of sklearn scale the regularization of W by the number of features
+        if hasattr(topic_model, 'alpha_W'):
+            alpha = topic_model.alpha_W * n_features
+        elif getattr(topic_model, 'regularization', 'both') in ('both', 'transformation'):
+            alpha = topic_model.alpha
+        else:
+            alpha = 0.0
+
+        return cls(components, l1_reg=alpha * l1_ratio, l2_reg=alpha * (1 - l1_ratio), **kwargs)
+
+    def __init__(self, components, l1_reg=0.0, l2_reg=0.0, tol=1e-6, max_iter=200):
+        self.components = np.ascontiguousarray(components, dtype=np.float64)
+        self.l1_reg = l1_reg
+        self.l2_reg = l2_reg
+        self.tol = tol
+        self.max_iter = max_iter
+        self.n_topics = self.components.shape[0]
+        self._components_t = np.ascontiguousarray(self.components.T)
+
+        # the Gram matrix H H^T (plus the l2 penalty) is all the solvers need besides X H^T
+        self.gram = self.components @ self.components.T
+        self.gram[np.diag_indices(self.n_topics)] += l2_reg
+        self._gram_inv = np.linalg.pinv(self.gram)
+        # a topic with an all-zero row in H can never get any weight
+        self._active_topics = [topic for topic in range(self.n_topics) if self.gram[topic, topic] > 0]
+
+        # inverse of the Gram matrix restricted to each subset of topics, embedded in an n_topics x n_topics matrix.
+        # they are laid side by side, so X H^T times this matrix gives every subset's solution in one matrix product
+        self._subset_inverses = None
+        if self.n_topics <= MAX_ENUMERATED_TOPICS:
+            subsets = itertools.chain.from_iterable(itertools.combinations(range(self.n_topics), size)
+                                                    for size in range(self.n_topics + 1))
+            inverses = np.zeros((2 ** self.n_topics, self.n_topics, self.n_topics))
+            for i, subset in enumerate(subsets):
+                subset = list(subset)
+                if subset:
+                    inverses[i][np.ix_(subset, subset)] = np.linalg.pinv(self.gram[np.ix_(subset, subset)])
+            self._subset_inverses = np.ascontiguousarray(inverses.transpose(1, 0, 2).reshape(self.n_topics, -1))
@@ -0,0 +1,237 @@
+"""
+Contains a cache of search results keyed on the cleaned and lemmatized search term, so that repeated searches (and
+searches that normalize to the same text, like "Politics" and "politics!") skip vectorization, topic projection and
+ranking. Only searches that preprocess to exactly the same text share an entry, since only they are certain to get the
+same results: "politics" and "political" are different lemmas, vectorized differently, so they are cached separately.
+Results are stored in a pluggable backend: an in-process LRU for a single worker, or a local SQLite file that
+several gunicorn workers on the same machine can share.
+
+Every entry is tagged with a version fingerprint of the models and metadata, so that entries computed against an old
+model are never served once the model pickles or the metadata change.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class MemoryCacheBackend:
+    """
+    In-process, least-recently-used cache with a time-to-live on each entry.
+    """
+    def get(self, key):
+        """
+        :param str key: Cache key.
+        :return: Cached value, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        """
+        :param str key: Cache key.
+        :param value: JSON-serializable value to cache.
+        :param float ttl: Number of seconds the entry stays valid.
+        """
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+
+class SQLiteCacheBackend:
+    """
+    Cache stored in a local SQLite file, shared by every process that opens the same path. Expired and excess entries
+    are pruned periodically on write.
+    """
+    PRUNE_EVERY = 100
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads, so each thread opens its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS query_cache '
+                               '(key TEXT PRIMARY KEY, value TEXT, expires_at REAL)')
+            self._local.connection = connection
+
+        return connection
+
+    def get(self, key):
+        """
+        :param str key: Cache key.
+        :return: Cached value, or None if missing or expired.
+        """
+        row = self._connection().execute('SELECT value, expires_at FROM query_cache WHERE key = ?',
+                                         (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        """
+        :param str key: Cache key.
+        :param value: JSON-serializable value to cache.
+        :param float ttl: Number of seconds the entry stays valid.
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO query_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                               (key, json.dumps(value), time.time() + ttl))
+
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """
+        Deletes expired entries, then the entries closest to expiring until at most `maxsize` remain.
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM query_cache WHERE expires_at < ?', (time.time(),))
+            connection.execute('DELETE FROM query_cache WHERE key IN (SELECT key FROM query_cache '
+                               'ORDER BY expires_at DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM query_cache')
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM query_cache').fetchone()[0]
+
+    def __init__(self, path, maxsize=100000):
+        self.path = path
+        self.maxsize = maxsize
+        self._writes = 0
+        self._local = threading.local()
+
+
+class QueryCache:
+    """
+    Caches the ranked row ids and similarity scores for normalized search terms.
+    """
+    def _key(self, normalized_query, k):
+        return f'{self.version}:{k}:{normalized_query}'
+
+    def get(self, normalized_query, k):
+        """
+        Looks up the results of a previous search.
+
+        :param str normalized_query: Cleaned and lemmatized search term.
+        :param int k: Number of results requested.
+        :return: Row ids and similarity scores (most similar first), or None on a cache miss.
+        :rtype: tuple
+        """
+        value = self.backend.get(self._key(normalized_query, k))
+        # the counters are shared by every thread of the worker
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if value is None:
+            return None
+        return value['row_ids'], value['scores']
+
+    def set(self, normalized_query, k, row_ids, scores):
+        """
+        Stores the results of a search.
+
+        :param str normalized_query: Cleaned and lemmatized search term.
+        :param int k: Number of results requested.
+        :param list row_ids: Ranked row ids of the matching comedy specials.
+        :param list scores: Similarity score of each matching comedy special.
+        """
+        self.backend.set(self._key(normalized_query, k),
+                         {'row_ids': [int(row_id) for row_id in row_ids], 'scores': [float(s) for s in scores]},
+                         self.ttl)
+
+    def __init__(self, backend, version='', ttl=3600):
+        self.backend = backend
+        self.version = version
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+
+def fingerprint(file_paths=(), metadata=None):
+    """
+    Computes a version string that changes whenever any of the given files or the metadata change.
+
+    :param list file_paths: Paths to model files (e.g. pickles). Their size and modification time are hashed.
+    :param pandas.DataFrame metadata: Metadata pandas dataframe. Its contents are hashed.
+    :return: Short hexadecimal fingerprint.
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        digest.update(f'{file_path}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+
+    if metadata is not None:
+        # mongo's ObjectIds don't hash consistently, and don't carry any information the app displays anyway
+        hashed_rows = pd.util.hash_pandas_object(metadata.drop(columns='_id', errors='ignore').astype(str))
+        digest.update(hashed_rows.values.tobytes())
+
+    return digest.hexdigest()[:16]
+
+
+def create_query_cache(backend='memory', path=None, maxsize=10000, ttl=3600, version=''):
+    """
+    Builds a query cache with the requested backend.
+
+    :param str backend: 'memory' for an in-process cache, 'sqlite' for a cache shared through a local file, or 'none'
+                        to disable caching.
+    :param str path: Path to the SQLite file. Required for the 'sqlite' backend.
+    :param int maxsize: Maximum number of cached searches.
+    :param float ttl: Number of seconds each cached search stays valid.
+    :param str version: Fingerprint of the models and metadata the results are computed from.
+    :return: Query cache, or None if caching is disabled.
+    :rtype: QueryCache
+    """
+    if backend == 'none':
+        return None
+    elif backend == 'memory':
+        cache_backend = MemoryCacheBackend(maxsize=maxsize)
+    elif backend == 'sqlite':
+        if path is None:
+            raise ValueError('A path is required for the sqlite query cache backend.')
+        cache_backend = SQLiteCacheBackend(path, maxsize=maxsize)
+    else:
+        raise ValueError(f'Unknown query cache backend: {backend}')
+
+    return QueryCache(cache_backend, version=version, ttl=ttl)
@@ -0,0 +1,197 @@
+"""
+Contains functions for finding the comedy specials most similar to free-text search terms. Many search terms can be
+scored at once: they are cleaned, vectorized, projected into topic space, and ranked as single batched matrix
+operations rather than one query at a time.
+
+Search terms can also be matched word for word (see app.lexical_index), with `search_lexical`, or both ways at once,
+with `search_hybrid`.
+"""
+import numpy as np
+
+from app.metrics import timed
+from app.similarity import select_top_k
+
+
+def search_batch(queries, pipeline, topic_model, topic_index, k=10, cache=None):
+    """
+    Finds the top k most similar comedy specials for each search term.
+
+    :param list queries: List of search term strings.
+    :param TranscriptProcessingPipeline pipeline: Fitted NLP pipeline used to vectorize the search terms.
+    :param TopicProjector topic_model: Projects the vectors into topic space. A fitted sklearn NMF topic model also
+                                       works, but is much slower.
+    :param SimilarityIndex topic_index: Index of the document-topic matrix to rank against (see app.similarity).
+    :param int k: Number of results to return per search term.
+    :param QueryCache cache: Optional cache of results keyed on the cleaned and lemmatized search term.
+    :return: One (row_ids, similarities) tuple per search term, most similar first. Blank search terms, and search
+             terms with none of the words the topics are made of, return empty results.
+    :rtype: list
+    """
+    results = [_empty_result() for _ in queries]
+
+    # blank search terms have no meaningful position in topic space, so only score the rest
+    positions = [i for i, query in enumerate(queries) if query.strip() != '']
+    if not positions:
+        return results
+
+    preprocessed = pipeline.preprocess([queries[i] for i in positions])
+
+    # serve what we can from the cache, and only vectorize and rank the rest
+    if cache is not None:
+        uncached = []
+        for position, normalized_query in zip(positions, preprocessed):
+            cached = cache.get(normalized_query, k)
+            if cached is None:
+                uncached.append((position, normalized_query))
+            else:
+                results[position] = (np.asarray(cached[0], dtype=int), np.asarray(cached[1], dtype=np.float32))
+    else:
+        uncached = list(zip(positions, preprocessed))
+
+    if not uncached:
+        return results
+
+    # search terms that clean to the same text (e.g. differing only in case or punctuation) are only scored once
+    unique_queries = list(dict.fromkeys(normalized_query for _, normalized_query in uncached))
+
+    # keep the TF-IDF vectors sparse all the way into the topic projection
+    vectorized = pipeline.transform_preprocessed(unique_queries, sparse=True)
+    with timed('project'):
+        query_topics = topic_model.transform(vectorized)
+    placed = _placed(query_topics)
+
+    scored = {normalized_query: _empty_result() for normalized_query in unique_queries}
+    if len(placed):
+        with timed('rank'):
+            row_ids, similarities = topic_index.top_k_batch(query_topics[placed], k=k)
+        for i, ids, scores in zip(placed, row_ids, similarities):
+            scored[unique_queries[i]] = (ids, scores)
+    if cache is not None:
+        for normalized_query, (ids, scores) in scored.items():
+            cache.set(normalized_query, k, ids, scores)
+    for position, normalized_query in uncached:
+        results[position] = scored[normalized_query]
+
+    return results
+
+
+def _empty_result():
+    return np.zeros(0, dtype=int), np.zeros(0, dtype=np.float32)
+
+
+def _nonblank(queries):
+    # positions of the search terms that aren't blank
+    return [i for i, query in enumerate(queries) if query.strip() != '']
+
+
+def _placed(query_topics):
+    # search terms with none of the words the topics are made of project onto the origin of topic space, which is no
+    # more similar to one comedy special than to another, so (like blank search terms) they aren't ranked
+    return np.flatnonzero(np.asarray(query_topics).any(axis=1))
+
+
+def search_lexical(queries, pipeline, lexical_index, k=10):
+    """
+    Finds the comedy specials whose transcripts, comedian or title best match the words of each search term, scored
+    with BM25.
+
+    :param list queries: List of search term strings.
+    :param TranscriptProcessingPipeline pipeline: Fitted NLP pipeline, which cleans and lemmatizes each search term the
+                                                  same way the transcripts were.
+    :param LexicalIndex lexical_index: Lexical index of the comedy specials.
+    :param int k: Number of results to return per search term.
+    :return: One (row_ids, scores) tuple per search term, best match first. Search terms matching nothing (including
+             blank ones) return empty results.
+    :rtype: list
+    """
+    results = [_empty_result() for _ in queries]
+    positions = _nonblank(queries)
+    if not positions:
+        return results
+
+    preprocessed = pipeline.preprocess([queries[i] for i in positions])
+    with timed('lexical'):
+        for i, position in enumerate(positions):
+            results[position] = lexical_index.top_k(preprocessed[i], queries[position], k=k)
+
+    return results
+
+
+def search_hybrid(queries, pipeline, topic_model, topic_index, lexical_index, k=10, lexical_weight=0.5,
+                  n_candidates=100):
+    """
+    Ranks comedy specials by a blend of their lexical and topic scores, so that specials matching the words of a search
+    term come first, followed by specials about the same things. Candidates are the lexical matches plus the
+    `n_candidates` specials nearest in topic space; each query's lexical scores are scaled so its best match scores 1.
+
+    :param list queries: List of search term strings.
+    :param TranscriptProcessingPipeline pipeline: Fitted NLP pipeline.
+    :param TopicProjector topic_model: Projects the vectors into topic space.
+    :param SimilarityIndex topic_index: Index of the document-topic matrix, with positional row ids (metadata rows).
+    :param LexicalIndex lexical_index: Lexical index of the comedy specials.
+    :param int k: Number of results to return per search term.
+    :param float lexical_weight: Weight of the lexical score, between 0 (topic search) and 1 (lexical search).
+    :param int n_candidates: Number of specials nearest in topic space to consider per search term.
+    :return: One (row_ids, scores) tuple per search term, best match first. Blank search terms return empty results,
+             and search terms with none of the words the topics are made of only return their lexical matches.
+    :rtype: list
+    """
+    results = [_empty_result() for _ in queries]
+    positions = _nonblank(queries)
+    if not positions:
+        return results
+
+    preprocessed = pipeline.preprocess([queries[i] for i in positions])
+    vectorized = pipeline.transform_preprocessed(preprocessed, sparse=True)
+    with timed('project'):
+        query_topics = topic_model.transform(vectorized)
+    placed = _placed(query_topics)
+    topic_rows = [np.zeros(0, dtype=int)] * len(positions)
+    if len(placed):
+        with timed('rank'):
+            placed_rows, _ = topic_index.top_k_batch(query_topics[placed], k=max(k, n_candidates))
+        for i, rows in zip(placed, placed_rows):
+            topic_rows[i] = rows
+
+    with timed('lexical'):
+        for i, position in enumerate(positions):
+            lexical_rows, lexical_scores = lexical_index.score(preprocessed[i], queries[position])
+            if not len(lexical_rows) and not len(topic_rows[i]):
+                continue
+
+            rows = np.union1d(lexical_rows, topic_rows[i])
+            lexical = np.zeros(len(rows), dtype=np.float32)
+            if len(lexical_rows):
+                lexical[np.searchsorted(rows, lexical_rows)] = lexical_scores / lexical_scores.max()
+            topic = topic_index.similarities(query_topics[i:i + 1], rows)
+
+            top, scores = select_top_k((lexical_weight * lexical + (1 - lexical_weight) * topic)[np.newaxis], k)
+            results[position] = (rows[top[0]], scores[0].astype(np.float32))
+
+    return results
+
+
+def format_results(metadata, row_ids, similarities):
+    """
+    Converts ranked row ids into JSON-serializable records describing each comedy special.
+
+    :param pandas.DataFrame metadata: Metadata pandas dataframe aligned with the row ids of the topic index.
+    :param numpy.ndarray row_ids: Positional row ids of the matching comedy specials.
+    :param numpy.ndarray similarities: Cosine similarity of each matching comedy special.
+    :return: List of dictionaries containing comedyId (as `id`), comedian, title, year, image URL and similarity score.
+    :rtype: list
+    """
+    rows = metadata.iloc[row_ids]
+
+    return [
+        {
+            'id': int(comedy_id),
+            'comedian': comedian,
+            'title': title,
+            'year': int(year),
+            'imageUrl': image_url,
+            'score': float(score)
+        }
+        for comedy_id, comedian, title, year, image_url, score
+        in zip(rows['comedyId'], rows['comedian'], rows['title'], rows['year'], rows['imageUrl'], similarities)
+    ]
@@ -0,0 +1,370 @@
+"""
+Contains the similarity search backends used to rank comedy specials against search terms. Every backend indexes a set
+of row vectors (dense, like the document-topic matrix, or sparse, like full TF-IDF vectors) and answers "top k rows by
+cosine similarity" for a batch of query vectors with `top_k_batch`, so they are interchangeable:
+
+    exact   brute force: every row is scored (the default)
+    lsh     random hyperplane locality sensitive hashing: only rows whose signature matches the query's in at least one
+            table are scored
+    ivf     inverted file: rows are clustered with spherical k-means, and only rows in the clusters nearest to the
+            query are scored
+
+The approximate backends trade a little recall for scoring a small fraction of the rows, which only pays off once there
+are many thousands of rows or the vectors have many dimensions. If this file is run as a script, it compares the recall
+at 10 and latency of the backends on synthetic data:
+
+    python -m app.similarity benchmark [n_documents] [n_dimensions]
+"""
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+
+def l2_normalize_rows(matrix):
+    """
+    Scales each row of a matrix to unit length. Rows with a norm of zero are left as all zeros, which matches the
+    behavior of sklearn.metrics.pairwise.cosine_similarity.
+
+    :param numpy.ndarray matrix: 2D array of row vectors.
+    :return: C-contiguous float32 array of unit-length row vectors.
+    :rtype: numpy.ndarray
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    return np.ascontiguousarray(matrix / norms)
+
+
+def normalize_vectors(vectors):
+    """
+    :param vectors: Row vectors (numpy array or scipy sparse matrix).
+    :return: Unit-length float32 row vectors, as a C-contiguous array or a CSR matrix.
+    """
+    if sparse.issparse(vectors):
+        return normalize(sparse.csr_matrix(vectors, dtype=np.float32))
+
+    return l2_normalize_rows(vectors)
+
+
+def select_top_k(similarity, k):
+    """
+    :param numpy.ndarray similarity: Scores of shape (n_queries, n_rows).
+    :param int k: Number of rows to select per query.
+    :return: Column indices of the k highest scores of each query (highest first) and the scores.
+    :rtype: tuple
+    """
+    k = min(k, similarity.shape[1])
+    if k <= 0:
+        return np.zeros((len(similarity), 0), dtype=int), similarity[:, :0]
+
+    # partial sort to find the top k, then fully sort only those k
+    top_idx = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    top_similarity = np.take_along_axis(similarity, top_idx, axis=1)
+    order = np.argsort(-top_similarity, axis=1, kind='stable')
+
+    return np.take_along_axis(top_idx, order, axis=1), np.take_along_axis(top_similarity, order, axis=1)
+
+
+def _concatenate_ranges(starts, stops):
+    # np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)]), without a python loop
+    lengths = stops - starts
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+    return shifts + np.arange(lengths.sum())
+
+
+def _dot(vectors, queries):
+    # dense (n_rows, n_queries) scores of sparse or dense rows against sparse or dense queries
+    scores = vectors @ queries.T
+    return scores.toarray() if sparse.issparse(scores) else np.asarray(scores)
+
+
+class SimilarityIndex:
+    """
+    Row vectors with aligned row ids that can be searched by cosine similarity.
+    """
+    def top_k(self, query, k=10):
+        """
+        Finds the rows most similar to a single query.
+
+        :param query: Query vector, shape (n_dimensions,) or (1, n_dimensions).
+        :param int k: Number of results to return.
+        :return: Row ids of the k most similar rows (most similar first) and their cosine similarities.
+        :rtype: tuple
+        """
+        query = query if sparse.issparse(query) else np.asarray(query).reshape(1, -1)
+        row_ids, similarities = self.top_k_batch(query, k=k)
+
+        return row_ids[0], similarities[0]
+
+    def top_k_batch(self, queries, k=10):
+        """
+        Finds the rows most similar to each of many queries.
+
+        :param queries: Query vectors, shape (n_queries, n_dimensions) (numpy array or scipy sparse matrix).
+        :param int k: Number of results to return per query.
+        :return: Row ids of the k most similar rows for each query (most similar first) and their cosine
+                 similarities, both of shape (n_queries, k).
+        :rtype: tuple
+        """
+        raise NotImplementedError
+
+    def similarities(self, query, positions):
+        """
+        Scores a query against chosen rows only, exactly, whatever the backend.
+
+        :param query: Query vector, shape (1, n_dimensions).
+        :param numpy.ndarray positions: Positions of the rows to score (indexes into `row_ids`).
+        :return: Cosine similarity of the query to each of the rows.
+        :rtype: numpy.ndarray
+        """
+        query = query if sparse.issparse(query) else np.asarray(query).reshape(1, -1)
+        return _dot(self.vectors[positions], normalize_vectors(query)).ravel()
+
+    def _exact_top_k(self, queries, k):
+        positions, similarities = select_top_k(_dot(queries, self.vectors), k)
+        return self.row_ids[positions], similarities
+
+    def _rerank(self, queries, candidates, k):
+        # exact scores for each query's candidate rows. a query with fewer than k candidates is scored against every
+        # row instead, so every query gets k results
+        k = min(k, len(self.row_ids))
+        row_ids = np.zeros((queries.shape[0], k), dtype=self.row_ids.dtype)
+        similarities = np.zeros((queries.shape[0], k), dtype=np.float32)
+        for i, rows in enumerate(candidates):
+            query = queries[i:i + 1]
+            if len(rows) < k:
+                ids, scores = self._exact_top_k(query, k)
+                row_ids[i], similarities[i] = ids[0], scores[0]
+                continue
+
+            top, scores = select_top_k(_dot(self.vectors[rows], query).T, k)
+            row_ids[i], similarities[i] = self.row_ids[rows[top[0]]], scores[0]
+
+        return row_ids, similarities
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def __init__(self, vectors, row_ids, normalized=False):
+        if vectors.shape[0] != len(row_ids):
+            raise ValueError('vectors and row_ids must have the same number of rows.')
+
+        # rows that are already unit length (e.g. memory mapped from a model artifact) are used as is, without a copy
+        self.vectors = vectors if normalized else normalize_vectors(vectors)
+        self.row_ids = np.asarray(row_ids)
+        self.n_dimensions = self.vectors.shape[1]
+
+
+class ExactIndex(SimilarityIndex):
+    """
+    Scores every row: cosine similarity against all rows is a single matrix product, and the top k rows are selected
+    with a partial sort.
+    """
+    def top_k_batch(self, queries, k=10):
+        return self._exact_top_k(normalize_vectors(queries), k)
+
+
+class LSHIndex(SimilarityIndex):
+    """
+    Random hyperplane locality sensitive hashing. Each of `n_tables` tables gives every row an `n_bits` signature (the
+    sides of random hyperplanes it lies on), so rows separated by a small angle are likely to share a signature in at
+    least one table. The signatures of all tables are kept in one sorted array (prefixed with their table), so finding a
+    query's bucket in every table is a single binary search. More tables raise recall; more bits make buckets smaller
+    and searches faster.
+    """
+    def _keys(self, vectors):
+        bits = _dot(vectors, self.hyperplanes) > self._offsets
+        bits = bits.reshape(vectors.shape[0], self.n_tables, self.n_bits)
+        signatures = bits.astype(np.int64) @ (np.int64(1) << np.arange(self.n_bits, dtype=np.int64))
+
+        return signatures + (np.arange(self.n_tables, dtype=np.int64) << self.n_bits)
+
+    def top_k_batch(self, queries, k=10):
+        queries = normalize_vectors(queries)
+        keys = self._keys(queries)
+        starts = np.searchsorted(self._sorted_keys, keys)
+        stops = np.searchsorted(self._sorted_keys, keys + 1)
+
+        candidates = [np.unique(self._sorted_rows[_concatenate_ranges(query_starts, query_stops)])
+                      for query_starts, query_stops in zip(starts, stops)]
+
+        return self._rerank(queries, candidates, k)
+
+    def __init__(self, vectors, row_ids, normalized=False, n_tables=32, n_bits=8, random_state=0):
+        super().__init__(vectors, row_ids, normalized=normalized)
+        if n_bits + int(n_tables).bit_length() > 62:
+            raise ValueError('n_bits is too large for the signatures of this many tables to fit in an int64.')
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+
+        random_state = np.random.RandomState(random_state)
+        self.hyperplanes = random_state.standard_normal((n_tables * n_bits, self.n_dimensions)).astype(np.float32)
+        # the hyperplanes pass through the mean row rather than the origin. rows with non-negative weights (like topic
+        # weights) all lie in one corner of the space, which most hyperplanes through the origin wouldn't split
+        mean = np.asarray(self.vectors.mean(axis=0)).ravel()
+        self._offsets = self.hyperplanes @ mean
+
+        keys = self._keys(self.vectors).ravel()
+        order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[order]
+        self._sorted_rows = order // n_tables
+
+
+class IVFIndex(SimilarityIndex):
+    """
+    Inverted file index. Rows are clustered into `n_lists` lists with spherical k-means, and a query is only scored
+    against the rows in the `n_probe` lists whose centroids are most similar to it. More probes raise recall.
+    """
+    def _assign(self, vectors, batch_size=4096):
+        # scored in batches so that the (n_rows, n_lists) score matrix stays small
+        return np.concatenate([_dot(vectors[start:start + batch_size], self.centroids).argmax(axis=1)
+                               for start in range(0, vectors.shape[0], batch_size)])
+
+    def _fit_centroids(self, n_iter, random_state):
+        n_rows = self.vectors.shape[0]
+        self.centroids = normalize_vectors(self.vectors[random_state.choice(n_rows, self.n_lists, replace=False)])
+        if sparse.issparse(self.centroids):
+            self.centroids = self.centroids.toarray()
+
+        for _ in range(n_iter):
+            assignments = self._assign(self.vectors)
+            membership = sparse.csr_matrix((np.ones(n_rows, dtype=np.float32), (assignments, np.arange(n_rows))),
+                                           shape=(self.n_lists, n_rows))
+            sums = membership @ self.vectors
+            centroids = l2_normalize_rows(sums.toarray() if sparse.issparse(sums) else sums)
+
+            # re-seed empty lists with random rows
+            empty = np.flatnonzero(np.bincount(assignments, minlength=self.n_lists) == 0)
+            if len(empty):
+                seeds = self.vectors[random_state.choice(n_rows, len(empty), replace=False)]
+                centroids[empty] = seeds.toarray() if sparse.issparse(seeds) else seeds
+            self.centroids = centroids
+
+        return self._assign(self.vectors)
+
+    def top_k_batch(self, queries, k=10):
+        queries = normalize_vectors(queries)
+        n_probe = min(self.n_probe, self.n_lists)
+        nearest_lists, _ = select_top_k(_dot(queries, self.centroids), n_probe)
+
+        candidates = [self._list_rows[_concatenate_ranges(self._list_offsets[lists], self._list_offsets[lists + 1])]
+                      for lists in nearest_lists]
+
+        return self._rerank(queries, candidates, k)
+
+    def __init__(self, vectors, row_ids, normalized=False, n_lists=None, n_probe=8, n_iter=10, random_state=0):
+        super().__init__(vectors, row_ids, normalized=normalized)
+        n_rows = self.vectors.shape[0]
+        self.n_lists = max(1, min(n_rows, int(round(np.sqrt(n_rows))) if n_lists is None else n_lists))
+        self.n_probe = n_probe
+
+        assignments = self._fit_centroids(n_iter, np.random.RandomState(random_state))
+        # rows grouped by list: list i is _list_rows[_list_offsets[i]:_list_offsets[i + 1]]
+        self._list_rows = np.argsort(assignments, kind='stable')
+        self._list_offsets = np.searchsorted(assignments[self._list_rows], np.arange(self.n_lists + 1))
+
+
+SIMILARITY_BACKENDS = {'exact': ExactIndex, 'lsh': LSHIndex, 'ivf': IVFIndex}
+
+
+def create_similarity_index(backend, vectors, row_ids, normalized=False, **params):
+    """
+    Builds the similarity index used to rank search results.
+
+    :param str backend: 'exact', 'lsh' or 'ivf'.
+    :param vectors: Row vectors to index (numpy array or scipy sparse matrix).
+    :param numpy.ndarray row_ids: Id of each row, returned in search results.
+    :param bool normalized: If True, the rows are already unit length and are used without a copy.
+    :param params: Backend settings, e.g. n_tables and n_bits for 'lsh', or n_lists and n_probe for 'ivf'.
+    :return: Similarity index.
+    :rtype: SimilarityIndex
+    """
+    if backend not in SIMILARITY_BACKENDS:
+        raise ValueError(f'Unknown similarity backend: {backend}')
+
+    return SIMILARITY_BACKENDS[backend](vectors, row_ids, normalized=normalized, **params)
+
+
+def recall_at_k(row_ids, true_row_ids):
+    """
+    :param numpy.ndarray row_ids: Approximate results, one row per query.
+    :param numpy.ndarray true_row_ids: Exact results, one row per query.
+    :return: Average fraction of the exact results that were found.
+    :rtype: float
+    """
+    return float(np.mean([len(np.intersect1d(found, true)) / len(true) for found, true in zip(row_ids, true_row_ids)]))
+
+
+def benchmark_backends(vectors, queries, configurations, k=10):
+    """
+    Measures the recall at k and search latency of similarity backends against the exact results.
+
+    :param vectors: Row vectors to index (numpy array or scipy sparse matrix).
+    :param queries: Query vectors.
+    :param list configurations: (backend, params) pairs to measure.
+    :param int k: Number of results per query.
+    :return: One dictionary per configuration with the build time, recall at k and mean latency per query.
+    :rtype: list
+    """
+    row_ids = np.arange(vectors.shape[0])
+    true_row_ids, _ = ExactIndex(vectors, row_ids).top_k_batch(queries, k=k)
+
+    results = []
+    for backend, params in configurations:
+        start = time.perf_counter()
+        index = create_similarity_index(backend, vectors, row_ids, **params)
+        build_seconds = time.perf_counter() - start
+
+        # one query at a time, since that's how searches arrive
+        start = time.perf_counter()
+        found = np.vstack([index.top_k(queries[i:i + 1], k=k)[0] for i in range(queries.shape[0])])
+        latency = (time.perf_counter() - start) / queries.shape[0]
+
+        results.append({'backend': backend, 'params': params, 'build_seconds': build_seconds,
+                        'recall': recall_at_k(found, true_row_ids), 'latency_ms': latency * 1000})
+
+    return results
+
+
+def synthetic_topic_vectors(n_documents, n_dimensions, n_queries=200, random_state=0):
+    """
+    Generates non-negative vectors that look like document-topic weights (each document a sparse mixture of topics),
+    and queries that are noisy copies of random documents.
+
+    :param int n_documents: Number of rows.
+    :param int n_dimensions: Number of topics.
+    :param int n_queries: Number of queries.
+    :param int random_state: Seed.
+    :return: Document vectors and query vectors.
+    :rtype: tuple
+    """
+    random_state = np.random.RandomState(random_state)
+    vectors = random_state.dirichlet(np.full(n_dimensions, 0.1), size=n_documents).astype(np.float32)
+    queries = vectors[random_state.choice(n_documents, n_queries)]
+    queries = np.abs(queries + random_state.normal(scale=0.05, size=queries.shape)).astype(np.float32)
+
+    return vectors, queries
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] != ['benchmark']:
+        sys.exit('Usage: python -m app.similarity benchmark [n_documents] [n_dimensions]')
+
+    n_documents = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    n_dimensions = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    vectors, queries = synthetic_topic_vectors(n_documents, n_dimensions)
+
+    configurations = [('exact', {})]
+    configurations += [('lsh', {'n_tables': n_tables, 'n_bits': n_bits}) for n_tables, n_bits in [(16, 8), (32, 8),
+                                                                                                   (32, 10)]]
+    configurations += [('ivf', {'n_probe': n_probe}) for n_probe in [2, 4, 8, 16]]
+
+    print(f'{n_documents} documents, {n_dimensions} dimensions, {queries.shape[0]} queries')
+    for result in benchmark_backends(vectors, queries, configurations):
+        print(f'{result["backend"]:<6} {str(result["params"]):<32} recall@10={result["recall"]:.3f} '
+              f'latency={result["latency_ms"]:.3f}ms build={result["build_seconds"]:.2f}s')
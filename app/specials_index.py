@@ -0,0 +1,81 @@
+"""
+Contains an inverted index from topic to the comedy specials in that topic, used to filter and paginate the catalogue on
+the server instead of sending every comedy special to the browser. Posting lists are sorted arrays of metadata row ids,
+so filtering by several topics is an intersection of a few small arrays rather than a scan over all metadata.
+"""
+import math
+
+import numpy as np
+
+from app.topics import TOPIC_COLUMNS
+
+
+class SpecialsIndex:
+    """
+    Per-topic posting lists plus the release year of every comedy special.
+    """
+    def topic_number(self, topic):
+        """
+        Resolves a topic given either by name (e.g. 'political') or by number (e.g. '3').
+
+        :param str topic: Topic name or number.
+        :return: Topic number.
+        :rtype: int
+        """
+        if topic in self.topic_names:
+            return self.topic_names.index(topic)
+        if topic.isdigit() and int(topic) < len(self.postings):
+            return int(topic)
+
+        raise KeyError(f'Unknown topic: {topic}')
+
+    def filter(self, topics=(), year_from=None, year_to=None):
+        """
+        Finds the comedy specials that are members of every given topic and were released within the given years.
+
+        :param list topics: Topic numbers. Comedy specials must be members of all of them.
+        :param int year_from: Earliest release year (inclusive).
+        :param int year_to: Latest release year (inclusive).
+        :return: Sorted row ids of the matching comedy specials.
+        :rtype: numpy.ndarray
+        """
+        # intersect the shortest posting lists first so the intermediate results stay small
+        postings = sorted((self.postings[topic] for topic in set(topics)), key=len)
+        row_ids = postings[0] if postings else np.arange(len(self.years))
+        for posting in postings[1:]:
+            row_ids = np.intersect1d(row_ids, posting, assume_unique=True)
+
+        if year_from is not None:
+            row_ids = row_ids[self.years[row_ids] >= year_from]
+        if year_to is not None:
+            row_ids = row_ids[self.years[row_ids] <= year_to]
+
+        return row_ids
+
+    @staticmethod
+    def paginate(row_ids, page, per_page):
+        """
+        :param numpy.ndarray row_ids: Row ids to paginate.
+        :param int page: Page number, starting at 1.
+        :param int per_page: Number of rows per page.
+        :return: Row ids on the requested page and the total number of pages.
+        :rtype: tuple
+        """
+        start = (page - 1) * per_page
+
+        return row_ids[start:start + per_page], max(1, math.ceil(len(row_ids) / per_page))
+
+    @classmethod
+    def from_metadata(cls, metadata, membership):
+        """
+        :param pandas.DataFrame metadata: Metadata pandas dataframe.
+        :param TopicMembership membership: Topic membership of each row of `metadata`.
+        :return: Index over the rows of `metadata`.
+        :rtype: SpecialsIndex
+        """
+        return cls(membership, metadata['year'].values, topic_names=TOPIC_COLUMNS)
+
+    def __init__(self, membership, years, topic_names=None):
+        self.postings = [membership.members(topic) for topic in range(membership.n_topics)]
+        self.years = np.asarray(years)
+        self.topic_names = list(topic_names) if topic_names is not None else []
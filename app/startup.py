@@ -0,0 +1,373 @@
+"""
+Contains the start up subsystem for the Flask app. Loading the models, metadata and the indexes built from them is
+deferred until the first request (or done once in the gunicorn master when `preload_app` is on, so that every worker
+shares the loaded objects copy-on-write). Metadata is read from a local snapshot rather than from Mongo (see
+`app.metadata_store`), models are memory mapped from the current model artifact (falling back to the legacy pickles if
+none has been exported), NLTK data must already be installed, and the time spent in each start up phase is logged.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import dill as pickle
+import joblib
+import numpy as np
+
+from app import nlp_pipeline
+from app.artifacts import current_version, load_current_artifact
+from app.batching import SearchBatcher
+from app.lexical_index import LexicalIndex
+from app.metadata_store import APP_METADATA_FIELDS, MongoMetadataStore, create_metadata_store
+from app.neighbours import NeighbourLists
+from app.page_cache import PageCache
+from app.projection import TopicProjector
+from app.query_cache import create_query_cache, fingerprint
+from app.search import search_batch
+from app.similarity import create_similarity_index
+from app.specials_index import SpecialsIndex
+from app.topics import TOPIC_COLUMNS, TopicMembership
+
+# the pickled pipeline refers to the module by the name it had when it was pickled
+sys.modules['nlp_pipeline'] = nlp_pipeline
+
+logger = logging.getLogger(__name__)
+
+# the app only needs wordnet (for lemmatizing search terms); the stop words are stored in the pickled pipeline
+APP_NLTK_RESOURCES = ['corpora/wordnet']
+
+
+class StartupTimings:
+    """
+    Records how long each phase of start up takes.
+    """
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the body of a `with` block as one start up phase.
+
+        :param str name: Name of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    def __str__(self):
+        return ', '.join(f'{name}={seconds:.3f}s' for name, seconds in self.phases.items())
+
+    def __init__(self):
+        self.phases = {}
+
+
+class Resources:
+    """
+    Everything the app needs to answer requests: the metadata, the NLP pipeline and topic model, and the indexes and
+    caches built from them.
+    """
+    def comedy_info(self, row_ids=None):
+        """
+        Builds the data shown on each comedy special's card: comedian, title, year, image and whether the special is a
+        member of each topic ('1' or '0'), which the page uses to filter cards by topic.
+
+        :param numpy.ndarray row_ids: Positional rows of the metadata to include, in display order. Defaults to all
+                                      rows.
+        :return: List of dictionaries, one per comedy special.
+        :rtype: list
+        """
+        metadata = self.metadata if row_ids is None else self.metadata.iloc[row_ids]
+
+        return [
+            {'id': int(comedy_id), 'comedian': comedian, 'title': title, 'year': int(year), 'imageUrl': image_url,
+             'topics': topics}
+            for comedy_id, comedian, title, year, image_url, topics in zip(metadata['comedyId'], metadata['comedian'],
+                                                                           metadata['title'], metadata['year'],
+                                                                           metadata['imageUrl'],
+                                                                           self.membership.flags(row_ids))
+        ]
+
+    def row_of(self, comedy_id):
+        """
+        :param int comedy_id: comedyId of a comedy special.
+        :return: Metadata row of the comedy special, or None if it isn't in the metadata.
+        :rtype: int
+        """
+        return self.row_of_comedy_id.get(comedy_id)
+
+    def similar_specials(self, row_id, k=10):
+        """
+        Finds the comedy specials most similar in topic space to a comedy special: a lookup in the precomputed
+        neighbour lists, or (if there are none, or they are too short) a search of the topic index.
+
+        :param int row_id: Metadata row of the comedy special.
+        :param int k: Number of similar comedy specials to return.
+        :return: Metadata rows of the most similar comedy specials (most similar first) and their cosine similarities.
+        :rtype: tuple
+        """
+        if self.neighbours is not None and k <= self.neighbours.k:
+            return self.neighbours.similar(row_id, k=k)
+
+        row_ids, similarities = self.topic_index.top_k(self.topic_index.vectors[row_id], k=k + 1)
+        not_self = row_ids != row_id
+
+        return row_ids[not_self][:k], similarities[not_self][:k]
+
+    def warm_up(self):
+        """
+        Fills the lemma cache and runs one search through the whole search path, so that the first real request doesn't
+        pay for lazy initialization or for page faults on the memory mapped model arrays.
+        """
+        self.pipeline.warm_lemma_cache()
+        search_batch(['warm up'], self.pipeline, self.projector, self.topic_index)
+
+    def __init__(self, metadata, pipeline, topic_model, config, version, doc_topic_unit=None):
+        self.metadata = metadata
+        self.pipeline = pipeline
+        self.topic_model = topic_model
+        # projects search terms into topic space much faster than the topic model's own iterative solver
+        self.projector = TopicProjector.from_topic_model(topic_model)
+        self.version = version
+        # comedy specials are identified by comedyId in the API, since metadata rows move whenever specials are added
+        # or dropped
+        self.row_of_comedy_id = dict(zip(metadata['comedyId'], range(len(metadata))))
+
+        # topic membership (for filtering) and the normalized document-topic matrix (for ranking searches)
+        self.membership = TopicMembership.from_metadata(metadata, threshold=config['TOPIC_THRESHOLD'])
+        self.specials_index = SpecialsIndex.from_metadata(metadata, self.membership)
+        if doc_topic_unit is not None and len(doc_topic_unit) == len(metadata):
+            doc_topic, normalized = doc_topic_unit, True
+        else:
+            doc_topic, normalized = metadata[TOPIC_COLUMNS].values, False
+        self.topic_index = create_similarity_index(config['SIMILARITY_BACKEND'], doc_topic,
+                                                   row_ids=np.arange(len(metadata)), normalized=normalized,
+                                                   **config['SIMILARITY_PARAMS'])
+        # word for word search of the transcripts (if their index matches the pipeline's preprocessing) and of the
+        # comedians and titles
+        self.lexical_index = LexicalIndex.from_metadata(metadata, path=config['LEXICAL_INDEX_PATH'], pipeline=pipeline)
+        # each comedy special's most similar comedy specials, computed ahead of time by `python -m app.neighbours build`
+        self.neighbours = NeighbourLists.load(config['NEIGHBOURS_PATH'], metadata)
+
+        # the home page shows every comedy special, so its card data is computed once rather than on every request
+        self.index_comedy_info = self.comedy_info()
+        self.page_cache = PageCache()
+
+        # cache search results; the version fingerprint invalidates entries whenever the models or metadata change
+        self.query_cache = create_query_cache(backend=config['QUERY_CACHE_BACKEND'],
+                                              path=config['QUERY_CACHE_PATH'],
+                                              maxsize=config['QUERY_CACHE_SIZE'],
+                                              ttl=config['QUERY_CACHE_TTL'],
+                                              version=version)
+        # coalesces searches made at the same time by the worker's threads into batches
+        self.search_batcher = SearchBatcher(pipeline, self.projector, self.topic_index, cache=self.query_cache,
+                                            max_batch_size=config['SEARCH_BATCH_MAX_SIZE'],
+                                            max_wait=config['SEARCH_BATCH_MAX_WAIT'])
+
+
+def load_metadata(config):
+    """
+    Loads the metadata from the configured metadata store (by default, the local snapshot). Falls back to querying
+    Mongo if there is no snapshot yet.
+
+    :param dict config: Flask app config.
+    :return: Metadata pandas dataframe.
+    :rtype: pandas.DataFrame
+    """
+    store = create_metadata_store(config['METADATA_STORE'], path=config['METADATA_SNAPSHOT_PATH'])
+    try:
+        return store.load()
+    except FileNotFoundError:
+        logger.warning('No metadata snapshot at %s; loading metadata from Mongo. Run `python -m app.metadata_store '
+                       'sync` to create one.', config['METADATA_SNAPSHOT_PATH'])
+        return MongoMetadataStore(fields=APP_METADATA_FIELDS).load()
+
+
+def load_resources(config):
+    """
+    Loads the metadata and models and builds everything derived from them, logging the time spent in each phase.
+
+    :param dict config: Flask app config.
+    :return: Loaded resources and the start up timings.
+    :rtype: tuple
+    """
+    timings = StartupTimings()
+
+    with timings.phase('nltk'):
+        nlp_pipeline.ensure_nltk_data(APP_NLTK_RESOURCES)
+    with timings.phase('metadata'):
+        metadata = load_metadata(config)
+
+    artifact = load_current_artifact(config['MODEL_ARTIFACT_ROOT'])
+    if artifact is not None:
+        with timings.phase('pipeline'):
+            pipeline = artifact.pipeline()
+        with timings.phase('topic_model'):
+            topic_model = artifact.topic_model()
+        version = f'{artifact.version}-{fingerprint(metadata=metadata)}'
+        doc_topic_unit = artifact.doc_topic_unit
+        if not artifact.matches_metadata(metadata):
+            logger.warning('The document-topic matrix of model artifact %s was computed from different topic weights '
+                           'than the metadata; indexing the metadata topic weights instead.', artifact.version)
+            doc_topic_unit = None
+    else:
+        logger.warning('No model artifact in %s; loading the legacy model pickles.', config['MODEL_ARTIFACT_ROOT'])
+        with timings.phase('pipeline'):
+            with open(config['PIPELINE_PATH'], 'rb') as f:
+                pipeline = pickle.load(f)
+        with timings.phase('topic_model'):
+            topic_model = joblib.load(config['TOPIC_MODEL_PATH'])
+        version = fingerprint([config['PIPELINE_PATH'], config['TOPIC_MODEL_PATH']], metadata)
+        doc_topic_unit = None
+
+    with timings.phase('indexes'):
+        resources = Resources(metadata, pipeline, topic_model, config, version, doc_topic_unit=doc_topic_unit)
+    with timings.phase('warm_up'):
+        resources.warm_up()
+
+    logger.info('Loaded %d comedy specials (version %s) in %.3fs: %s', len(metadata), version, timings.total, timings)
+
+    return resources, timings
+
+
+def source_version(config):
+    """
+    Cheaply identifies what `load_resources` would load right now, without loading it: the current model artifact
+    version (or the legacy pickles' modification times) and the modification times of the metadata snapshot, the
+    lexical index and the neighbour lists.
+
+    :param dict config: Flask app config.
+    :return: Hashable identifier that changes whenever the models or metadata on disk change.
+    :rtype: tuple
+    """
+    artifact_version = current_version(config['MODEL_ARTIFACT_ROOT'])
+    file_paths = [config['METADATA_SNAPSHOT_PATH'], os.path.join(config['LEXICAL_INDEX_PATH'], 'manifest.json'),
+                  os.path.join(config['NEIGHBOURS_PATH'], 'manifest.json')]
+    if artifact_version is None:
+        file_paths.extend([config['PIPELINE_PATH'], config['TOPIC_MODEL_PATH']])
+
+    stats = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stats.append(None)
+
+    return (artifact_version, *stats)
+
+
+class LazyResources:
+    """
+    Loads the app's resources on first use, exactly once, no matter how many threads ask for them at the same time.
+
+    If loading fails, requests get the error for the next `RESOURCES_RETRY_INTERVAL` seconds rather than each trying the
+    whole load again, and then the next request retries. (With gunicorn's `preload_app`, a failed load stops the
+    master from starting any workers instead.)
+
+    If `MODEL_RELOAD_INTERVAL` is set, it also checks (at most that often, on a request) whether new models or metadata
+    have been published, and if so loads and warms them in a background thread and then swaps them in. Requests keep
+    getting the old resources until the new ones are ready, and requests that already hold the old ones finish with
+    them.
+    """
+    def get(self):
+        """
+        :return: Loaded resources, loading them first if necessary.
+        :rtype: Resources
+        """
+        if self._resources is None:
+            with self._lock:
+                if self._resources is None:
+                    self._load()
+        elif self.reload_interval and time.monotonic() >= self._next_check:
+            self._check_for_updates()
+
+        return self._resources
+
+    def load(self):
+        """
+        Loads the resources now rather than on first use, e.g. in the gunicorn master before forking workers.
+        """
+        self.get()
+
+    def _load(self):
+        if self._load_error is not None and time.monotonic() < self._retry_at:
+            raise RuntimeError(f'Loading the app resources failed; retrying in '
+                               f'{self._retry_at - time.monotonic():.0f}s.') from self._load_error
+
+        try:
+            source = source_version(self.config)
+            self._resources, self.timings = load_resources(self.config)
+        except Exception as e:
+            logger.exception('Failed to load app resources; retrying in %ss.', self.retry_interval)
+            self._load_error, self._retry_at = e, time.monotonic() + self.retry_interval
+            raise
+
+        self._source, self._load_error = source, None
+
+    def set(self, resources):
+        """
+        Serves the given resources instead of loading them, e.g. resources built from synthetic data by the
+        benchmarks. They are still replaced if new models or metadata are published on disk.
+
+        :param Resources resources: Resources to serve.
+        """
+        with self._lock:
+            self._source = source_version(self.config)
+            self._resources = resources
+
+    def _check_for_updates(self):
+        self._next_check = time.monotonic() + self.reload_interval
+        if source_version(self.config) != self._source and not self._lock.locked():
+            threading.Thread(target=self.reload, name='reload-resources', daemon=True).start()
+
+    def reload(self, force=False):
+        """
+        Loads the models and metadata currently on disk and swaps them in once they are ready.
+
+        :param bool force: If True, reload even if nothing on disk has changed.
+        :return: True if new resources were swapped in.
+        :rtype: bool
+        """
+        with self._lock:
+            source = source_version(self.config)
+            if source == self._source and not force:
+                return False
+
+            try:
+                resources, timings = load_resources(self.config)
+            except Exception:
+                # keep serving the current resources, and don't retry until something changes again
+                logger.exception('Failed to reload app resources; still serving version %s.',
+                                 self._resources.version if self._resources is not None else None)
+                self._source = source
+                return False
+
+            # a single reference assignment, so every request sees either the old resources or the new ones
+            self._resources, self.timings, self._source = resources, timings, source
+            self.reloads += 1
+
+        logger.info('Reloaded app resources (version %s).', resources.version)
+        return True
+
+    @property
+    def loaded(self):
+        return self._resources is not None
+
+    def __init__(self, config):
+        self.config = config
+        self.reload_interval = config.get('MODEL_RELOAD_INTERVAL', 0)
+        self.retry_interval = config.get('RESOURCES_RETRY_INTERVAL', 0)
+        self.timings = None
+        self.reloads = 0
+        self._resources = None
+        self._source = None
+        self._next_check = 0.0
+        self._load_error = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
@@ -1,13 +1,66 @@
-// filters comedy specials by topic/category upon changing the dropdown
+// builds the HTML element for a single comedy special card (same markup as templates/index.html)
+function buildCard(special) {
+    var card = $('<div class="card" style="width: 13rem; margin: 5px;"></div>');
+    special.topics.forEach(function(flag, topic) {
+        card.attr('data-topic-' + topic.toString(), flag);
+    });
+
+    var image = $('<img height="280px" style="padding:5px;">').attr('src', special.imageUrl).attr('alt', special.title);
+    var body = $('<div class="card-body"></div>');
+    body.append($('<h6 class="card-text"></h6>').text(special.comedian));
+    body.append($('<p></p>')
+        .append($('<small></small>').text(special.title)).append('<br>')
+        .append($('<small></small>').text('(' + special.year + ')')));
+
+    return card.append(image).append(body);
+}
+
 $(document).ready(function(){
+    var cards = $("#comedyCards");
+    var lazy = cards.attr("data-lazy") === "true";
+    var perPage = parseInt(cards.attr("data-per-page"));
+    var topic = null;
+    var page = 1;
+
+    // fetches one page of comedy specials (filtered by the selected topic) from the server
+    function loadPage(replace) {
+        var url = "/api/specials?page=" + page + "&per_page=" + perPage;
+        if (topic !== null) {
+            url += "&topic=" + topic;
+        }
+
+        fetch(url).then(function(response) { return response.json(); }).then(function(data) {
+            if (replace) {
+                cards.empty();
+            }
+            data.specials.forEach(function(special) {
+                cards.append(buildCard(special));
+            });
+            $("#loadMore").toggle(data.page < data.pages);
+        });
+    }
+
+    $("#loadMore").click(function(){
+        page += 1;
+        loadPage(false);
+    });
+
+    // filters comedy specials by topic/category upon changing the dropdown
     $(".dropdown-menu a").click(function(){
         // change dropdown to show selected option
         $(".btn-secondary:first-child").text($(this).text());
         $(".btn-secondary:first-child").val($(this).text());
 
-        // filter topics
         var optionValue = $(this).attr("data-option");
-        $('div[data-topic-' + optionValue.toString() + ' = "0"]').hide();
-        $('div[data-topic-' + optionValue.toString() + ' = "1"]').show();
+        if (lazy) {
+            // the home page only holds one page of cards, so filter on the server
+            topic = optionValue;
+            page = 1;
+            loadPage(true);
+        } else {
+            // search results are all on the page already, so filter them in place
+            $('div[data-topic-' + optionValue.toString() + ' = "0"]').hide();
+            $('div[data-topic-' + optionValue.toString() + ' = "1"]').show();
+        }
     });
-});
\ No newline at end of file
+});
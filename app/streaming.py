@@ -0,0 +1,291 @@
+"""
+Contains vectorizers and a topic model that can be fit one batch of documents at a time, so that the corpus never has
+to be held in memory at once:
+
+    StreamingTfidfVectorizer    TfidfVectorizer whose vocabulary and IDF are built from per-batch document frequencies.
+                                Memory grows with the number of distinct words, not the number of documents, and the
+                                result is the same as fitting sklearn's TfidfVectorizer to the whole corpus.
+    HashingTfidfVectorizer      TF-IDF over hashed words, for corpora whose distinct words don't fit in memory either.
+                                Memory is fixed by `n_features`, but there is no vocabulary to read topics from.
+    MiniBatchNMF                NMF topic model updated one minibatch at a time (sklearn 0.23 has none).
+
+Both vectorizers can be passed to TranscriptProcessingPipeline as its vectorizer; see
+`TranscriptProcessingPipeline.fit_stream`.
+"""
+import numbers
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from app.projection import TopicProjector
+
+
+def _document_count_limits(min_df, max_df, n_documents):
+    # the same interpretation of min_df and max_df as sklearn's CountVectorizer: integers are document counts and
+    # floats are proportions of the corpus
+    max_doc_count = max_df if isinstance(max_df, numbers.Integral) else max_df * n_documents
+    min_doc_count = min_df if isinstance(min_df, numbers.Integral) else min_df * n_documents
+    if max_doc_count < min_doc_count:
+        raise ValueError('max_df corresponds to < documents than min_df')
+
+    return min_doc_count, max_doc_count
+
+
+class StreamingTfidfVectorizer(TfidfVectorizer):
+    """
+    sklearn TfidfVectorizer that can also be fit in batches: call `partial_fit` with each batch of documents, then
+    `finish_fit` once every batch has been seen. `fit` and `fit_transform` still work on a whole corpus.
+    """
+    def partial_fit(self, raw_documents):
+        """
+        Counts the documents each word appears in for one batch of documents.
+
+        :param list raw_documents: Batch of documents.
+        :return: The vectorizer.
+        :rtype: StreamingTfidfVectorizer
+        """
+        if not hasattr(self, '_document_frequencies'):
+            self._n_documents = 0
+            self._document_frequencies = Counter()
+            self._term_frequencies = Counter()
+
+        analyze = self.build_analyzer()
+        for document in raw_documents:
+            terms = analyze(document)
+            self._document_frequencies.update(set(terms))
+            # only needed to pick the most frequent words
+            if self.max_features is not None:
+                self._term_frequencies.update(terms)
+            self._n_documents += 1
+
+        return self
+
+    def finish_fit(self):
+        """
+        Builds the vocabulary and IDF weights from the document frequencies counted by `partial_fit`, exactly as
+        `fit` would have from the whole corpus, and frees the counts.
+
+        :return: The fitted vectorizer.
+        :rtype: StreamingTfidfVectorizer
+        """
+        n_documents = getattr(self, '_n_documents', 0)
+        if not n_documents:
+            raise ValueError('partial_fit must be called with at least one document before finish_fit.')
+
+        min_doc_count, max_doc_count = _document_count_limits(self.min_df, self.max_df, n_documents)
+        terms = sorted(term for term, document_frequency in self._document_frequencies.items()
+                       if min_doc_count <= document_frequency <= max_doc_count)
+        if self.max_features is not None and len(terms) > self.max_features:
+            terms = sorted(sorted(terms, key=lambda term: -self._term_frequencies[term])[:self.max_features])
+        if not terms:
+            raise ValueError('After pruning, no terms remain. Try a lower min_df or a higher max_df.')
+
+        self.fixed_vocabulary_ = False
+        self.vocabulary_ = {term: column for column, term in enumerate(terms)}
+
+        self._tfidf = TfidfTransformer(norm=self.norm, use_idf=self.use_idf, smooth_idf=self.smooth_idf,
+                                       sublinear_tf=self.sublinear_tf)
+        self._tfidf.n_features_in_ = len(terms)
+        if self.use_idf:
+            # sklearn's idf: pretend one extra document contains every word if smooth_idf is on
+            document_frequencies = np.array([self._document_frequencies[term] for term in terms], dtype=np.float64)
+            smooth = int(self.smooth_idf)
+            self._tfidf.idf_ = np.log((n_documents + smooth) / (document_frequencies + smooth)) + 1
+
+        del self._n_documents, self._document_frequencies, self._term_frequencies
+
+        return self
+
+
+class HashingTfidfVectorizer(BaseEstimator):
+    """
+    TF-IDF vectorizer that maps words to columns by hashing, fit in batches like StreamingTfidfVectorizer. Only the
+    document frequency of each of the `n_features` columns is kept, however many distinct words the corpus has.
+    Columns outside the min_df/max_df limits are zeroed rather than removed. Hash collisions make columns ambiguous, so
+    it has no vocabulary or feature names and can't be exported as a model artifact.
+    """
+    def _hashing_vectorizer(self):
+        return HashingVectorizer(stop_words=self.stop_words, n_features=self.n_features, alternate_sign=False,
+                                 norm=None)
+
+    def _hashed_counts(self, raw_documents):
+        return self._hashing_vectorizer().transform(raw_documents)
+
+    def build_analyzer(self):
+        """
+        :return: Function splitting a document into the words that are hashed to columns.
+        :rtype: function
+        """
+        return self._hashing_vectorizer().build_analyzer()
+
+    def partial_fit(self, raw_documents):
+        """
+        Counts the documents each column appears in for one batch of documents.
+
+        :param list raw_documents: Batch of documents.
+        :return: The vectorizer.
+        :rtype: HashingTfidfVectorizer
+        """
+        if not hasattr(self, '_document_frequencies'):
+            self._n_documents = 0
+            self._document_frequencies = np.zeros(self.n_features, dtype=np.int64)
+
+        counts = self._hashed_counts(raw_documents)
+        # each document's columns are unique, so counting column indices counts documents
+        self._document_frequencies += np.bincount(counts.indices, minlength=self.n_features)
+        self._n_documents += counts.shape[0]
+
+        return self
+
+    def finish_fit(self):
+        """
+        Computes the IDF weight of each column from the document frequencies counted by `partial_fit`.
+
+        :return: The fitted vectorizer.
+        :rtype: HashingTfidfVectorizer
+        """
+        n_documents = getattr(self, '_n_documents', 0)
+        if not n_documents:
+            raise ValueError('partial_fit must be called with at least one document before finish_fit.')
+
+        min_doc_count, max_doc_count = _document_count_limits(self.min_df, self.max_df, n_documents)
+        document_frequencies = self._document_frequencies
+        kept = (document_frequencies >= min_doc_count) & (document_frequencies <= max_doc_count)
+        self.idf_ = np.where(kept, np.log((n_documents + 1) / (document_frequencies + 1)) + 1, 0.0)
+
+        del self._n_documents, self._document_frequencies
+
+        return self
+
+    def fit(self, raw_documents, y=None):
+        return self.partial_fit(raw_documents).finish_fit()
+
+    def transform(self, raw_documents):
+        """
+        :param list raw_documents: Documents to vectorize.
+        :return: TF-IDF matrix with `n_features` columns.
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if not hasattr(self, 'idf_'):
+            raise ValueError('The hashing vectorizer is not fitted.')
+
+        X = self._hashed_counts(raw_documents) @ sparse.diags(self.idf_)
+        X.eliminate_zeros()
+
+        return normalize(X, norm=self.norm) if self.norm is not None else X.tocsr()
+
+    def fit_transform(self, raw_documents, y=None):
+        return self.fit(raw_documents).transform(raw_documents)
+
+    def __init__(self, stop_words=None, min_df=1, max_df=1.0, n_features=2 ** 20, norm='l2'):
+        self.stop_words = stop_words
+        self.min_df = min_df
+        self.max_df = max_df
+        self.n_features = n_features
+        self.norm = norm
+
+
+class MiniBatchNMF(BaseEstimator, TransformerMixin):
+    """
+    NMF topic model with the Frobenius loss, fit one minibatch of documents at a time (online NMF, after Mairal et al.,
+    2010). For each batch the document-topic weights are solved exactly with the topic-word matrix held fixed, and the
+    topic-word matrix is then updated from two running sums of size n_topics x n_topics and n_topics x n_words, so
+    memory doesn't grow with the number of documents. Older batches are down-weighted by `forget_factor`, since they
+    were solved against older topics.
+
+    `alpha` and `l1_ratio` regularize the document-topic weights as in sklearn's NMF, so the fitted model works with
+    TopicProjector and can be exported as a model artifact.
+    """
+    def _update_components(self):
+        H = self.components_
+        A, B = self._topic_gram, self._topic_word
+        for _ in range(self.max_iter):
+            max_step = 0.0
+            # one sweep of block coordinate descent over the topics (rows of H)
+            for topic in range(self.n_components):
+                if A[topic, topic] <= 0:
+                    continue
+                updated = np.maximum(H[topic] + (B[topic] - A[topic] @ H) / A[topic, topic], 0)
+                max_step = max(max_step, np.abs(updated - H[topic]).max())
+                H[topic] = updated
+
+            if max_step <= self.tol * max(H.max(), 1e-12):
+                break
+
+    def partial_fit(self, X, y=None):
+        """
+        Updates the topics with one minibatch of documents.
+
+        :param X: TF-IDF matrix of the batch (scipy sparse matrix or numpy array).
+        :return: The topic model.
+        :rtype: MiniBatchNMF
+        """
+        X = sparse.csr_matrix(X, dtype=np.float64)
+        if not hasattr(self, 'components_'):
+            # sklearn's random initialization, scaled to the first batch
+            random_state = np.random.RandomState(self.random_state)
+            scale = np.sqrt(X.mean() / self.n_components)
+            self.components_ = scale * np.abs(random_state.standard_normal((self.n_components, X.shape[1])))
+            self.n_components_ = self.n_components
+            self.n_features_in_ = X.shape[1]
+            self._topic_gram = np.zeros((self.n_components, self.n_components))
+            self._topic_word = np.zeros((self.n_components, X.shape[1]))
+            self.n_batches_ = 0
+
+        W = self.transform(X)
+        self._topic_gram = self.forget_factor * self._topic_gram + W.T @ W
+        self._topic_word = self.forget_factor * self._topic_word + np.asarray((X.T @ W).T)
+        self._update_components()
+        self._projector = None
+        self.n_batches_ += 1
+
+        return self
+
+    def fit(self, X, y=None):
+        """
+        Fits the topics to an in-memory corpus, `n_epochs` passes of `batch_size` documents at a time.
+
+        :param X: TF-IDF matrix (scipy sparse matrix or numpy array).
+        :return: The fitted topic model.
+        :rtype: MiniBatchNMF
+        """
+        X = sparse.csr_matrix(X, dtype=np.float64)
+        for _ in range(self.n_epochs):
+            for start in range(0, X.shape[0], self.batch_size):
+                self.partial_fit(X[start:start + self.batch_size])
+
+        return self
+
+    def transform(self, X):
+        """
+        :param X: TF-IDF matrix (scipy sparse matrix or numpy array).
+        :return: Non-negative document-topic weights.
+        :rtype: numpy.ndarray
+        """
+        if getattr(self, '_projector', None) is None:
+            self._projector = TopicProjector.from_topic_model(self)
+
+        return self._projector.transform(X)
+
+    def __getstate__(self):
+        # the projector is rebuilt from the components when needed
+        state = self.__dict__.copy()
+        state.pop('_projector', None)
+
+        return state
+
+    def __init__(self, n_components, alpha=0.0, l1_ratio=0.0, batch_size=1000, n_epochs=10, forget_factor=0.9,
+                 max_iter=50, tol=1e-4, random_state=None):
+        self.n_components = n_components
+        self.alpha = alpha
+        self.l1_ratio = l1_ratio
+        self.batch_size = batch_size
+        self.n_epochs = n_epochs
+        self.forget_factor = forget_factor
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_state = random_state
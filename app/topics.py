@@ -0,0 +1,87 @@
+"""
+Contains the topic names produced by the topic model and a compact representation of which comedy specials belong to
+which topics. A comedy special is a member of a topic if its topic weight is above a threshold; membership for every
+special is computed in one NumPy operation and stored as a packed bitmap (one bit per topic, one row per special).
+"""
+import hashlib
+import json
+
+import numpy as np
+
+# metadata column holding each topic's weights, in the order the topic model produces them
+TOPIC_COLUMNS = ['observational', 'theBlackExperience', 'britishAustralian',
+                 'political', 'immigrantUpbringing', 'relationshipsSex']
+
+
+def topic_weights_fingerprint(comedy_ids, topic_weights):
+    """
+    Identifies a set of comedy specials and their topic weights, so that anything computed from the weights (a model
+    artifact's document-topic matrix, the neighbour lists) can be checked against the metadata being served. Weights are
+    hashed as float64 bytes, which survive the round trip through Mongo and the SQLite snapshot exactly.
+
+    :param comedy_ids: comedyId of each comedy special.
+    :param numpy.ndarray topic_weights: Topic weights of each comedy special, in TOPIC_COLUMNS order.
+    :return: Short hexadecimal fingerprint.
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([str(comedy_id) for comedy_id in comedy_ids]).encode())
+    digest.update(np.ascontiguousarray(topic_weights, dtype=np.float64).tobytes())
+
+    return digest.hexdigest()[:16]
+
+
+class TopicMembership:
+    """
+    Packed bitmap of topic membership. Row i, bit j is set if comedy special i is a member of topic j.
+    """
+    def to_array(self):
+        """
+        :return: Boolean membership matrix of shape (n_specials, n_topics).
+        :rtype: numpy.ndarray
+        """
+        return np.unpackbits(self.bitmap, axis=1, count=self.n_topics).astype(bool)
+
+    def flags(self, row_ids=None):
+        """
+        Membership as '1'/'0' strings, the format used by the `data-topic-*` attributes of the comedy cards.
+
+        :param numpy.ndarray row_ids: Rows to return. Defaults to all rows.
+        :return: List with one list of '1'/'0' strings per row.
+        :rtype: list
+        """
+        bitmap = self.bitmap if row_ids is None else self.bitmap[row_ids]
+        membership = np.unpackbits(bitmap, axis=1, count=self.n_topics).astype(bool)
+
+        return np.where(membership, '1', '0').tolist()
+
+    def members(self, topic):
+        """
+        :param int topic: Topic number (column of the document-topic matrix).
+        :return: Sorted row ids of the comedy specials that are members of the topic.
+        :rtype: numpy.ndarray
+        """
+        if not 0 <= topic < self.n_topics:
+            raise IndexError(f'Topic {topic} does not exist; there are {self.n_topics} topics.')
+
+        byte, bit = divmod(topic, 8)
+        return np.flatnonzero(self.bitmap[:, byte] & (0x80 >> bit))
+
+    @classmethod
+    def from_metadata(cls, metadata, threshold):
+        """
+        :param pandas.DataFrame metadata: Metadata pandas dataframe containing a column of weights for each topic.
+        :param float threshold: Topic weight above which a comedy special is considered a member of the topic.
+        :return: Topic membership for each row of `metadata`.
+        :rtype: TopicMembership
+        """
+        return cls(metadata[TOPIC_COLUMNS].values, threshold)
+
+    def __len__(self):
+        return len(self.bitmap)
+
+    def __init__(self, doc_topic, threshold):
+        doc_topic = np.asarray(doc_topic)
+        self.threshold = threshold
+        self.n_topics = doc_topic.shape[1]
+        self.bitmap = np.packbits(doc_topic > threshold, axis=1)
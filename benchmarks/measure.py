@@ -0,0 +1,123 @@
+"""
+Contains the measurement helpers used by the benchmark suite: timing a stage over many repetitions (latency
+percentiles and throughput), measuring its peak memory, and comparing results with a saved baseline.
+"""
+import gc
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def measure(run, repeats=20, warmup=1, items=1):
+    """
+    Times a stage and measures its peak memory.
+
+    :param run: Function running the stage once.
+    :param int repeats: Number of timed runs.
+    :param int warmup: Number of untimed runs first, to fill caches and trigger lazy initialization.
+    :param int items: Number of items (documents, queries, ...) each run processes, for throughput.
+    :return: Latency percentiles and mean in milliseconds, throughput in items per second, and peak memory in MB.
+    :rtype: dict
+    """
+    for _ in range(warmup):
+        run()
+
+    latencies = []
+    gc.collect()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+
+    # traced separately, since tracing allocations slows the stage down
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'repeats': repeats,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(latencies.mean()),
+        'throughput_per_s': float(items / (latencies.mean() / 1000)),
+        'peak_memory_mb': peak / 2 ** 20
+    }
+
+
+def environment():
+    """
+    :return: Description of the machine and library versions the benchmarks ran with, saved with the results since
+             timings are only comparable on the same setup.
+    :rtype: dict
+    """
+    import pandas
+    import scipy
+    import sklearn
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'pandas': pandas.__version__,
+        'scikit-learn': sklearn.__version__,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }
+
+
+def save_results(results, file_path):
+    """
+    :param dict results: Benchmark results.
+    :param str file_path: Path to the .json file to write.
+    """
+    with open(file_path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(file_path):
+    """
+    :param str file_path: Path to a .json file written by save_results.
+    :return: Benchmark results.
+    :rtype: dict
+    """
+    with open(file_path) as f:
+        return json.load(f)
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2, min_difference_ms=0.05, min_difference_mb=1.0):
+    """
+    Finds the stages that got slower or use more memory than in the baseline. Small absolute differences are ignored,
+    since very short stages are noisy.
+
+    :param dict results: Benchmark results.
+    :param dict baseline: Earlier benchmark results.
+    :param float tolerance: Allowed relative increase, e.g. 0.2 for 20%.
+    :param float min_difference_ms: Latency increases smaller than this are never regressions.
+    :param float min_difference_mb: Peak memory increases smaller than this are never regressions.
+    :return: One message per regression.
+    :rtype: list
+    """
+    regressions = []
+    for scale, stages in results['runs'].items():
+        for stage, current in stages.items():
+            previous = baseline.get('runs', {}).get(scale, {}).get(stage)
+            if previous is None:
+                continue
+
+            for metric, min_difference in [('p50_ms', min_difference_ms), ('p95_ms', min_difference_ms),
+                                           ('peak_memory_mb', min_difference_mb)]:
+                difference = current[metric] - previous[metric]
+                if difference > min_difference and current[metric] > previous[metric] * (1 + tolerance):
+                    regressions.append(f'{stage} ({scale}): {metric} {previous[metric]:.3f} -> {current[metric]:.3f}')
+
+    return regressions
@@ -0,0 +1,186 @@
+"""
+Runs the benchmark suite: the NLP pipeline on a synthetic transcript corpus, and start up, search and page rendering on
+synthetic catalogues of comedy specials of increasing size, all in memory (no Mongo). Records latency percentiles,
+throughput and peak memory of each stage, optionally saves them as a JSON baseline, and compares them with an earlier
+baseline, exiting with status 1 if any stage regressed. Needs the NLTK data the pipeline uses. From the repository root:
+
+    python -m benchmarks.run --specials 1000 10000 100000 --output benchmarks/baseline.json
+    python -m benchmarks.run --specials 1000 10000 100000 --baseline benchmarks/baseline.json
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+
+import nltk
+from sklearn.decomposition import NMF
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from app.app import RESOURCES, app as flask_app
+from app.metadata_store import SQLiteMetadataStore, sync_metadata
+from app.neighbours import NeighbourLists, compute_neighbours
+from app.nlp_pipeline import TranscriptProcessingPipeline, ensure_nltk_data
+from app.search import search_batch
+from app.startup import Resources
+from app.topics import TOPIC_COLUMNS, TopicMembership
+from benchmarks.measure import compare_to_baseline, environment, load_results, measure, save_results
+from benchmarks.synthetic import InMemoryMetadataStore, generate_metadata, generate_search_terms, \
+    generate_transcripts
+
+
+def create_pipeline():
+    """
+    :return: Unfitted pipeline with the same settings as `analysis/create_nlp_pipeline.py`.
+    :rtype: TranscriptProcessingPipeline
+    """
+    return TranscriptProcessingPipeline(
+        tokenizer=nltk.word_tokenize,
+        stemmer=nltk.stem.PorterStemmer,
+        lemmatizer=nltk.stem.WordNetLemmatizer,
+        vectorizer=TfidfVectorizer
+    )
+
+
+def benchmark_corpus(n_transcripts, words_per_transcript, repeats):
+    """
+    Benchmarks preprocessing, fitting and transforming with the NLP pipeline and fitting the topic model.
+
+    :param int n_transcripts: Number of synthetic transcripts.
+    :param int words_per_transcript: Average number of words per transcript.
+    :param int repeats: Number of timed runs of the fast stages. Fitting is timed a tenth as often.
+    :return: Results of each stage, the fitted pipeline and topic model, and search terms.
+    :rtype: tuple
+    """
+    transcripts = generate_transcripts(n_transcripts, words_per_transcript=words_per_transcript)
+    search_terms = generate_search_terms(100, transcripts)
+    few_repeats = max(3, repeats // 10)
+
+    pipeline = create_pipeline()
+    stages = {
+        'preprocess': measure(lambda: pipeline.preprocess(transcripts), repeats=few_repeats, items=n_transcripts),
+        'pipeline_fit_transform': measure(lambda: pipeline.fit_transform(transcripts, sparse=True),
+                                          repeats=few_repeats, items=n_transcripts)
+    }
+
+    vectorized_corpus = pipeline.fit_transform(transcripts, sparse=True)
+    topic_model = NMF(n_components=6, random_state=0)
+    stages['topic_model_fit'] = measure(lambda: topic_model.fit(vectorized_corpus), repeats=few_repeats, warmup=0,
+                                        items=n_transcripts)
+
+    terms = itertools.cycle(search_terms)
+    stages['pipeline_transform'] = measure(lambda: pipeline.transform([next(terms)], sparse=True), repeats=repeats)
+
+    return stages, pipeline, topic_model, search_terms
+
+
+def benchmark_catalogue(n_specials, pipeline, topic_model, search_terms, repeats):
+    """
+    Benchmarks start up, search, "more like this" lists and page rendering against a synthetic catalogue.
+
+    :param int n_specials: Number of synthetic comedy specials.
+    :param TranscriptProcessingPipeline pipeline: Fitted pipeline.
+    :param sklearn.decomposition.NMF topic_model: Fitted topic model.
+    :param list search_terms: Search terms.
+    :param int repeats: Number of timed runs of the fast stages. Start up is timed a tenth as often.
+    :return: Results of each stage.
+    :rtype: dict
+    """
+    metadata = generate_metadata(n_specials)
+    config = flask_app.config
+    few_repeats = max(3, repeats // 10)
+    stages = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = SQLiteMetadataStore(os.path.join(directory, 'metadata.sqlite3'))
+        sync_metadata(InMemoryMetadataStore(metadata), snapshot)
+        stages['metadata_snapshot_load'] = measure(snapshot.load, repeats=few_repeats, items=n_specials)
+
+    stages['topic_membership'] = measure(lambda: TopicMembership.from_metadata(metadata, config['TOPIC_THRESHOLD']),
+                                         repeats=repeats, items=n_specials)
+    stages['build_resources'] = measure(lambda: Resources(metadata, pipeline, topic_model, config, 'benchmark'),
+                                        repeats=few_repeats, items=n_specials)
+
+    stages['neighbours_build'] = measure(lambda: compute_neighbours(metadata[TOPIC_COLUMNS].values, k=20),
+                                         repeats=few_repeats, warmup=0, items=n_specials)
+
+    resources = Resources(metadata, pipeline, topic_model, config, 'benchmark')
+    resources.neighbours = NeighbourLists(*compute_neighbours(metadata[TOPIC_COLUMNS].values, k=20))
+    terms = itertools.cycle(search_terms)
+    stages['search'] = measure(lambda: search_batch([next(terms)], pipeline, resources.projector,
+                                                    resources.topic_index, k=10), repeats=repeats)
+    stages['search_batch'] = measure(lambda: search_batch(search_terms, pipeline, resources.projector,
+                                                          resources.topic_index, k=10),
+                                     repeats=few_repeats, items=len(search_terms))
+
+    # the pages are rendered by the real routes, served the synthetic resources
+    RESOURCES.set(resources)
+    client = flask_app.test_client()
+
+    def get(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {url} returned {response.status_code}.')
+
+    def render_index():
+        resources.page_cache.clear()
+        get('/')
+
+    stages['index'] = measure(render_index, repeats=repeats)
+    stages['index_cached'] = measure(lambda: get('/'), repeats=repeats)
+    stages['api_specials'] = measure(lambda: get('/api/specials?topic=political&year_from=1990&page=2'),
+                                     repeats=repeats)
+    special_ids = itertools.cycle(metadata['comedyId'].tolist())
+    stages['similar'] = measure(lambda: get(f'/special/{next(special_ids)}/similar'), repeats=repeats)
+
+    return stages
+
+
+def print_stages(scale, stages):
+    print(f'\n{scale}')
+    for stage, result in stages.items():
+        print(f'  {stage:<24} p50={result["p50_ms"]:>10.3f}ms  p95={result["p95_ms"]:>10.3f}ms  '
+              f'throughput={result["throughput_per_s"]:>12.1f}/s  peak={result["peak_memory_mb"]:>8.1f}MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the search and NLP pipeline hot paths on synthetic data.')
+    parser.add_argument('--specials', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='catalogue sizes to benchmark (up to about 1000000)')
+    parser.add_argument('--transcripts', type=int, default=200, help='number of synthetic transcripts to fit on')
+    parser.add_argument('--words', type=int, default=2000, help='average number of words per transcript')
+    parser.add_argument('--repeats', type=int, default=50, help='timed runs of each fast stage')
+    parser.add_argument('--similarity-backend', default='exact', help='exact, lsh or ivf (see app.similarity)')
+    parser.add_argument('--output', help='save the results to this .json file, e.g. as a new baseline')
+    parser.add_argument('--baseline', help='compare the results with this .json file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slow down, e.g. 0.2 for 20%%')
+    args = parser.parse_args()
+
+    ensure_nltk_data()
+    flask_app.config.update(QUERY_CACHE_BACKEND='none', SIMILARITY_BACKEND=args.similarity_backend,
+                            MODEL_RELOAD_INTERVAL=0)
+    RESOURCES.reload_interval = 0
+
+    results = {'environment': environment(), 'runs': {}}
+
+    scale = f'{args.transcripts} transcripts'
+    corpus_stages, pipeline, topic_model, search_terms = benchmark_corpus(args.transcripts, args.words, args.repeats)
+    results['runs'][scale] = corpus_stages
+    print_stages(scale, corpus_stages)
+
+    for n_specials in args.specials:
+        scale = f'{n_specials} specials'
+        results['runs'][scale] = benchmark_catalogue(n_specials, pipeline, topic_model, search_terms, args.repeats)
+        print_stages(scale, results['runs'][scale])
+
+    if args.output:
+        save_results(results, args.output)
+        print(f'\nSaved results to {args.output}.')
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, load_results(args.baseline), tolerance=args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regressions compared with {args.baseline}:')
+            print('\n'.join(f'  {regression}' for regression in regressions))
+            sys.exit(1)
+        print(f'\nNo regressions compared with {args.baseline}.')
@@ -0,0 +1,124 @@
+"""
+Generates synthetic comedy specials for benchmarking: transcripts that look enough like the scraped ones to exercise
+every text cleaning step (stage directions in brackets, music, numbers, profanity, stop words), and metadata with the
+same columns as the metadata collection. Everything is generated from a seed, so runs are reproducible, and is held in
+memory in place of the Mongo collections.
+"""
+import numpy as np
+import pandas as pd
+
+from app.metadata_store import MetadataStore
+from app.topics import TOPIC_COLUMNS
+
+# common words that TranscriptProcessingPipeline removes as stop words, so cleaning has as much to do as on real text
+FILLER_WORDS = ['the', 'and', 'i', 'you', 'a', 'to', 'it', 'that', 'like', 'so', 'know', 'just', 'was', 'my', 'is',
+                'um', 'yeah', 'oh', 'fuck', 'shit', 'dude', 'literally', 'alright']
+STAGE_DIRECTIONS = ['[audience laughing]', '[applause]', '(laughter)', '♪ upbeat music playing ♪', '[cheering]']
+SYLLABLES = ['ba', 'ko', 'ri', 'ta', 'me', 'lo', 'sun', 'dar', 'pe', 'vin', 'ca', 'mor', 'ti', 'gal', 'ne', 'fu']
+
+
+def pseudo_words(n_words, random_state):
+    """
+    :param int n_words: Number of distinct words.
+    :param numpy.random.RandomState random_state: Random number generator.
+    :return: Distinct lowercase words of two to four syllables, some with plural endings so lemmatizing changes them.
+    :rtype: list
+    """
+    words = set()
+    while len(words) < n_words:
+        word = ''.join(random_state.choice(SYLLABLES, size=random_state.randint(2, 5)))
+        words.add(word + 's' if random_state.rand() < 0.2 else word)
+
+    return sorted(words)
+
+
+def generate_transcripts(n_transcripts, words_per_transcript=2000, vocabulary_size=5000, n_topics=len(TOPIC_COLUMNS),
+                         random_state=0):
+    """
+    Generates transcripts as mixtures of topics, each topic favouring its own subset of the vocabulary, so that a
+    topic model fit to them finds real structure.
+
+    :param int n_transcripts: Number of transcripts.
+    :param int words_per_transcript: Average number of words per transcript.
+    :param int vocabulary_size: Number of distinct content words.
+    :param int n_topics: Number of topics the transcripts are mixed from.
+    :param int random_state: Seed.
+    :return: Raw transcripts.
+    :rtype: list
+    """
+    random_state = np.random.RandomState(random_state)
+    vocabulary = np.array(pseudo_words(vocabulary_size, random_state))
+    topic_word = random_state.dirichlet(np.full(vocabulary_size, 0.05), size=n_topics)
+
+    transcripts = []
+    for _ in range(n_transcripts):
+        n_words = max(10, int(random_state.normal(words_per_transcript, words_per_transcript / 4)))
+        word_probabilities = random_state.dirichlet(np.full(n_topics, 0.3)) @ topic_word
+        words = list(vocabulary[random_state.choice(vocabulary_size, size=n_words, p=word_probabilities)])
+
+        # about half the words of a real transcript are stop words, plus the odd stage direction and number
+        for position in random_state.randint(0, len(words), size=n_words // 2):
+            words[position] += ' ' + FILLER_WORDS[random_state.randint(len(FILLER_WORDS))]
+        for position in random_state.randint(0, len(words), size=n_words // 200 + 1):
+            words[position] += ' ' + STAGE_DIRECTIONS[random_state.randint(len(STAGE_DIRECTIONS))]
+        for position in random_state.randint(0, len(words), size=n_words // 300 + 1):
+            words[position] += f' {random_state.randint(1, 2020)}.'
+
+        transcripts.append(' '.join(words).capitalize())
+
+    return transcripts
+
+
+def generate_search_terms(n_terms, transcripts, words_per_term=3, random_state=0):
+    """
+    :param int n_terms: Number of search terms.
+    :param list transcripts: Transcripts to draw the words of the search terms from.
+    :param int words_per_term: Number of words in each search term.
+    :param int random_state: Seed.
+    :return: Search terms, as a user might type them.
+    :rtype: list
+    """
+    random_state = np.random.RandomState(random_state)
+    terms = []
+    for _ in range(n_terms):
+        words = transcripts[random_state.randint(len(transcripts))].split()
+        terms.append(' '.join(words[i] for i in random_state.randint(0, len(words), size=words_per_term)))
+
+    return terms
+
+
+def generate_metadata(n_specials, random_state=0):
+    """
+    :param int n_specials: Number of comedy specials.
+    :param int random_state: Seed.
+    :return: Metadata pandas dataframe with the columns of the metadata collection, in comedyId order.
+    :rtype: pandas.DataFrame
+    """
+    random_state = np.random.RandomState(random_state)
+    comedy_ids = np.arange(n_specials)
+    metadata = pd.DataFrame({
+        'comedyId': comedy_ids,
+        'comedian': [f'Comedian {i}' for i in random_state.randint(0, max(1, n_specials // 4), size=n_specials)],
+        'title': [f'Special {i}' for i in comedy_ids],
+        'year': random_state.randint(1970, 2021, size=n_specials),
+        'imageUrl': [f'static/images/{i}.jpg' for i in comedy_ids]
+    })
+
+    # like NMF output: non-negative, and mostly concentrated on one or two topics
+    doc_topic = random_state.dirichlet(np.full(len(TOPIC_COLUMNS), 0.3), size=n_specials)
+    doc_topic *= random_state.uniform(0.1, 1.0, size=(n_specials, 1))
+    for column, weights in zip(TOPIC_COLUMNS, doc_topic.T):
+        metadata[column] = weights
+
+    return metadata
+
+
+class InMemoryMetadataStore(MetadataStore):
+    """
+    Stands in for the metadata collection: serves a copy of a dataframe held in memory.
+    """
+    def load(self):
+        return self.metadata.copy()
+
+    def __init__(self, metadata):
+        self.metadata = metadata
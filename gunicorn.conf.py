@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for the Flask app.
+
+With `preload_app` on (the default), the app's metadata, models and indexes are loaded once in the master process before
+the workers are forked, so every worker shares the same memory pages copy-on-write and starts answering requests
+immediately. Set GUNICORN_PRELOAD=false to load them separately in each worker (on its first request) instead.
+
+Either way, each worker swaps in newly published models and metadata on its own (see MODEL_RELOAD_INTERVAL), so a model
+refresh doesn't need a restart.
+"""
+import gc
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+# threads per worker (more than 1 uses the gthread worker). concurrent searches in a worker are scored in batches (see
+# app.batching), so threads raise search throughput per core
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+
+
+def on_starting(server):
+    if server.cfg.preload_app:
+        from app.app import RESOURCES
+
+        RESOURCES.load()
+        server.log.info('Preloaded app resources: %s', RESOURCES.timings)
+
+        # stop the garbage collector from touching (and therefore copying) the preloaded objects in each worker
+        gc.freeze()
@@ -0,0 +1,92 @@
+"""
+Shared fixtures: a small synthetic corpus (see benchmarks.synthetic) with an NLP pipeline and topic model fit to it, so
+that tests need neither the scraped transcripts nor Mongo.
+"""
+import nltk
+import pytest
+from sklearn.decomposition import NMF
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from app.config import ProductionConfig
+from app.nlp_pipeline import TranscriptProcessingPipeline
+from app.startup import Resources
+from app.topics import TOPIC_COLUMNS
+from benchmarks.synthetic import generate_metadata, generate_transcripts
+
+# a short, fixed stop word list, so the tests don't need the NLTK stop words corpus
+STOP_WORDS = ['i', 'the', 'and', 'a', 'was', 'is', 'to', 'my', 'it', 'at', 'in']
+
+
+def create_pipeline():
+    return TranscriptProcessingPipeline(tokenizer=nltk.word_tokenize, stemmer=nltk.stem.PorterStemmer,
+                                        lemmatizer=nltk.stem.WordNetLemmatizer, vectorizer=TfidfVectorizer,
+                                        stop_words=STOP_WORDS)
+
+
+class OwnLemmas:
+    # the synthetic corpus is made of pseudo words, which are their own lemmas
+    def lemmatize(self, word):
+        return word
+
+
+@pytest.fixture(scope='session')
+def transcripts():
+    return generate_transcripts(80, words_per_transcript=300, vocabulary_size=600)
+
+
+@pytest.fixture(scope='session')
+def documents(transcripts):
+    # cleaned, but not lemmatized (which would need the WordNet data), transcripts to fit to
+    return create_pipeline().clean_corpus(transcripts)
+
+
+@pytest.fixture(scope='session')
+def fitted_models(documents):
+    pipeline = create_pipeline()
+    tfidf = pipeline.fit_transform_preprocessed(documents, sparse=True)
+    topic_model = NMF(n_components=len(TOPIC_COLUMNS), init='nndsvda', max_iter=500, random_state=0)
+    doc_topic = topic_model.fit_transform(tfidf)
+
+    return pipeline, topic_model, doc_topic
+
+
+@pytest.fixture(scope='session')
+def seed_lemmas(documents):
+    """
+    Fills a pipeline's lemma cache with every word of the corpus, so that search terms made of those words can be
+    preprocessed without the WordNet data.
+    """
+    words = set(' '.join(documents).split())
+
+    def seed(pipeline):
+        for word in words:
+            pipeline.lemma_cache.lemmatize(word, OwnLemmas())
+
+        return pipeline
+
+    return seed
+
+
+@pytest.fixture(scope='session')
+def metadata(fitted_models):
+    _, _, doc_topic = fitted_models
+    metadata = generate_metadata(len(doc_topic))
+    metadata[TOPIC_COLUMNS] = doc_topic
+
+    return metadata
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = {name: getattr(ProductionConfig, name) for name in dir(ProductionConfig) if name.isupper()}
+    config.update(MODEL_ARTIFACT_ROOT=str(tmp_path / 'artifacts'), LEXICAL_INDEX_PATH=str(tmp_path / 'lexical_index'),
+                  NEIGHBOURS_PATH=str(tmp_path / 'neighbours'), QUERY_CACHE_BACKEND='none', MODEL_RELOAD_INTERVAL=0)
+
+    return config
+
+
+@pytest.fixture
+def resources(config, fitted_models, metadata, seed_lemmas):
+    pipeline, topic_model, _ = fitted_models
+
+    return Resources(metadata, seed_lemmas(pipeline), topic_model, config, 'test')
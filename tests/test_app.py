@@ -0,0 +1,113 @@
+"""
+Tests for the validation of the JSON API's parameters (see app.app).
+"""
+import html
+
+import pytest
+
+import app.app as app_module
+from app.app import MAX_BATCH_SIZE, MAX_PER_PAGE
+from app.startup import LazyResources
+
+
+@pytest.fixture
+def client(monkeypatch, config, resources):
+    lazy_resources = LazyResources(config)
+    lazy_resources.set(resources)
+    monkeypatch.setattr(app_module, 'RESOURCES', lazy_resources)
+
+    return app_module.app.test_client()
+
+
+def error(response):
+    # the error description, from the HTML error page
+    return html.unescape(response.get_data(as_text=True))
+
+
+@pytest.fixture
+def query(documents):
+    return ' '.join(documents[0].split()[:5])
+
+
+@pytest.mark.parametrize('payload', [
+    {},
+    {'queries': 'political'},
+    {'queries': {'political': 1}},
+    {'queries': ['political', 3]},
+    {'queries': [None]},
+])
+def test_batch_search_rejects_queries_that_arent_a_list_of_strings(client, payload):
+    response = client.post('/api/search/batch', json=payload)
+
+    assert response.status_code == 400
+    assert '"queries" must be a list of strings' in error(response)
+
+
+def test_batch_search_rejects_too_many_queries(client):
+    response = client.post('/api/search/batch', json={'queries': ['political'] * (MAX_BATCH_SIZE + 1)})
+
+    assert response.status_code == 400
+    assert f'At most {MAX_BATCH_SIZE} queries' in error(response)
+
+
+@pytest.mark.parametrize('k', [True, False, 0, -1, MAX_PER_PAGE + 1, 2.5, '10', None, [10]])
+def test_batch_search_rejects_bad_k(client, query, k):
+    response = client.post('/api/search/batch', json={'queries': [query], 'k': k})
+
+    assert response.status_code == 400
+    assert '"k" must be an integer' in error(response)
+
+
+@pytest.mark.parametrize('mode', ['semantic', '', None, 1])
+def test_batch_search_rejects_bad_mode(client, query, mode):
+    response = client.post('/api/search/batch', json={'queries': [query], 'mode': mode})
+
+    assert response.status_code == 400
+    assert '"mode" must be one of' in error(response)
+
+
+@pytest.mark.parametrize('mode', ['topic', 'lexical', 'hybrid'])
+def test_batch_search(client, metadata, query, mode):
+    response = client.post('/api/search/batch', json={'queries': [query], 'k': MAX_PER_PAGE, 'mode': mode})
+
+    assert response.status_code == 200
+    [result] = response.get_json()['results']
+    assert result['query'] == query
+    if mode != 'lexical':
+        assert len(result['specials']) == min(MAX_PER_PAGE, len(metadata))
+    assert {special['id'] for special in result['specials']} <= set(metadata['comedyId'])
+
+
+@pytest.mark.parametrize('mode', ['topic', 'lexical', 'hybrid'])
+def test_batch_search_empty_results(client, mode):
+    # no queries, a blank query, and a query of stop words only (which has no position in topic space)
+    assert client.post('/api/search/batch', json={'queries': [], 'mode': mode}).get_json() == {'results': []}
+
+    response = client.post('/api/search/batch', json={'queries': ['', '   ', 'the and i'], 'k': 5, 'mode': mode})
+
+    assert response.status_code == 200
+    assert response.get_json()['results'] == [{'query': '', 'specials': []}, {'query': '   ', 'specials': []},
+                                              {'query': 'the and i', 'specials': []}]
+
+
+def test_similar_specials(client, metadata):
+    comedy_id = int(metadata['comedyId'].iloc[3])
+    response = client.get(f'/special/{comedy_id}/similar?k=5')
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['id'] == comedy_id
+    assert len(data['specials']) == 5 and comedy_id not in {special['id'] for special in data['specials']}
+    assert len(client.get(f'/special/{comedy_id}/similar').get_json()['specials']) == 10
+
+
+@pytest.mark.parametrize('k', ['abc', '', '2.5', '0', '-1', str(MAX_PER_PAGE + 1)])
+def test_similar_specials_rejects_bad_k(client, metadata, k):
+    response = client.get(f'/special/{int(metadata["comedyId"].iloc[3])}/similar?k={k}')
+
+    assert response.status_code == 400
+    assert '"k" must be an integer' in error(response)
+
+
+def test_similar_specials_of_unknown_special(client, metadata):
+    assert client.get(f'/special/{int(metadata["comedyId"].max()) + 1}/similar').status_code == 404
@@ -0,0 +1,43 @@
+"""
+Tests that a model artifact reproduces the pickled pipeline it was exported from.
+"""
+import dill as pickle
+import numpy as np
+
+from app.artifacts import load_current_artifact, write_model_artifact
+
+
+def test_artifact_transform_matches_pickled_pipeline(tmp_path, fitted_models, documents):
+    pipeline, topic_model, doc_topic = fitted_models
+    write_model_artifact(str(tmp_path), pipeline, topic_model, doc_topic)
+    artifact_pipeline = load_current_artifact(str(tmp_path)).pipeline()
+    pickled_pipeline = pickle.loads(pickle.dumps(pipeline))
+
+    # the training documents, plus documents with unknown words, repeats, stop words and nothing at all
+    corpus = documents + ['', 'zzzz qqqq', documents[0].split()[0] * 3, ' '.join(documents[1].split()[:5] * 4),
+                          'the and i']
+    expected = pickled_pipeline.transform_preprocessed(corpus, sparse=True)
+    actual = artifact_pipeline.transform_preprocessed(corpus, sparse=True)
+
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual.toarray(), expected.toarray(), atol=1e-12)
+
+
+def test_artifact_vectorizer_analyzes_like_sklearn(tmp_path, fitted_models, documents):
+    pipeline, topic_model, doc_topic = fitted_models
+    write_model_artifact(str(tmp_path), pipeline, topic_model, doc_topic)
+    vectorizer = load_current_artifact(str(tmp_path)).pipeline().vectorizer
+
+    analyzer, expected_analyzer = vectorizer.build_analyzer(), pipeline.vectorizer.build_analyzer()
+    for document in documents[:10]:
+        assert analyzer(document) == expected_analyzer(document)
+    assert set(vectorizer.get_stop_words()) == set(pipeline.vectorizer.get_stop_words())
+    assert vectorizer.vocabulary_ == pipeline.vectorizer.vocabulary_
+    assert vectorizer.get_feature_names() == sorted(pipeline.vectorizer.vocabulary_,
+                                                    key=pipeline.vectorizer.vocabulary_.get)
+
+    params, expected_params = vectorizer.get_params(), pipeline.vectorizer.get_params()
+    for name in ['analyzer', 'lowercase', 'strip_accents', 'token_pattern', 'binary', 'sublinear_tf', 'norm',
+                 'use_idf']:
+        assert params[name] == expected_params[name]
+    assert tuple(params['ngram_range']) == tuple(expected_params['ngram_range'])
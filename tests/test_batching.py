@@ -0,0 +1,131 @@
+"""
+Tests that `SearchBatcher` gives each thread the same results as searching on its own, and that no thread is left
+waiting when a batch fails or doesn't fill.
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.batching import SearchBatcher
+from app.search import search_batch
+
+# long enough to join a thread that should already be finished, short enough not to hang the tests if one isn't
+JOIN_TIMEOUT = 10
+
+
+class BlockingPipeline:
+    """
+    Wraps a pipeline so that preprocessing waits for `release` to be set, and raises `error` if it is set.
+    """
+    def preprocess(self, corpus):
+        self.started.set()
+        self.release.wait(JOIN_TIMEOUT)
+        if self.error is not None:
+            raise self.error
+
+        return self.pipeline.preprocess(corpus)
+
+    def __getattr__(self, name):
+        return getattr(self.pipeline, name)
+
+    def __init__(self, pipeline, error=None):
+        self.pipeline = pipeline
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+
+def search_concurrently(batcher, searches):
+    # runs each (query, k) search in its own thread, all starting at once
+    results = [None] * len(searches)
+    barrier = threading.Barrier(len(searches))
+
+    def search(i, query, k):
+        barrier.wait()
+        try:
+            results[i] = batcher.search(query, k)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=search, args=(i, query, k)) for i, (query, k) in enumerate(searches)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(JOIN_TIMEOUT)
+    assert not any(thread.is_alive() for thread in threads)
+
+    return results
+
+
+@pytest.fixture
+def queries(documents):
+    # search terms made of corpus words, some repeated, and a blank one
+    words = ' '.join(documents).split()
+    queries = [' '.join(words[i:i + 3]) for i in range(0, 300, 10)]
+
+    return queries + queries[:5] + ['']
+
+
+@pytest.mark.parametrize('max_batch_size, max_wait', [(8, 0.01), (64, 0.05), (1, 0)])
+def test_batched_results_match_unbatched(resources, queries, max_batch_size, max_wait):
+    batcher = SearchBatcher(resources.pipeline, resources.projector, resources.topic_index,
+                            max_batch_size=max_batch_size, max_wait=max_wait)
+    searches = [(query, 5 if i % 3 else 10) for i, query in enumerate(queries)]
+
+    results = search_concurrently(batcher, searches)
+
+    for (query, k), (row_ids, similarities) in zip(searches, results):
+        [(expected_row_ids, expected_similarities)] = search_batch([query], resources.pipeline, resources.projector,
+                                                                   resources.topic_index, k=k)
+        np.testing.assert_array_equal(row_ids, expected_row_ids)
+        np.testing.assert_allclose(similarities, expected_similarities, rtol=1e-5)
+    assert batcher._in_flight == {} and batcher._queue == []
+
+
+def test_failed_batch_releases_every_waiting_search(resources, queries):
+    pipeline = BlockingPipeline(resources.pipeline, error=RuntimeError('preprocessing failed'))
+    pipeline.release.set()
+    batcher = SearchBatcher(pipeline, resources.projector, resources.topic_index, max_batch_size=8, max_wait=0.01)
+
+    results = search_concurrently(batcher, [(query, 10) for query in queries[:-1]])
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert batcher._in_flight == {} and batcher._queue == []
+
+    # the batcher still works once the error goes away
+    pipeline.error = None
+    row_ids, _ = batcher.search(queries[0], 10)
+    assert len(row_ids) == 10
+
+
+def test_search_waits_at_most_max_wait_for_a_batch_to_fill(resources, queries):
+    pipeline = BlockingPipeline(resources.pipeline)
+    batcher = SearchBatcher(pipeline, resources.projector, resources.topic_index, max_batch_size=32, max_wait=0.05)
+
+    # a lone search doesn't wait for others to join it
+    pipeline.release.set()
+    start = time.perf_counter()
+    batcher.search(queries[0], 10)
+    assert time.perf_counter() - start < 1
+
+    # while the first search's batch is held up, a second search times out waiting for its batch to fill and then
+    # waits for the running batch, and both finish once it does
+    pipeline.release.clear()
+    pipeline.started.clear()
+    results = {}
+    first = threading.Thread(target=lambda: results.update(first=batcher.search(queries[1], 10)))
+    first.start()
+    assert pipeline.started.wait(JOIN_TIMEOUT)
+    second = threading.Thread(target=lambda: results.update(second=batcher.search(queries[2], 10)))
+    second.start()
+    time.sleep(0.2)
+    assert second.is_alive() and batcher._queue[0].query == queries[2]
+
+    pipeline.release.set()
+    first.join(JOIN_TIMEOUT)
+    second.join(JOIN_TIMEOUT)
+    assert not first.is_alive() and not second.is_alive()
+    assert set(results) == {'first', 'second'}
+    assert batcher._in_flight == {} and batcher._queue == []
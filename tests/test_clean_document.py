@@ -0,0 +1,50 @@
+"""
+Golden-output tests for `TranscriptProcessingPipeline.clean_document`. The expected outputs were produced by the
+original regular expression cleaning steps, before they were precompiled and reordered, so any change to what the
+cleaning produces shows up here (and needs a bump of PREPROCESSING_VERSION).
+"""
+import nltk
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from app.nlp_pipeline import TranscriptProcessingPipeline
+
+# a short, fixed stop word list, so the tests don't need the NLTK stop words corpus
+STOP_WORDS = ['i', 'the', 'and', 'a', 'was', 'is', 'to', 'my', 'it', 'at', 'in']
+
+GOLDEN_OUTPUTS = [
+    # brackets and parentheses
+    ('So I walked in [laughter] and the crowd [applause] went quiet', 'so walked crowd went quiet'),
+    ('He said (pause) nothing at all (really)', 'he said nothing all'),
+    # music cues
+    ('♪ Happy birthday to you ♪ that was my mom singing', 'that mom singing'),
+    ('♪ la la ♪ one ♪ two ♪ three', 'one three'),
+    # smart quotes, ellipses and dashes
+    ('“I can’t believe it,” she said… it’s wild – honestly', 'can’t believe she said it’s wild honestly'),
+    ('Wait—what?! No... yes; maybe: well, it\'s "complicated"', 'wait—what no yes maybe well s complicated'),
+    # digits
+    ('I was 25 in 1999, living on 3rd street with my 2nd wife', 'living on street with wife'),
+    # repeated characters
+    ('Aaaahhh noooo, that is sooo good, hmmm okay', 'that good okay'),
+    # line breaks, profanity and names
+    ('Line one\nline two\nline three', 'line one line two line three'),
+    ('THE Fuck Kevin was in Vegas, damn', 'vegas'),
+    ('', ''),
+]
+
+
+@pytest.fixture(scope='module')
+def pipeline():
+    return TranscriptProcessingPipeline(tokenizer=nltk.word_tokenize, stemmer=nltk.stem.PorterStemmer,
+                                        lemmatizer=nltk.stem.WordNetLemmatizer, vectorizer=TfidfVectorizer,
+                                        stop_words=STOP_WORDS)
+
+
+@pytest.mark.parametrize('document, expected', GOLDEN_OUTPUTS)
+def test_clean_document_matches_golden_output(pipeline, document, expected):
+    assert pipeline.clean_document(document) == expected
+
+
+def test_clean_corpus_cleans_each_document(pipeline):
+    documents, expected = zip(*GOLDEN_OUTPUTS)
+    assert pipeline.clean_corpus(list(documents)) == list(expected)
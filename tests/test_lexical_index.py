@@ -0,0 +1,122 @@
+"""
+Tests for the lexical index (see app.lexical_index).
+"""
+import math
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from app.artifacts import load_current_artifact, write_model_artifact
+from app.lexical_index import (PostingLists, analysis_fingerprint, count_terms, decode_varints, encode_varints,
+                               word_analyzer, write_transcript_index)
+from app.search import search_hybrid, search_lexical
+from app.startup import Resources
+
+
+EDGE_VALUES = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 21 - 1, 2 ** 21, 2 ** 35 + 3, 2 ** 63, 2 ** 64 - 1]
+
+
+def bm25(corpus, query_words, k1=1.2, b=0.75):
+    # BM25 straight from its definition, one document at a time
+    average_length = sum(len(document) for document in corpus) / len(corpus)
+    scores = {}
+    for row, document in enumerate(corpus):
+        score = 0.0
+        for word in set(query_words):
+            doc_freq = sum(word in other for other in corpus)
+            count = document.count(word)
+            if count:
+                idf = math.log(1 + (len(corpus) - doc_freq + 0.5) / (doc_freq + 0.5))
+                score += idf * count * (k1 + 1) / (count + k1 * (1 - b + b * len(document) / average_length))
+        if score:
+            scores[row] = score
+
+    return scores
+
+
+@pytest.mark.parametrize('value', EDGE_VALUES)
+def test_varint_round_trips_edge_value(value):
+    encoded, n_bytes = encode_varints(np.array([value], dtype=np.uint64))
+
+    assert n_bytes[0] == max(1, math.ceil(value.bit_length() / 7)) == len(encoded)
+    assert decode_varints(encoded).tolist() == [value]
+
+
+def test_varints_round_trip_together():
+    values = np.array(EDGE_VALUES + EDGE_VALUES[::-1], dtype=np.uint64)
+    encoded, n_bytes = encode_varints(values)
+
+    assert n_bytes.sum() == len(encoded)
+    assert decode_varints(encoded).tolist() == values.tolist()
+    assert decode_varints(encode_varints(np.zeros(0, dtype=np.uint64))[0]).tolist() == []
+
+
+def test_postings_round_trip_large_gaps_and_counts():
+    # documents at the start and end of a large corpus, so gaps and counts span one to three varint bytes
+    n_documents = 300000
+    documents = [[0, 127, 128, 129, 16511, n_documents - 1], [5], [], [n_documents - 1]]
+    counts = [[1, 127, 128, 16384, 2, 3], [1], [], [200000]]
+    rows = np.concatenate([np.asarray(d, dtype=np.int64) for d in documents])
+    columns = np.repeat(np.arange(len(documents)), [len(d) for d in documents])
+    matrix = sparse.csr_matrix((np.concatenate([np.asarray(c) for c in counts]), (rows, columns)),
+                               shape=(n_documents, len(documents)))
+    posting_lists = PostingLists.from_counts(matrix)
+
+    for term in range(len(documents)):
+        term_documents, term_counts = posting_lists.postings(term)
+        assert term_documents.tolist() == documents[term]
+        assert term_counts.tolist() == counts[term]
+    assert posting_lists.doc_freqs.tolist() == [len(d) for d in documents]
+
+
+def test_bm25_matches_formula():
+    corpus = [
+        'cat sat on the mat'.split(),
+        'the cat chased the other cat'.split(),
+        'dog'.split(),
+        'a dog and a cat and a bird and a very long sentence about nothing much'.split(),
+        'bird bird bird'.split(),
+    ]
+    vocabulary = {}
+    counts = count_terms(str.split, [' '.join(document) for document in corpus], vocabulary)
+
+    for k1, b in [(1.2, 0.75), (2.0, 0.0), (0.5, 1.0)]:
+        posting_lists = PostingLists.from_counts(counts, k1=k1, b=b)
+        for query_words in [['cat'], ['cat', 'bird'], ['dog', 'dog', 'mat'], ['bird', 'nothing', 'cat', 'the']]:
+            expected = bm25(corpus, query_words, k1=k1, b=b)
+            documents, scores = posting_lists.score(np.array([vocabulary[word] for word in query_words]))
+
+            assert documents.tolist() == sorted(expected)
+            np.testing.assert_allclose(scores, [expected[row] for row in documents], rtol=1e-6)
+
+
+def test_resources_search_artifact_with_transcript_index(config, fitted_models, documents, metadata, seed_lemmas):
+    pipeline, topic_model, doc_topic = fitted_models
+    write_model_artifact(config['MODEL_ARTIFACT_ROOT'], pipeline, topic_model, doc_topic,
+                         comedy_ids=metadata['comedyId'].values)
+    vocabulary = {}
+    counts = count_terms(word_analyzer(pipeline), documents, vocabulary)
+    write_transcript_index(config['LEXICAL_INDEX_PATH'], counts, metadata['comedyId'].values, vocabulary,
+                           analysis_fingerprint(pipeline))
+
+    artifact = load_current_artifact(config['MODEL_ARTIFACT_ROOT'])
+    artifact_pipeline = seed_lemmas(artifact.pipeline())
+    assert analysis_fingerprint(artifact_pipeline) == analysis_fingerprint(pipeline)
+
+    resources = Resources(metadata, artifact_pipeline, artifact.topic_model(), config, artifact.version,
+                          doc_topic_unit=artifact.doc_topic_unit)
+    assert resources.lexical_index.transcripts is not None
+
+    # the two words of the transcript at row 3 that the fewest other transcripts contain
+    document_words = [set(document.split()) for document in documents]
+    words = sorted(document_words[3], key=lambda word: (sum(word in other for other in document_words), word))[:2]
+    matching_rows = [row for row, other in enumerate(document_words) if set(words) <= other]
+    query = ' '.join(words)
+
+    [(rows, scores)] = search_lexical([query], artifact_pipeline, resources.lexical_index, k=5)
+    assert 3 in rows and rows[0] in matching_rows and scores[0] > 0
+    [(rows, scores)] = search_hybrid([query], artifact_pipeline, resources.projector, resources.topic_index,
+                                     resources.lexical_index, k=5)
+    assert 3 in rows and rows[0] in matching_rows and len(rows) == 5
+    assert np.all(np.diff(scores) <= 0)
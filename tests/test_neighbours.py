@@ -0,0 +1,33 @@
+"""
+Tests that the blocked `compute_neighbours` finds the same neighbours as scoring every pair of rows at once.
+"""
+import numpy as np
+import pytest
+
+from app.neighbours import compute_neighbours
+
+
+def brute_force_neighbours(vectors, k):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarities = unit @ unit.T
+    np.fill_diagonal(similarities, -np.inf)
+    neighbours = np.argsort(-similarities, axis=1, kind='stable')[:, :k]
+
+    return neighbours, np.take_along_axis(similarities, neighbours, axis=1)
+
+
+@pytest.mark.parametrize('n_rows, k, row_block_size, column_block_size', [
+    (50, 5, 7, 11),
+    (50, 5, 50, 6),
+    (97, 10, 16, 12),
+    (30, 100, 4, 8),
+])
+def test_blocked_neighbours_match_brute_force(n_rows, k, row_block_size, column_block_size):
+    vectors = np.random.RandomState(n_rows).dirichlet(np.full(6, 0.3), size=n_rows)
+    expected_neighbours, expected_similarities = brute_force_neighbours(vectors, min(k, n_rows - 1))
+
+    neighbours, similarities = compute_neighbours(vectors, k=k, row_block_size=row_block_size,
+                                                  column_block_size=column_block_size)
+
+    np.testing.assert_array_equal(neighbours, expected_neighbours)
+    np.testing.assert_allclose(similarities, expected_similarities, atol=1e-3)
@@ -0,0 +1,127 @@
+"""
+Tests that `TopicProjector.transform` finds the same topic weights as the topic model's own solver,
+`sklearn.decomposition.NMF.transform`, on each of its solution paths, and on the shipped topic model.
+"""
+import os
+import sys
+
+import dill as pickle
+import joblib
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.decomposition import NMF, non_negative_factorization
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+from app import nlp_pipeline
+from app.config import ProductionConfig
+from app.projection import MAX_ENUMERATED_TOPICS, TopicProjector
+
+N_FEATURES = 40
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def corpus(n_documents, seed):
+    # sparse non-negative stand-in for a TF-IDF matrix
+    return sparse.random(n_documents, N_FEATURES, density=0.2, format='csr', random_state=seed)
+
+
+def fit_topic_model(n_components, alpha=0.0, l1_ratio=0.0):
+    # a tight tolerance, so that NMF.transform (which uses the model's tol and max_iter) converges to the optimum
+    params = {'n_components': n_components, 'init': 'nndsvda', 'tol': 1e-12, 'max_iter': 5000, 'random_state': 0,
+              'l1_ratio': l1_ratio}
+    # newer versions of sklearn regularize W with alpha_W (scaled by the number of features) rather than alpha
+    if 'alpha_W' in NMF().get_params():
+        params['alpha_W'] = alpha / N_FEATURES
+    else:
+        params['alpha'] = alpha
+
+    return NMF(**params).fit(corpus(200, seed=0))
+
+
+def assert_matches_topic_model(topic_model, projector):
+    X = corpus(100, seed=1)
+    expected = topic_model.transform(X)
+
+    # several search terms must fall outside the unconstrained solution for the constrained solver to be exercised
+    assert (expected == 0).any(axis=1).sum() > 10
+    np.testing.assert_allclose(projector.transform(X), expected, atol=1e-6)
+
+
+@pytest.mark.filterwarnings('ignore::sklearn.exceptions.ConvergenceWarning')
+def test_enumerated_path_matches_nmf_transform():
+    topic_model = fit_topic_model(n_components=6)
+    projector = TopicProjector.from_topic_model(topic_model)
+
+    assert projector._subset_inverses is not None
+    assert_matches_topic_model(topic_model, projector)
+
+
+@pytest.mark.filterwarnings('ignore::sklearn.exceptions.ConvergenceWarning')
+def test_coordinate_descent_path_matches_nmf_transform():
+    topic_model = fit_topic_model(n_components=MAX_ENUMERATED_TOPICS + 2)
+    projector = TopicProjector.from_topic_model(topic_model, tol=1e-12, max_iter=5000)
+
+    assert projector._subset_inverses is None
+    assert_matches_topic_model(topic_model, projector)
+
+
+@pytest.mark.filterwarnings('ignore::sklearn.exceptions.ConvergenceWarning')
+def test_regularized_model_matches_nmf_transform():
+    topic_model = fit_topic_model(n_components=6, alpha=0.01, l1_ratio=0.5)
+    projector = TopicProjector.from_topic_model(topic_model)
+
+    assert projector.l1_reg > 0 and projector.l2_reg > 0
+    assert_matches_topic_model(topic_model, projector)
+
+
+@pytest.fixture(scope='module')
+def shipped_vectorizer():
+    # the pickled pipeline refers to the module by the name it had when it was pickled (see app.startup)
+    sys.modules.setdefault('nlp_pipeline', nlp_pipeline)
+    with open(os.path.join(REPO_ROOT, ProductionConfig.PIPELINE_PATH), 'rb') as f:
+        return pickle.load(f).vectorizer
+
+
+def tfidf_rows(vectorizer, documents):
+    try:
+        idf = vectorizer.idf_
+    except AttributeError:
+        # newer versions of sklearn can't read the idf weights of a vectorizer pickled by the version in
+        # requirements.txt, which kept them as a diagonal matrix
+        idf = vectorizer._tfidf._idf_diag.diagonal()
+    tfidf = normalize(CountVectorizer(vocabulary=vectorizer.vocabulary_).transform(documents).multiply(idf).tocsr())
+
+    # where the pickled vectorizer works, the rows must be exactly its own
+    try:
+        expected = vectorizer.transform(documents)
+    except Exception:
+        pass
+    else:
+        np.testing.assert_allclose(tfidf.toarray(), expected.toarray(), rtol=1e-12)
+
+    return tfidf
+
+
+@pytest.mark.filterwarnings('ignore::UserWarning')
+def test_shipped_topic_model_matches_nmf_solver(shipped_vectorizer):
+    topic_model = joblib.load(os.path.join(REPO_ROOT, ProductionConfig.TOPIC_MODEL_PATH))
+    words = np.array(sorted(shipped_vectorizer.vocabulary_, key=shipped_vectorizer.vocabulary_.get))
+    # the transcripts the model was fit to aren't in the repo, so search terms are drawn from its vocabulary: the
+    # example searches, each topic's top words, and random mixtures of up to 30 words
+    random_state = np.random.RandomState(0)
+    documents = ['political', 'relationships', 'immigrant upbringing', 'black experience', 'british australian']
+    documents += [' '.join(words[np.argsort(-topic)[:10]]) for topic in topic_model.components_]
+    documents += [' '.join(random_state.choice(words, size=random_state.randint(1, 30))) for _ in range(300)]
+    tfidf = tfidf_rows(shipped_vectorizer, documents)
+
+    # sklearn's own solver, run to convergence, with the topics fixed (NMF.transform itself needs the sklearn version
+    # the model was pickled with)
+    expected, _, _ = non_negative_factorization(tfidf, H=topic_model.components_,
+                                                n_components=topic_model.components_.shape[0], update_H=False,
+                                                solver='cd', tol=1e-12, max_iter=5000)
+    projected = TopicProjector.from_topic_model(topic_model).transform(tfidf)
+
+    assert (expected == 0).any(axis=1).sum() > 10
+    np.testing.assert_allclose(projected, expected, atol=1e-6)
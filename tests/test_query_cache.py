@@ -0,0 +1,103 @@
+"""
+Tests for the search result cache (see app.query_cache): hits and misses, invalidation when the models or metadata
+change, and that cached searches return exactly what uncached searches do.
+"""
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from app.query_cache import create_query_cache, fingerprint
+from app.search import search_batch
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request):
+    return request.param
+
+
+def create_cache(backend, tmp_path, version='v1', ttl=3600):
+    return create_query_cache(backend=backend, path=str(tmp_path / 'query_cache.sqlite3'), maxsize=100, ttl=ttl,
+                              version=version)
+
+
+def test_hits_and_misses(backend, tmp_path):
+    cache = create_cache(backend, tmp_path)
+
+    assert cache.get('politics', 10) is None
+    cache.set('politics', 10, np.array([3, 1, 2]), np.array([0.75, 0.5, 0.25], dtype=np.float32))
+    assert cache.get('politics', 10) == ([3, 1, 2], [0.75, 0.5, 0.25])
+    # the same search term with a different k, or a different search term, is a different entry
+    assert cache.get('politics', 5) is None
+    assert cache.get('political', 10) is None
+
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_expired_entries_miss(backend, tmp_path):
+    cache = create_cache(backend, tmp_path, ttl=-1)
+    cache.set('politics', 10, [3], [0.9])
+
+    assert cache.get('politics', 10) is None
+
+
+def test_new_version_invalidates_entries(backend, tmp_path):
+    cache = create_cache(backend, tmp_path, version='v1')
+    cache.set('politics', 10, [3, 1], [0.9, 0.5])
+
+    # a cache for new models or metadata (sharing the sqlite file, for the sqlite backend) doesn't serve old entries
+    new_cache = create_cache(backend, tmp_path, version='v2')
+    if backend == 'memory':
+        new_cache.backend = cache.backend
+    assert new_cache.get('politics', 10) is None
+    assert cache.get('politics', 10) == ([3, 1], [0.9, 0.5])
+
+
+def test_fingerprint_changes_with_model_files_and_metadata(tmp_path, metadata):
+    model_path = tmp_path / 'topic_model.pkl'
+    model_path.write_bytes(b'model')
+    version = fingerprint([str(model_path)], metadata)
+    assert fingerprint([str(model_path)], metadata.copy()) == version
+
+    model_path.write_bytes(b'new model')
+    os.utime(model_path, ns=(1, 1))
+    assert fingerprint([str(model_path)], metadata) != version
+
+    changed_metadata = metadata.copy()
+    changed_metadata.loc[0, 'title'] = 'A different title'
+    assert fingerprint([], changed_metadata) != fingerprint([], metadata)
+
+
+def test_counters_are_exact_under_concurrent_lookups(tmp_path):
+    cache = create_cache('memory', tmp_path)
+    cache.set('politics', 10, [3], [0.9])
+    n_threads, n_lookups = 8, 2000
+
+    def look_up():
+        for i in range(n_lookups):
+            cache.get('politics' if i % 2 else 'relationships', 10)
+
+    threads = [threading.Thread(target=look_up) for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.hits == cache.misses == n_threads * n_lookups // 2
+
+
+def test_cached_search_matches_uncached_search(backend, tmp_path, resources, documents):
+    words = ' '.join(documents).split()
+    queries = [' '.join(words[i:i + 3]) for i in range(0, 200, 10)] + ['', words[0].upper() + '!']
+    cache = create_cache(backend, tmp_path)
+
+    expected = search_batch(queries, resources.pipeline, resources.projector, resources.topic_index, k=10)
+    cold = search_batch(queries, resources.pipeline, resources.projector, resources.topic_index, k=10, cache=cache)
+    warm = search_batch(queries, resources.pipeline, resources.projector, resources.topic_index, k=10, cache=cache)
+
+    assert cache.hits == len(queries) - 1
+    for results in [cold, warm]:
+        for (row_ids, similarities), (expected_row_ids, expected_similarities) in zip(results, expected):
+            np.testing.assert_array_equal(row_ids, expected_row_ids)
+            np.testing.assert_array_equal(similarities, expected_similarities)
@@ -0,0 +1,36 @@
+"""
+Tests for search terms that have no position in topic space (see app.search).
+"""
+import numpy as np
+import pytest
+
+from app.search import search_batch, search_hybrid
+
+
+@pytest.fixture
+def unplaced_queries(resources, documents):
+    # a search term of stop words only, and one of corpus words too rare or too common to be in the TF-IDF vocabulary
+    vocabulary = resources.pipeline.vectorizer.vocabulary_
+    words = [word for word in dict.fromkeys(' '.join(documents).split()) if word not in vocabulary][:3]
+    assert words
+
+    return ['the and i', ' '.join(words)]
+
+
+def test_unplaced_queries_return_empty_results(resources, documents, unplaced_queries):
+    queries = unplaced_queries + [' '.join(documents[0].split()[:5])]
+    results = search_batch(queries, resources.pipeline, resources.projector, resources.topic_index, k=10)
+
+    for row_ids, similarities in results[:-1]:
+        assert len(row_ids) == len(similarities) == 0
+    row_ids, similarities = results[-1]
+    assert len(row_ids) == 10 and np.all(similarities > 0)
+
+
+def test_hybrid_unplaced_queries_only_return_lexical_matches(resources, unplaced_queries):
+    results = search_hybrid(unplaced_queries, resources.pipeline, resources.projector, resources.topic_index,
+                            resources.lexical_index, k=10)
+
+    # there is no transcript index, and none of the words are in a comedian's name or a title
+    for row_ids, scores in results:
+        assert len(row_ids) == len(scores) == 0
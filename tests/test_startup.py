@@ -0,0 +1,82 @@
+"""
+Tests that `LazyResources` doesn't retry a failed load on every request.
+"""
+import threading
+import time
+
+import pytest
+
+from app import startup
+from app.startup import LazyResources
+
+
+class FlakyLoader:
+    """
+    Stands in for `load_resources`, failing until `fail` is cleared.
+    """
+    def __call__(self, config):
+        self.calls += 1
+        if self.fail:
+            raise OSError('metadata snapshot is unreadable')
+
+        return self.resources, None
+
+    def __init__(self, resources):
+        self.resources = resources
+        self.calls = 0
+        self.fail = True
+
+
+@pytest.fixture
+def loader(monkeypatch, resources):
+    loader = FlakyLoader(resources)
+    monkeypatch.setattr(startup, 'load_resources', loader)
+
+    return loader
+
+
+def test_failed_load_is_not_retried_until_the_retry_interval_passes(config, loader):
+    lazy_resources = LazyResources(dict(config, RESOURCES_RETRY_INTERVAL=0.2))
+
+    with pytest.raises(OSError):
+        lazy_resources.get()
+    # later requests get the error without loading again
+    for _ in range(5):
+        with pytest.raises(RuntimeError, match='retrying in') as error:
+            lazy_resources.get()
+        assert isinstance(error.value.__cause__, OSError)
+    assert loader.calls == 1 and not lazy_resources.loaded
+
+    # once the interval has passed the next request loads again, failing again if the problem persists
+    time.sleep(0.25)
+    with pytest.raises(OSError):
+        lazy_resources.get()
+    assert loader.calls == 2
+
+    time.sleep(0.25)
+    loader.fail = False
+    assert lazy_resources.get() is loader.resources
+    assert lazy_resources.get() is loader.resources
+    assert loader.calls == 3
+
+
+def test_concurrent_requests_after_a_failed_load_dont_retry_it(config, loader):
+    lazy_resources = LazyResources(dict(config, RESOURCES_RETRY_INTERVAL=60))
+    with pytest.raises(OSError):
+        lazy_resources.get()
+
+    errors = []
+
+    def request():
+        try:
+            lazy_resources.get()
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 8 and loader.calls == 1